@@ -0,0 +1,22 @@
+"""Gunicorn configuration."""
+import os
+import shutil
+
+# Worker processes write Prometheus metrics to files in this directory,
+# so that /metrics can aggregate them (see whatifstocks/metrics.py). Set
+# before the workers are forked, so that they all inherit it.
+os.environ.setdefault(
+    'prometheus_multiproc_dir', '/tmp/whatifstocks-prometheus')
+
+
+def on_starting(server):
+    """Start with no metrics left over from a previous run."""
+    multiproc_dir = os.environ['prometheus_multiproc_dir']
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    """Let a dead worker's metrics files be cleaned up."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,44 @@
+"""Add stock_yearly_price.year and a covering (year, stock_id) index
+
+Revision ID: 3f1c2a9d7e54
+Revises: 9b09bf25cebb
+Create Date: 2026-10-18 09:12:44.103817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e54'
+down_revision = '9b09bf25cebb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'stock_yearly_price',
+        sa.Column('year', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE stock_yearly_price '
+        'SET year = CAST(EXTRACT(year FROM close_at) AS integer)')
+    op.alter_column('stock_yearly_price', 'year', nullable=False)
+
+    conn = op.get_bind()
+
+    if (
+            conn.dialect.name == 'postgresql' and
+            conn.dialect.server_version_info >= (11,)):
+        op.execute(
+            'CREATE INDEX _syp_year_sid_ix ON stock_yearly_price '
+            '(year, stock_id) INCLUDE (close_price)')
+    else:
+        op.create_index(
+            '_syp_year_sid_ix', 'stock_yearly_price',
+            ['year', 'stock_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('_syp_year_sid_ix', table_name='stock_yearly_price')
+    op.drop_column('stock_yearly_price', 'year')
@@ -0,0 +1,28 @@
+"""Add exchange.data_updated_at
+
+Revision ID: 5a9e3b71c2df
+Revises: b7e4d0c8a615
+Create Date: 2026-10-18 10:41:05.319960
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9e3b71c2df'
+down_revision = 'b7e4d0c8a615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'exchange',
+        sa.Column(
+            'data_updated_at', sa.DateTime(), nullable=False,
+            server_default=sa.func.now()))
+
+
+def downgrade():
+    op.drop_column('exchange', 'data_updated_at')
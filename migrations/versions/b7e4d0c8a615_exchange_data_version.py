@@ -0,0 +1,28 @@
+"""Add exchange.data_version
+
+Revision ID: b7e4d0c8a615
+Revises: 3f1c2a9d7e54
+Create Date: 2026-10-18 10:03:27.582214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d0c8a615'
+down_revision = '3f1c2a9d7e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'exchange',
+        sa.Column(
+            'data_version', sa.Integer(), nullable=False,
+            server_default='0'))
+
+
+def downgrade():
+    op.drop_column('exchange', 'data_version')
@@ -0,0 +1,28 @@
+"""Add monthly totals to stock_yearly_price
+
+Revision ID: c4d17a9e08f2
+Revises: e2f8a4c61b39
+Create Date: 2026-10-18 15:20:44.318702
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d17a9e08f2'
+down_revision = 'e2f8a4c61b39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('stock_yearly_price', sa.Column('close_months', sa.Integer(), nullable=True))
+    op.add_column('stock_yearly_price', sa.Column('close_price_count', sa.Integer(), nullable=True))
+    op.add_column('stock_yearly_price', sa.Column('close_price_sum', sa.Numeric(precision=16, scale=4), nullable=True))
+
+
+def downgrade():
+    op.drop_column('stock_yearly_price', 'close_price_sum')
+    op.drop_column('stock_yearly_price', 'close_price_count')
+    op.drop_column('stock_yearly_price', 'close_months')
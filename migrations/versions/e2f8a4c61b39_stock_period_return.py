@@ -0,0 +1,55 @@
+"""Add stock_period_return and exchange_dirty_year
+
+Revision ID: e2f8a4c61b39
+Revises: 5a9e3b71c2df
+Create Date: 2026-10-18 11:26:51.774102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f8a4c61b39'
+down_revision = '5a9e3b71c2df'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_period_return',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('exchange_id', sa.Integer(), nullable=False),
+    sa.Column('stock_id', sa.Integer(), nullable=False),
+    sa.Column('from_year', sa.Integer(), nullable=False),
+    sa.Column('to_year', sa.Integer(), nullable=False),
+    sa.Column('avg_close_price_from', sa.Numeric(precision=12, scale=4), nullable=False),
+    sa.Column('avg_close_price_to', sa.Numeric(precision=12, scale=4), nullable=False),
+    sa.Column('price_change_percent', sa.Numeric(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['exchange_id'], ['exchange.id'], ),
+    sa.ForeignKeyConstraint(['stock_id'], ['stock.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('exchange_id', 'from_year', 'to_year', 'rank', name='_spr_eid_years_rank_uc')
+    )
+    op.create_table('exchange_dirty_year',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('exchange_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['exchange_id'], ['exchange.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('_edy_eid_year_ix', 'exchange_dirty_year', ['exchange_id', 'year'], unique=False)
+
+    # Every year that already has prices needs its returns computed.
+    op.execute(
+        'INSERT INTO exchange_dirty_year (exchange_id, year) '
+        'SELECT DISTINCT stock.exchange_id, stock_yearly_price.year '
+        'FROM stock_yearly_price '
+        'JOIN stock ON stock.id = stock_yearly_price.stock_id')
+
+
+def downgrade():
+    op.drop_index('_edy_eid_year_ix', table_name='exchange_dirty_year')
+    op.drop_table('exchange_dirty_year')
+    op.drop_table('stock_period_return')
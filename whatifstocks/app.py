@@ -3,8 +3,10 @@ from flask import Flask, render_template
 
 from whatifstocks import commands
 from whatifstocks.assets import assets
+from whatifstocks.benchmarks.commands import benchmark as benchmark_cmds
 from whatifstocks.extensions import (db, debug_toolbar, mail, mailgun,
-                                     migrate)
+                                     metrics, migrate, result_cache,
+                                     slow_query_log)
 from whatifstocks.public.views import blueprint as public_bp
 from whatifstocks.settings import ProdConfig
 from whatifstocks.stockanalysis.commands import stockanalysis as stockanalysis_cmds
@@ -40,6 +42,12 @@ def register_extensions(app):
     db.init_app(app)
     debug_toolbar.init_app(app)
     migrate.init_app(app, db)
+    result_cache.init_app(app)
+    metrics.init_app(app)
+    slow_query_log.init_app(app)
+
+    if app.config['METRICS_ENABLED']:
+        metrics.watch_cache('result', result_cache)
 
     return None
 
@@ -126,3 +134,4 @@ def register_commands(app):
     app.cli.add_command(commands.urls)
 
     app.cli.add_command(stockanalysis_cmds)
+    app.cli.add_command(benchmark_cmds)
@@ -0,0 +1 @@
+"""Benchmarks, and the synthetic market data they run against."""
@@ -0,0 +1,267 @@
+"""Click commands for benchmarks."""
+from datetime import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+import click
+from flask import current_app as app
+from flask.cli import with_appcontext
+
+from whatifstocks.benchmarks.datagen import SyntheticMarket
+from whatifstocks.benchmarks.downloads import (bench_download,
+                                               download_scenarios,
+                                               ticker_symbols)
+from whatifstocks.benchmarks.stubserver import StubAlphaVantageServer
+from whatifstocks.benchmarks.suite import (compare_results, git_commit,
+                                           run_benchmarks)
+
+
+def comma_separated(cast, minimum):
+    """Click callback parsing a comma-separated list of numbers."""
+    def parse(ctx, param, value):
+        try:
+            values = [cast(v) for v in value.split(',') if v.strip()]
+        except ValueError:
+            values = []
+
+        if not values or min(values) < minimum:
+            raise click.BadParameter(
+                'must be a comma-separated list of numbers, each at '
+                'least {0}'.format(minimum))
+
+        return values
+
+    return parse
+
+
+@click.group()
+def benchmark():
+    """Benchmark stock analysis."""
+    pass
+
+
+@benchmark.command()
+@click.option('--sizes', default='100,1000,5000',
+              callback=comma_separated(int, 1),
+              help='Comma-separated numbers of stocks per exchange')
+@click.option('--years', type=int, default=20,
+              help='Years of prices per stock')
+@click.option('--sectors', type=int, default=10,
+              help='Number of industry sectors')
+@click.option('--exchanges', type=int, default=1,
+              help='Number of exchanges')
+@click.option('--repeat', type=int, default=3,
+              help='Timed runs of each benchmark')
+@click.option('--seed', type=int, default=0,
+              help='Seed of the synthetic data')
+@click.option('--portfolios', type=int, default=10000,
+              help='Random portfolios per backtest')
+@click.option('--keep-data', default=False, is_flag=True,
+              help="Don't delete the synthetic data afterwards")
+@click.option('--output-file', type=click.File('w'), default='-',
+              help='JSON output file (default: stdout)')
+@with_appcontext
+def run(sizes, years, sectors, exchanges, repeat, seed, portfolios,
+        keep_data, output_file):
+    """Run benchmarks against synthetic data in the DB.
+
+    Creates, and afterwards deletes, exchanges whose symbols start with
+    BENCH, and sectors whose titles do.
+    """
+    def log(msg):
+        click.echo(msg, err=True)
+
+    results = run_benchmarks(
+        app, sizes, num_years=years, num_sectors=sectors,
+        num_exchanges=exchanges, repeat=repeat, seed=seed,
+        keep_data=keep_data, num_portfolios=portfolios, log=log)
+
+    json.dump(results, output_file, indent=2, sort_keys=True)
+    output_file.write('\n')
+
+
+@benchmark.command()
+@click.option('--output-dir', prompt=True,
+              help='Directory to write CSV files to')
+@click.option('--stocks', type=int, default=1000,
+              help='Stocks per exchange')
+@click.option('--years', type=int, default=20,
+              help='Years of prices per stock')
+@click.option('--sectors', type=int, default=10,
+              help='Number of industry sectors')
+@click.option('--exchanges', type=int, default=1,
+              help='Number of exchanges')
+@click.option('--seed', type=int, default=0,
+              help='Seed of the synthetic data')
+@click.option('--db', 'to_db', default=False, is_flag=True,
+              help='Also create the synthetic data in the DB')
+@with_appcontext
+def generate(output_dir, stocks, years, sectors, exchanges, seed, to_db):
+    """Write synthetic company info and monthly prices CSV files."""
+    market = SyntheticMarket(
+        num_exchanges=exchanges, stocks_per_exchange=stocks,
+        num_years=years, num_sectors=sectors, seed=seed)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    for exchange_index in range(exchanges):
+        symbol = market.exchange_symbol(exchange_index)
+
+        with open(os.path.join(
+                output_dir, '{0}-company.csv'.format(symbol)), 'wb') as f:
+            market.write_company_csv(f, exchange_index)
+
+        with open(os.path.join(
+                output_dir, '{0}-prices.csv'.format(symbol)), 'wb') as f:
+            market.write_monthly_prices_csv(f, exchange_index)
+
+    if to_db:
+        market.delete_from_db()
+        market.create_in_db()
+
+    click.echo('Done!')
+
+
+@benchmark.command()
+@click.argument('old_file', type=click.File('r'))
+@click.argument('new_file', type=click.File('r'))
+@click.option('--threshold', type=float, default=None,
+              help='Exit with an error if any median is this many times '
+                   'slower')
+def compare(old_file, new_file, threshold):
+    """Compare the median times of two benchmark results files."""
+    comparison = compare_results(json.load(old_file), json.load(new_file))
+    is_regression = False
+
+    for name, num_stocks, old_median, new_median, ratio in comparison:
+        is_slower = threshold is not None and ratio > threshold
+        is_regression = is_regression or is_slower
+        click.echo(
+            '{0:<24} {1:>8} {2:>10.4f}s {3:>10.4f}s {4:>7.2f}x{5}'.format(
+                name, num_stocks, old_median, new_median, ratio,
+                is_slower and '  SLOWER' or ''))
+
+    if is_regression:
+        sys.exit(1)
+
+
+@benchmark.command()
+@click.option('--host', default='127.0.0.1', help='Host to listen on')
+@click.option('--port', type=int, default=8765, help='Port to listen on')
+@click.option('--requests-per-minute', type=int, default=None,
+              help='Throttle API keys above this many requests per minute')
+@click.option('--latency', type=float, default=0.0,
+              help='Seconds to delay every response')
+@click.option('--latency-jitter', type=float, default=0.0,
+              help='Up to this many more seconds of random delay')
+@click.option('--error-rate', type=float, default=0.0,
+              help='Fraction of requests answered with an HTTP 503')
+@click.option('--unknown-rate', type=float, default=0.0,
+              help='Fraction of symbols answered with an "Error Message"')
+def stub_server(host, port, requests_per_minute, latency, latency_jitter,
+                error_rate, unknown_rate):
+    """Run a stub Alpha Vantage server until interrupted."""
+    server = StubAlphaVantageServer(
+        host=host, port=port, requests_per_minute=requests_per_minute,
+        latency=latency, latency_jitter=latency_jitter,
+        error_rate=error_rate, unknown_rate=unknown_rate)
+
+    click.echo('Set WHATIFSTOCKS_STOCKANALYSIS_MONTHLY_PRICES_URL_PATTERN='
+               "'{0}'".format(server.url_pattern))
+    server.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        click.echo(json.dumps(server.stats(), sort_keys=True))
+
+
+@benchmark.command()
+@click.option('--tickers', type=int, default=100,
+              help='Number of tickers to download in each scenario')
+@click.option('--workers', default='1,4,8', callback=comma_separated(int, 1),
+              help='Comma-separated numbers of download workers')
+@click.option('--requests-per-minute', default='300,600',
+              callback=comma_separated(float, 0),
+              help='Comma-separated client quotas (0 for no limit)')
+@click.option('--burst', default='1', callback=comma_separated(int, 1),
+              help='Comma-separated client token bucket capacities')
+@click.option('--stub/--no-stub', default=True,
+              help='Run a stub server, or download from the '
+                   'STOCKANALYSIS_MONTHLY_PRICES_URL_PATTERN setting')
+@click.option('--server-requests-per-minute', type=int, default=300,
+              help="Stub server's quota")
+@click.option('--latency', type=float, default=0.05,
+              help="Stub server's response delay in seconds")
+@click.option('--latency-jitter', type=float, default=0.05,
+              help="Stub server's random extra delay in seconds")
+@click.option('--error-rate', type=float, default=0.01,
+              help="Stub server's fraction of HTTP 503 responses")
+@click.option('--unknown-rate', type=float, default=0.01,
+              help="Stub server's fraction of unknown symbols")
+@click.option('--backoff-base', type=float, default=None,
+              help='Retry backoff base in seconds')
+@click.option('--output-file', type=click.File('w'), default='-',
+              help='JSON output file (default: stdout)')
+@with_appcontext
+def downloads(tickers, workers, requests_per_minute, burst, stub,
+              server_requests_per_minute, latency, latency_jitter,
+              error_rate, unknown_rate, backoff_base, output_file):
+    """Measure downloader throughput under different quota settings."""
+    server = None
+    url_pattern = app.config['STOCKANALYSIS_MONTHLY_PRICES_URL_PATTERN']
+
+    if stub:
+        server = StubAlphaVantageServer(
+            requests_per_minute=server_requests_per_minute, latency=latency,
+            latency_jitter=latency_jitter, error_rate=error_rate,
+            unknown_rate=unknown_rate).start()
+        url_pattern = server.url_pattern
+
+    if backoff_base is None:
+        backoff_base = app.config['STOCKANALYSIS_DOWNLOAD_BACKOFF_BASE']
+
+    results = []
+
+    try:
+        for scenario in download_scenarios(
+                workers, requests_per_minute, burst):
+            result = bench_download(
+                url_pattern, app.config['STOCKANALYSIS_ALPHAVANTAGE_APIKEY'],
+                'BENCH', ticker_symbols(tickers), scenario,
+                max_tries=app.config['STOCKANALYSIS_DOWNLOAD_MAX_TRIES'],
+                backoff_base=backoff_base,
+                backoff_max=app.config['STOCKANALYSIS_DOWNLOAD_BACKOFF_MAX'],
+                server=server)
+            results.append(result)
+            click.echo(
+                '{workers} workers, {requests_per_minute:g}/min, burst '
+                '{burst}: {tickers_per_sec:.2f} tickers/sec, '
+                '{num_retries} retries, {num_failed} failed, '
+                '{wall_secs:.1f}s'.format(**result), err=True)
+    finally:
+        if server is not None:
+            server.stop()
+
+    json.dump({
+        'meta': {
+            'git_commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'python_version': platform.python_version(),
+            'url_pattern': url_pattern,
+            'stub_server': stub and {
+                'requests_per_minute': server_requests_per_minute,
+                'latency': latency,
+                'latency_jitter': latency_jitter,
+                'error_rate': error_rate,
+                'unknown_rate': unknown_rate} or None},
+        'results': results}, output_file, indent=2, sort_keys=True)
+    output_file.write('\n')
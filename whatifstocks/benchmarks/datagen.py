@@ -0,0 +1,183 @@
+"""Deterministic synthetic market data for benchmarks."""
+from datetime import date
+import math
+import random
+
+import unicodecsv as csv
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.importers import bulk_import_monthly_prices
+from whatifstocks.stockanalysis.models import (Exchange, ExchangeDirtyYear,
+                                               IndustrySector, Stock,
+                                               StockPeriodReturn,
+                                               StockYearlyPrice)
+
+COMPANY_CSV_FIELDS = ('ticker_symbol', 'title', 'sector')
+MONTHLY_PRICE_CSV_FIELDS = ('ticker_symbol', 'close_at', 'close_price')
+
+
+class SyntheticMarket(object):
+    """Exchanges of stocks with random-walk monthly prices.
+
+    Everything is derived from ``seed``, and each stock's prices from its
+    own random generator, so the same parameters always give the same
+    data. Some stocks list after ``first_year``, and some have zero
+    prices (which importers skip), like real data.
+
+    Exchange symbols and sector titles start with ``symbol_prefix``, so
+    that ``delete_from_db`` can find everything the market created.
+    """
+
+    def __init__(self, num_exchanges=1, stocks_per_exchange=100,
+                 first_year=1998, num_years=20, num_sectors=10, seed=0,
+                 symbol_prefix='BENCH'):
+        self.num_exchanges = num_exchanges
+        self.stocks_per_exchange = stocks_per_exchange
+        self.first_year = first_year
+        self.num_years = num_years
+        self.num_sectors = num_sectors
+        self.seed = seed
+        self.symbol_prefix = symbol_prefix
+
+    @property
+    def last_year(self):
+        return self.first_year + self.num_years - 1
+
+    def exchange_symbol(self, exchange_index):
+        return '{0}{1}'.format(self.symbol_prefix, exchange_index)
+
+    def sector_title(self, sector_index):
+        return '{0} sector {1}'.format(self.symbol_prefix, sector_index)
+
+    def ticker_symbol(self, stock_index):
+        return 'S{0:06d}'.format(stock_index)
+
+    def _random(self, exchange_index, stock_index):
+        return random.Random(
+            (self.seed * 1000003 + exchange_index) * 1000003 + stock_index)
+
+    def company_rows(self, exchange_index):
+        """Company info rows, as read by ``import_stocks``."""
+        for stock_index in range(self.stocks_per_exchange):
+            rng = self._random(exchange_index, stock_index)
+
+            yield {
+                'ticker_symbol': self.ticker_symbol(stock_index),
+                'title': 'Synthetic Company {0}-{1}'.format(
+                    exchange_index, stock_index),
+                'sector': self.sector_title(
+                    rng.randrange(self.num_sectors))}
+
+    def monthly_price_rows(self, exchange_index):
+        """Monthly price rows, grouped by ticker symbol and in date order."""
+        for stock_index in range(self.stocks_per_exchange):
+            rng = self._random(exchange_index, stock_index)
+            # Same draw as in company_rows, to keep the streams in step.
+            rng.randrange(self.num_sectors)
+
+            listed_year = self.first_year
+
+            if rng.random() < 0.3:
+                listed_year += rng.randrange(self.num_years)
+
+            price = math.exp(rng.uniform(-1.0, 5.0))
+            drift = rng.gauss(0.005, 0.01)
+            volatility = rng.uniform(0.02, 0.15)
+            ticker_symbol = self.ticker_symbol(stock_index)
+
+            for year in range(listed_year, self.last_year + 1):
+                for month in range(1, 13):
+                    price *= math.exp(rng.gauss(drift, volatility))
+                    price = min(max(price, 0.0001), 99999999.0)
+                    is_missing = rng.random() < 0.01
+
+                    yield {
+                        'ticker_symbol': ticker_symbol,
+                        'close_at': date(year, month, 28).isoformat(),
+                        'close_price': (
+                            is_missing and '0.0000' or
+                            '{0:.4f}'.format(price))}
+
+    def write_company_csv(self, f, exchange_index):
+        """Write an exchange's company info CSV to a binary file."""
+        writer = csv.DictWriter(f, COMPANY_CSV_FIELDS, encoding='utf-8')
+        writer.writeheader()
+        writer.writerows(self.company_rows(exchange_index))
+
+    def write_monthly_prices_csv(self, f, exchange_index):
+        """Write an exchange's monthly prices CSV to a binary file."""
+        writer = csv.DictWriter(
+            f, MONTHLY_PRICE_CSV_FIELDS, encoding='utf-8')
+        writer.writeheader()
+        writer.writerows(self.monthly_price_rows(exchange_index))
+
+    def create_exchange(self, exchange_index):
+        """Create an exchange with no stocks."""
+        return Exchange.create(
+            exchange_symbol=self.exchange_symbol(exchange_index),
+            title='Synthetic exchange {0}'.format(exchange_index))
+
+    def create_in_db(self, batch_size=10000, with_prices=True):
+        """Create the market's exchanges, sectors, stocks and prices.
+
+        Returns the exchanges created.
+        """
+        sectors = [
+            IndustrySector.create(title=self.sector_title(i))
+            for i in range(self.num_sectors)]
+        sectors_by_title = {s.title: s for s in sectors}
+        exchanges = []
+
+        for exchange_index in range(self.num_exchanges):
+            exch = self.create_exchange(exchange_index)
+            db.session.bulk_insert_mappings(Stock, [
+                {'exchange_id': exch.id,
+                 'ticker_symbol': row['ticker_symbol'],
+                 'title': row['title'],
+                 'industry_sector_id': sectors_by_title[row['sector']].id}
+                for row in self.company_rows(exchange_index)])
+            db.session.commit()
+
+            if with_prices:
+                bulk_import_monthly_prices(
+                    exch, self.monthly_price_rows(exchange_index),
+                    batch_size=batch_size)
+
+            exch.bump_data_version()
+            exchanges.append(exch)
+
+        return exchanges
+
+    def delete_from_db(self):
+        """Delete everything created by any market with this prefix."""
+        exchange_ids = [
+            exch_id for exch_id, in (
+                db.session.query(Exchange.id)
+                          .filter(Exchange.exchange_symbol.like(
+                              self.symbol_prefix + '%')))]
+
+        if exchange_ids:
+            stock_ids = (
+                db.session.query(Stock.id)
+                          .filter(Stock.exchange_id.in_(exchange_ids))
+                          .subquery())
+
+            for model, criterion in (
+                    (StockPeriodReturn,
+                     StockPeriodReturn.exchange_id.in_(exchange_ids)),
+                    (ExchangeDirtyYear,
+                     ExchangeDirtyYear.exchange_id.in_(exchange_ids)),
+                    (StockYearlyPrice,
+                     StockYearlyPrice.stock_id.in_(stock_ids)),
+                    (Stock, Stock.exchange_id.in_(exchange_ids)),
+                    (Exchange, Exchange.id.in_(exchange_ids))):
+                (model.query
+                      .filter(criterion)
+                      .delete(synchronize_session=False))
+
+        (IndustrySector.query
+                       .filter(IndustrySector.title.like(
+                           self.symbol_prefix + ' sector %'))
+                       .delete(synchronize_session=False))
+
+        db.session.commit()
@@ -0,0 +1,67 @@
+"""Throughput benchmark of the monthly prices downloader."""
+import itertools
+import timeit
+
+from whatifstocks.stockanalysis.downloader import MonthlyPricesDownloader
+
+
+def download_scenarios(workers, requests_per_minute, bursts):
+    """Every combination of workers, quota and burst, as dicts."""
+    return [
+        {'workers': w, 'requests_per_minute': rpm, 'burst': burst}
+        for w, rpm, burst in itertools.product(
+            workers, requests_per_minute, bursts)]
+
+
+def ticker_symbols(num_tickers):
+    return ['T{0:05d}'.format(i) for i in range(num_tickers)]
+
+
+def bench_download(url_pattern, apikey, exchange_symbol, tickers, scenario,
+                   max_tries=5, backoff_base=1.0, backoff_max=60.0,
+                   timeout=30.0, server=None):
+    """Download all tickers under one scenario, and measure it.
+
+    With a stub ``server``, its stats are reset first and included.
+    Returns a JSON-serializable result dict.
+    """
+    if server is not None:
+        server.reset()
+
+    downloader = MonthlyPricesDownloader(
+        url_pattern, apikey, exchange_symbol,
+        workers=scenario['workers'],
+        requests_per_minute=scenario['requests_per_minute'],
+        burst=scenario['burst'], max_tries=max_tries,
+        backoff_base=backoff_base, backoff_max=backoff_max,
+        timeout=timeout)
+
+    num_ok = 0
+    num_failed = 0
+    num_tries = 0
+    start = timeit.default_timer()
+
+    for result in downloader.download(tickers):
+        num_tries += result.tries
+
+        if result.error:
+            num_failed += 1
+        else:
+            num_ok += 1
+
+    wall_secs = timeit.default_timer() - start
+    result = dict(
+        scenario,
+        num_tickers=len(tickers),
+        num_ok=num_ok,
+        num_failed=num_failed,
+        num_requests=num_tries,
+        num_retries=num_tries - len(tickers),
+        wall_secs=wall_secs,
+        tickers_per_sec=num_ok / wall_secs,
+        requests_per_sec=num_tries / wall_secs)
+
+    if server is not None:
+        result['server'] = server.stats()
+
+    return result
@@ -0,0 +1,225 @@
+"""Local stub of the Alpha Vantage monthly prices API, for benchmarks."""
+from collections import deque
+from datetime import date
+import json
+import math
+import random
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+from whatifstocks.stockanalysis.downloader import (
+    ALPHAVANTAGE_ERROR_KEY, ALPHAVANTAGE_MONTHLY_PRICES_KEY)
+
+MONTHLY_PRICES_FUNCTION = 'TIME_SERIES_MONTHLY_ADJUSTED'
+
+THROTTLE_NOTE = (
+    'Thank you for using Alpha Vantage! Our standard API call frequency '
+    'is 5 calls per minute and 500 calls per day. Please visit '
+    'https://www.alphavantage.co/premium/ if you would like to have a '
+    'higher API call volume.')
+
+INVALID_CALL_MESSAGE = (
+    'Invalid API call. Please retry or visit the documentation '
+    '(https://www.alphavantage.co/documentation/) for '
+    'TIME_SERIES_MONTHLY_ADJUSTED.')
+
+
+def monthly_prices_json(symbol, first_year, last_year):
+    """Deterministic ``TIME_SERIES_MONTHLY_ADJUSTED`` response for a symbol."""
+    rng = random.Random(zlib.crc32(symbol.encode('utf-8')))
+    price = math.exp(rng.uniform(-1.0, 5.0))
+    drift = rng.gauss(0.005, 0.01)
+    volatility = rng.uniform(0.02, 0.15)
+    series = {}
+
+    for year in range(first_year, last_year + 1):
+        for month in range(1, 13):
+            price = min(
+                max(price * math.exp(rng.gauss(drift, volatility)), 0.0001),
+                99999999.0)
+            close = '{0:.4f}'.format(price)
+            series[date(year, month, 28).isoformat()] = {
+                '1. open': close,
+                '2. high': close,
+                '3. low': close,
+                '4. close': close,
+                '5. adjusted close': close,
+                '6. volume': str(rng.randrange(1000, 10000000)),
+                '7. dividend amount': '0.0000'}
+
+    return {
+        'Meta Data': {
+            '1. Information': 'Monthly Adjusted Prices and Volumes',
+            '2. Symbol': symbol,
+            '3. Last Refreshed': date(last_year, 12, 28).isoformat(),
+            '4. Time Zone': 'US/Eastern'},
+        ALPHAVANTAGE_MONTHLY_PRICES_KEY: series}
+
+
+class StubAlphaVantageServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server that answers like Alpha Vantage.
+
+    Every request is delayed by ``latency`` plus up to ``latency_jitter``
+    seconds. More than ``requests_per_minute`` requests in any 60 seconds
+    (per API key) get the "higher API call volume" throttle note. A
+    fraction ``error_rate`` of requests get an HTML 503 error, and a
+    fraction ``unknown_rate`` of symbols get an "Error Message" response,
+    as for a symbol Alpha Vantage doesn't know.
+
+    ``stats()`` counts requests by outcome. Port 0 picks a free port.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, requests_per_minute=None,
+                 latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                 unknown_rate=0.0, first_year=1998, last_year=2017, seed=0,
+                 clock=time.time, sleep=time.sleep):
+        HTTPServer.__init__(self, (host, port), StubAlphaVantageHandler)
+        self.requests_per_minute = requests_per_minute
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.unknown_rate = unknown_rate
+        self.first_year = first_year
+        self.last_year = last_year
+        self.seed = seed
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._request_times = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url_pattern(self):
+        """URL pattern to use as the monthly prices URL pattern setting."""
+        host, port = self.server_address[:2]
+        return (
+            'http://{0}:{1}/query?function={2}&symbol={{0}}.{{1}}&'
+            'apikey={{2}}').format(host, port, MONTHLY_PRICES_FUNCTION)
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self):
+        """Clear the stats and the quota windows."""
+        with self._lock:
+            self._stats.clear()
+            self._request_times.clear()
+
+    def _count(self, outcome):
+        self._stats[outcome] = self._stats.get(outcome, 0) + 1
+
+    def is_symbol_unknown(self, symbol):
+        rng = random.Random(zlib.crc32(
+            '{0}:{1}'.format(self.seed, symbol).encode('utf-8')))
+        return rng.random() < self.unknown_rate
+
+    def respond(self, query):
+        """Outcome and ``(status, content type, body)`` for a query."""
+        with self._lock:
+            delay = self.latency + self._random.uniform(
+                0.0, self.latency_jitter)
+            is_error = self._random.random() < self.error_rate
+
+        if delay:
+            self._sleep(delay)
+
+        function = query.get('function', [''])[0]
+        symbol = query.get('symbol', [''])[0]
+        apikey = query.get('apikey', [''])[0]
+
+        with self._lock:
+            self._count('requests')
+            now = self._clock()
+            request_times = self._request_times.setdefault(apikey, deque())
+
+            while request_times and request_times[0] <= now - 60.0:
+                request_times.popleft()
+
+            is_throttled = (
+                self.requests_per_minute and
+                len(request_times) >= self.requests_per_minute)
+
+            if not is_throttled:
+                request_times.append(now)
+
+            if is_error:
+                outcome = 'errors'
+            elif is_throttled:
+                outcome = 'throttled'
+            elif (
+                    function != MONTHLY_PRICES_FUNCTION or not symbol or
+                    self.is_symbol_unknown(symbol)):
+                outcome = 'unknown'
+            else:
+                outcome = 'ok'
+
+            self._count(outcome)
+
+        if outcome == 'errors':
+            return outcome, (
+                503, 'text/html',
+                '<html><body>503 Service Unavailable</body></html>')
+
+        if outcome == 'throttled':
+            body = {'Note': THROTTLE_NOTE}
+        elif outcome == 'unknown':
+            body = {ALPHAVANTAGE_ERROR_KEY: INVALID_CALL_MESSAGE}
+        else:
+            body = monthly_prices_json(
+                symbol, self.first_year, self.last_year)
+
+        return outcome, (200, 'application/json', json.dumps(body))
+
+
+class StubAlphaVantageHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path != '/query':
+            status, content_type, body = 404, 'text/plain', 'Not found'
+        else:
+            _, (status, content_type, body) = self.server.respond(
+                parse_qs(url.query))
+
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,362 @@
+"""Benchmarks of the ranking query, importers and home page."""
+from datetime import datetime
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import timeit
+
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+import unicodecsv as csv
+
+from whatifstocks.benchmarks.datagen import SyntheticMarket
+from whatifstocks.extensions import db, result_cache
+from whatifstocks.stockanalysis.commands import (_import_monthly_prices,
+                                                 import_stocks)
+from whatifstocks.stockanalysis.globalranking import iter_global_ranking
+from whatifstocks.stockanalysis.models import (Exchange, IndustrySector,
+                                               Stock, StockYearlyPrice)
+from whatifstocks.stockanalysis.queries import (
+    yeartoyear_price_percent_change_result)
+
+IMPORT_SYMBOL_PREFIX = 'BENCHIMPORT'
+
+# Benchmarks pass around exchange IDs rather than ORM objects, because the
+# app contexts of test requests and commands remove the DB session when
+# they end.
+
+
+def time_calls(func, repeat, setup=None):
+    """Time ``repeat`` calls of ``func``, running ``setup`` before each.
+
+    Returns the durations in seconds.
+    """
+    durations = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        start = timeit.default_timer()
+        func()
+        durations.append(timeit.default_timer() - start)
+
+    return durations
+
+
+def summarize(name, num_stocks, durations, **extra):
+    """A JSON-serializable result row for one benchmark at one size."""
+    ordered = sorted(durations)
+    result = {
+        'name': name,
+        'num_stocks': num_stocks,
+        'repeat': len(durations),
+        'times': durations,
+        'min': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'mean': sum(durations) / len(durations)}
+    result.update(extra)
+
+    return result
+
+
+def git_commit():
+    """Current git commit of the working directory, if known."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                stderr=devnull).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return os.environ.get('SOURCE_VERSION')
+
+
+def bench_ranking_result(exchange_id, market, repeat, light=False):
+    """Time the SQL ranking query over the widest year range.
+
+    With ``light``, rows are read as namedtuples instead of ORM instances.
+    """
+    num_rows = []
+
+    def run():
+        num_rows.append(len(yeartoyear_price_percent_change_result(
+            exchange_id, market.first_year, market.last_year,
+            light=light).all()))
+        db.session.expunge_all()
+
+    durations = time_calls(run, repeat)
+
+    return durations, {
+        'num_rows': num_rows[-1],
+        'rows_per_sec': num_rows[-1] / sorted(durations)[len(durations) // 2]}
+
+
+def bench_backtest(exchange_id, market, repeat, num_portfolios,
+                   num_holdings=10, rebalance=False):
+    """Time backtesting a batch of random portfolios over all years."""
+    # Imported here so that NumPy is only needed for backtests.
+    from whatifstocks.stockanalysis.backtest import (backtest,
+                                                     complete_stock_indexes,
+                                                     PortfolioBatch)
+    from whatifstocks.stockanalysis.pricematrix import PriceMatrix
+
+    matrix = PriceMatrix.load(exchange_id)
+    batch = PortfolioBatch.random(
+        complete_stock_indexes(matrix, market.first_year, market.last_year),
+        num_portfolios, num_holdings, seed=market.seed)
+
+    def run():
+        backtest(
+            matrix, batch, market.first_year, market.last_year,
+            rebalance=rebalance)
+
+    durations = time_calls(run, repeat)
+
+    return durations, {
+        'num_portfolios': num_portfolios,
+        'portfolios_per_sec': (
+            num_portfolios / sorted(durations)[len(durations) // 2])}
+
+
+def bench_risk_metrics(exchange_id, market, repeat):
+    """Time computing every stock's risk metrics and sorting by each."""
+    # Imported here so that NumPy is only needed for risk metrics.
+    from whatifstocks.stockanalysis.pricematrix import PriceMatrix
+    from whatifstocks.stockanalysis.queries import RANKING_SORT_FIELDS
+    from whatifstocks.stockanalysis.riskmetrics import (
+        RiskMetricTable, sort_risk_metric_table, window_risk_metrics)
+
+    matrix = PriceMatrix.load(exchange_id)
+
+    def run():
+        indexes, prices_from, prices_to, change_percent = (
+            matrix.price_change_percent(market.first_year, market.last_year))
+        cagr, volatility, max_drawdown = window_risk_metrics(
+            matrix, market.first_year, market.last_year)
+        table = RiskMetricTable(
+            matrix, indexes, prices_from, prices_to, change_percent,
+            cagr[indexes], volatility[indexes], max_drawdown[indexes])
+
+        for sort_field, _ in RANKING_SORT_FIELDS:
+            sort_risk_metric_table(table, sort_field)
+
+    return time_calls(run, repeat), {}
+
+
+def bench_global_ranking(exchange_ids, market, repeat, workers):
+    """Time ranking all the exchanges together, with a cold result cache."""
+    def run():
+        exchanges = Exchange.query.filter(Exchange.id.in_(exchange_ids)).all()
+
+        for _ in iter_global_ranking(
+                exchanges, market.first_year, market.last_year,
+                workers=workers):
+            pass
+
+    return time_calls(run, repeat, setup=result_cache.clear), {
+        'workers': workers}
+
+
+def bench_import_monthly_prices(exchange_id, prices_path, repeat):
+    """Time the row-by-row monthly prices importer."""
+    exchanges = []
+
+    def setup():
+        stock_ids = (
+            db.session.query(Stock.id)
+                      .filter(Stock.exchange_id == exchange_id)
+                      .subquery())
+        (StockYearlyPrice.query
+                         .filter(StockYearlyPrice.stock_id.in_(stock_ids))
+                         .delete(synchronize_session=False))
+        db.session.commit()
+        exchanges[:] = [Exchange.query.get(exchange_id)]
+
+    def run():
+        with open(prices_path, 'rb') as f:
+            _import_monthly_prices(
+                exchanges[0], csv.DictReader(f, encoding='utf-8-sig'))
+
+    return time_calls(run, repeat, setup=setup), {}
+
+
+def bench_import_stocks(app, market, repeat):
+    """Time the import_stocks command, into an exchange of its own."""
+    import_market = SyntheticMarket(
+        num_exchanges=1, stocks_per_exchange=market.stocks_per_exchange,
+        num_sectors=market.num_sectors, seed=market.seed,
+        symbol_prefix=IMPORT_SYMBOL_PREFIX)
+    import_market.delete_from_db()
+    exch = import_market.create_exchange(0)
+    exchange_id, exchange_symbol = exch.id, exch.exchange_symbol
+    tmp_dir = tempfile.mkdtemp()
+    company_path = os.path.join(tmp_dir, 'company.csv')
+
+    with open(company_path, 'wb') as f:
+        import_market.write_company_csv(f, 0)
+
+    runner = CliRunner()
+    script_info = ScriptInfo(create_app=lambda info: app)
+
+    def setup():
+        (Stock.query
+              .filter_by(exchange_id=exchange_id)
+              .delete(synchronize_session=False))
+        (IndustrySector.query
+                       .filter(IndustrySector.title.like(
+                           IMPORT_SYMBOL_PREFIX + ' sector %'))
+                       .delete(synchronize_session=False))
+        db.session.commit()
+
+    def run():
+        result = runner.invoke(
+            import_stocks,
+            ['--exchange-symbol', exchange_symbol,
+             '--company-info-file', company_path],
+            obj=script_info, catch_exceptions=False)
+
+        if result.exit_code:
+            raise RuntimeError(result.output)
+
+    try:
+        return time_calls(run, repeat, setup=setup), {}
+    finally:
+        import_market.delete_from_db()
+        shutil.rmtree(tmp_dir)
+
+
+def bench_home(app, exchange_symbol, market, repeat, limit=None):
+    """Time a full render of the home page, with a cold result cache."""
+    client = app.test_client()
+    url = '/?exchange_symbol={0}&from_year={1}&to_year={2}'.format(
+        exchange_symbol, market.first_year, market.last_year)
+
+    if limit is not None:
+        url += '&limit={0}'.format(limit)
+
+    def run():
+        response = client.get(url)
+        # Read the body, in case the page is streamed.
+        response.get_data()
+        response.close()
+
+        if response.status_code != 200:
+            raise RuntimeError(
+                'GET {0} returned {1}'.format(url, response.status_code))
+
+    # Untimed, so that compiling the template isn't counted.
+    run()
+
+    return time_calls(run, repeat, setup=result_cache.clear), {}
+
+
+def run_benchmarks(app, sizes, num_years=20, num_sectors=10,
+                   num_exchanges=1, repeat=3, seed=0, keep_data=False,
+                   num_portfolios=10000, log=None):
+    """Run every benchmark for each number of stocks per exchange.
+
+    Creates a synthetic market in the DB for each size, and deletes it
+    afterwards unless ``keep_data``. Returns a JSON-serializable dict.
+    """
+    log = log or (lambda msg: None)
+    results = []
+
+    for num_stocks in sizes:
+        market = SyntheticMarket(
+            num_exchanges=num_exchanges, stocks_per_exchange=num_stocks,
+            num_years=num_years, num_sectors=num_sectors, seed=seed)
+        market.delete_from_db()
+        tmp_dir = tempfile.mkdtemp()
+
+        try:
+            log('{0} stocks: generating data'.format(num_stocks))
+            exchanges = market.create_in_db()
+            exchange_ids = [e.id for e in exchanges]
+            exch = exchanges[0]
+            exchange_id, exchange_symbol = exch.id, exch.exchange_symbol
+            prices_path = os.path.join(tmp_dir, 'prices.csv')
+
+            with open(prices_path, 'wb') as f:
+                market.write_monthly_prices_csv(f, 0)
+
+            benchmarks = (
+                ('ranking_result',
+                 lambda: bench_ranking_result(exchange_id, market, repeat)),
+                ('ranking_result_light',
+                 lambda: bench_ranking_result(
+                     exchange_id, market, repeat, light=True)),
+                ('backtest',
+                 lambda: bench_backtest(
+                     exchange_id, market, repeat, num_portfolios)),
+                ('backtest_rebalanced',
+                 lambda: bench_backtest(
+                     exchange_id, market, repeat, num_portfolios,
+                     rebalance=True)),
+                ('risk_metrics',
+                 lambda: bench_risk_metrics(exchange_id, market, repeat)),
+                ('global_ranking',
+                 lambda: bench_global_ranking(
+                     exchange_ids, market, repeat,
+                     app.config['STOCKANALYSIS_GLOBAL_RANKING_WORKERS'])),
+                ('global_ranking_serial',
+                 lambda: bench_global_ranking(
+                     exchange_ids, market, repeat, 1)),
+                ('import_monthly_prices',
+                 lambda: bench_import_monthly_prices(
+                     exchange_id, prices_path, repeat)),
+                ('import_stocks',
+                 lambda: bench_import_stocks(app, market, repeat)),
+                ('home_page',
+                 lambda: bench_home(app, exchange_symbol, market, repeat)),
+                ('home_full',
+                 lambda: bench_home(
+                     app, exchange_symbol, market, repeat, limit=0)))
+
+            for name, bench in benchmarks:
+                durations, extra = bench()
+                results.append(summarize(name, num_stocks, durations, **extra))
+                log('{0} stocks: {1} median {2:.4f}s'.format(
+                    num_stocks, name, results[-1]['median']))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+            if not keep_data:
+                market.delete_from_db()
+
+    return {
+        'meta': {
+            'git_commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'python_version': platform.python_version(),
+            'db_dialect': db.engine.dialect.name,
+            'ranking_engine': app.config['STOCKANALYSIS_RANKING_ENGINE'],
+            'num_years': num_years,
+            'num_sectors': num_sectors,
+            'num_exchanges': num_exchanges,
+            'repeat': repeat,
+            'num_portfolios': num_portfolios,
+            'seed': seed},
+        'results': results}
+
+
+def compare_results(old, new):
+    """Ratios of new to old median times, for benchmarks in both runs.
+
+    Returns a list of ``(name, num_stocks, old_median, new_median, ratio)``
+    tuples.
+    """
+    old_medians = {
+        (r['name'], r['num_stocks']): r['median'] for r in old['results']}
+    comparison = []
+
+    for r in new['results']:
+        key = (r['name'], r['num_stocks'])
+
+        if key in old_medians:
+            comparison.append(key + (
+                old_medians[key], r['median'],
+                r['median'] / old_medians[key]))
+
+    return comparison
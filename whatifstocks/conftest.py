@@ -0,0 +1,53 @@
+"""Fixtures shared by the tests."""
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from whatifstocks.app import create_app
+from whatifstocks.extensions import db as _db, result_cache
+from whatifstocks.settings import TestConfig
+from whatifstocks.stockanalysis.rankingrows import industry_sector_cache
+
+
+def clear_caches():
+    # Imported here so that NumPy is only needed by the tests that use it.
+    from whatifstocks.stockanalysis.pricematrix import price_matrices
+
+    result_cache.clear()
+    price_matrices.clear()
+    industry_sector_cache.clear()
+
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app(TestConfig)
+
+
+@pytest.fixture
+def db(app, request):
+    """Empty tables in the test DB, dropped again after the test.
+
+    Skips the test if the DB set in ``WHATIFSTOCKS_TEST_DATABASE_URI``
+    can't be reached.
+    """
+    ctx = app.app_context()
+    ctx.push()
+
+    try:
+        _db.engine.connect().close()
+    except OperationalError as e:
+        ctx.pop()
+        pytest.skip('Test DB unavailable: {0}'.format(e))
+
+    _db.drop_all()
+    _db.create_all()
+    clear_caches()
+
+    def teardown():
+        _db.session.remove()
+        _db.drop_all()
+        clear_caches()
+        ctx.pop()
+
+    request.addfinalizer(teardown)
+
+    return _db
@@ -8,9 +8,15 @@ from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 from whatifstocks.mailgun_extension import Mailgun
+from whatifstocks.metrics import Metrics
+from whatifstocks.slowqueries import SlowQueryLog
+from whatifstocks.stockanalysis.cache import ResultCache
 
 db = SQLAlchemy()
 mail = Mail()
 mailgun = Mailgun()
 migrate = Migrate()
 debug_toolbar = DebugToolbarExtension()
+result_cache = ResultCache()
+metrics = Metrics()
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,155 @@
+"""Prometheus metrics for requests, SQL, template rendering and caches.
+
+With several worker processes (e.g. gunicorn ``-w 3``), set the
+``prometheus_multiproc_dir`` environment variable to an empty directory
+before the workers start. Each worker then writes its metrics to files
+there, and ``/metrics`` aggregates all of them, whichever worker serves it.
+"""
+import os
+import timeit
+
+from flask import (before_render_template, g, has_request_context, request,
+                   Response, template_rendered)
+from prometheus_client import (CollectorRegistry, CONTENT_TYPE_LATEST,
+                               Counter, generate_latest, Histogram,
+                               multiprocess, REGISTRY)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MULTIPROC_DIR_ENV_VAR = 'prometheus_multiproc_dir'
+
+SQL_STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REQUEST_DURATION = Histogram(
+    'whatifstocks_request_duration_seconds',
+    'Time to handle a request, including streaming the response.',
+    ['endpoint', 'method', 'status'])
+REQUEST_SQL_STATEMENTS = Histogram(
+    'whatifstocks_request_sql_statements',
+    'SQL statements executed per request.',
+    ['endpoint'], buckets=SQL_STATEMENT_BUCKETS)
+REQUEST_SQL_DURATION = Histogram(
+    'whatifstocks_request_sql_duration_seconds',
+    'Total time spent executing SQL statements per request.',
+    ['endpoint'])
+SQL_STATEMENTS = Counter(
+    'whatifstocks_sql_statements_total',
+    'SQL statements executed, in or outside of requests.')
+TEMPLATE_RENDER_DURATION = Histogram(
+    'whatifstocks_template_render_seconds',
+    'Time to render a template.',
+    ['template'])
+CACHE_EVENTS = Counter(
+    'whatifstocks_cache_events_total',
+    'Cache hits, misses and evictions.',
+    ['cache', 'event'])
+
+
+def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(
+        timeit.default_timer())
+
+
+def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    duration = timeit.default_timer() - conn.info['metrics_query_start'].pop()
+    SQL_STATEMENTS.inc()
+
+    if has_request_context() and hasattr(g, 'metrics_sql_statements'):
+        g.metrics_sql_statements += 1
+        g.metrics_sql_secs += duration
+
+
+def _before_render_template(sender, template, context, **extra):
+    if has_request_context():
+        g.metrics_render_start = timeit.default_timer()
+
+
+def _template_rendered(sender, template, context, **extra):
+    start = has_request_context() and g.pop('metrics_render_start', None)
+
+    if start:
+        TEMPLATE_RENDER_DURATION.labels(template.name or '').observe(
+            timeit.default_timer() - start)
+
+
+class Metrics(object):
+    """Flask extension that records metrics and serves ``/metrics``."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._watched_caches = set()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['metrics'] = self
+
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        if not event.contains(
+                Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(
+                Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(
+                Engine, 'after_cursor_execute', _after_cursor_execute)
+
+        before_render_template.connect(_before_render_template, app)
+        template_rendered.connect(_template_rendered, app)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule(
+            app.config['METRICS_PATH'], 'metrics', self.metrics_view)
+
+    def watch_cache(self, name, cache):
+        """Count a cache's hits, misses and evictions."""
+        if (name, id(cache)) in self._watched_caches:
+            return
+
+        self._watched_caches.add((name, id(cache)))
+
+        def listener(cache_event):
+            CACHE_EVENTS.labels(name, cache_event).inc()
+
+        cache.add_listener(listener)
+
+    def _before_request(self):
+        g.metrics_request_start = timeit.default_timer()
+        g.metrics_sql_statements = 0
+        g.metrics_sql_secs = 0.0
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        # Streamed responses tear down once streaming ends.
+        start = g.pop('metrics_request_start', None)
+
+        if start is None:
+            return
+
+        endpoint = request.endpoint or 'none'
+        status = exc is not None and 500 or g.get('metrics_status', 500)
+        REQUEST_DURATION.labels(endpoint, request.method, status).observe(
+            timeit.default_timer() - start)
+        REQUEST_SQL_STATEMENTS.labels(endpoint).observe(
+            g.metrics_sql_statements)
+        REQUEST_SQL_DURATION.labels(endpoint).observe(g.metrics_sql_secs)
+
+    def metrics_view(self):
+        """Metrics in the Prometheus text format."""
+        if os.environ.get(MULTIPROC_DIR_ENV_VAR):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+
+        return Response(
+            generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -1,12 +1,73 @@
 """Public section, including homepage."""
-from flask import abort, Blueprint, render_template, request
+import hashlib
+import itertools
+
+from flask import (abort, Blueprint, current_app as app, make_response,
+                   render_template, request, Response, stream_with_context)
 
 from whatifstocks.stockanalysis.models import Exchange
-from whatifstocks.stockanalysis.queries import yeartoyear_price_percent_change_result
+from whatifstocks.stockanalysis.queries import (
+    iter_yeartoyear_price_percent_change_ranking, RANKING_SORT_FIELDS,
+    RankingCursor, yeartoyear_price_percent_change_ranking,
+    yeartoyear_sector_rollups)
+from whatifstocks.utils import stream_template
 
 
 blueprint = Blueprint('public', __name__, static_folder='../static')
 
+RANKING_SORT_TITLES = {
+    'price_change_percent': 'Change',
+    'cagr_percent': 'CAGR',
+    'volatility_percent': 'Volatility',
+    'max_drawdown_percent': 'Max drawdown'}
+
+
+def _home_etag(exchanges, exch, from_year, to_year, limit, cursor,
+               sort_field, show_metrics):
+    """Strong ETag for the home page, from the data it depends on."""
+    etag_parts = [app.config['ETAG_SALT']]
+    etag_parts.extend(
+        '{0}:{1}:{2}:{3}'.format(
+            e.id, e.exchange_symbol, e.title, e.data_version)
+        for e in exchanges)
+    etag_parts.append('{0}:{1}:{2}:{3}:{4}:{5}:{6}'.format(
+        exch and exch.exchange_symbol, from_year, to_year, limit,
+        cursor and cursor.encode(), sort_field, show_metrics))
+
+    return hashlib.sha1(
+        '|'.join(etag_parts).encode('utf-8')).hexdigest()
+
+
+def _is_not_modified(etag, last_modified):
+    """Whether the request's conditional headers match the current page."""
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since.
+        return request.if_none_match.contains(etag)
+
+    if request.if_modified_since and last_modified:
+        return (
+            last_modified.replace(microsecond=0) <=
+            request.if_modified_since.replace(tzinfo=None))
+
+    return False
+
+
+def _set_cache_headers(response, etag, last_modified):
+    response.set_etag(etag)
+
+    if last_modified:
+        response.last_modified = last_modified
+
+    response.cache_control.public = True
+    max_age = app.config['PUBLIC_HOME_CACHE_MAX_AGE']
+
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+
+    return response
+
 
 @blueprint.route('/')
 def home():
@@ -15,10 +76,19 @@ def home():
     from_year = None
     to_year = None
     yeartoyear_price_percent_changes = None
+    risk_metrics = None
+    sector_rollups = None
+    limit = app.config['PUBLIC_HOME_PAGE_SIZE']
+    cursor = None
+    next_cursor = None
+    sort_field = RANKING_SORT_FIELDS[0][0]
 
     exchange_symbol_raw = request.args.get('exchange_symbol')
     from_year_raw = request.args.get('from_year')
     to_year_raw = request.args.get('to_year')
+    limit_raw = request.args.get('limit')
+    cursor_raw = request.args.get('cursor')
+    sort_raw = request.args.get('sort')
 
     exchanges = Exchange.query.all()
     exchanges_by_symbol = {e.exchange_symbol: e for e in exchanges}
@@ -39,16 +109,109 @@ def home():
         else:
             abort(404)
 
-        exchange_id = exch.id
+        if limit_raw:
+            try:
+                limit = int(limit_raw)
+            except ValueError:
+                abort(404)
 
-        yeartoyear_price_percent_changes = yeartoyear_price_percent_change_result(
-            exchange_id, from_year, to_year)
+            if limit < 0:
+                abort(404)
+
+        if cursor_raw:
+            try:
+                cursor = RankingCursor.decode(cursor_raw)
+            except ValueError:
+                abort(404)
+
+        if sort_raw:
+            if sort_raw not in dict(RANKING_SORT_FIELDS):
+                abort(404)
+
+            sort_field = sort_raw
+
+    # Risk metrics are shown when asked for, or when sorting by one.
+    show_metrics = bool(exch and (
+        request.args.get('metrics') == '1' or
+        sort_field != RANKING_SORT_FIELDS[0][0]))
+
+    # Answer conditional requests before running the ranking query.
+    etag = _home_etag(
+        exchanges, exch, from_year, to_year, limit, cursor, sort_field,
+        show_metrics)
+    last_modified = (
+        exchanges and max(e.data_updated_at for e in exchanges) or None)
+
+    if _is_not_modified(etag, last_modified):
+        return _set_cache_headers(
+            make_response('', 304), etag, last_modified)
+
+    rank_offset = cursor and cursor.rank or 0
+    is_streamed = bool(
+        exch and not limit and not show_metrics and
+        app.config['PUBLIC_HOME_STREAM_ALL'])
+
+    if exch:
+        sector_rollups = yeartoyear_sector_rollups(exch, from_year, to_year)
+
+    if is_streamed:
+        rows = iter_yeartoyear_price_percent_change_ranking(
+            exch, from_year, to_year, cursor=cursor)
+        first_row = next(rows, None)
+
+        # The template only shows the table if there are rows.
+        if first_row is not None:
+            yeartoyear_price_percent_changes = itertools.chain(
+                [first_row], rows)
+    elif show_metrics:
+        # Imported here so that NumPy is only needed for risk metrics.
+        from whatifstocks.stockanalysis.riskmetrics import (
+            risk_metric_ranking)
+
+        # Pages of the in-memory ranking are cut at the cursor's rank.
+        yeartoyear_price_percent_changes, risk_metrics = risk_metric_ranking(
+            exch, from_year, to_year, sort_field=sort_field, limit=limit,
+            offset=rank_offset,
+            snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+    elif exch:
+        yeartoyear_price_percent_changes = yeartoyear_price_percent_change_ranking(
+            exch, from_year, to_year, limit=limit, cursor=cursor)
+
+    # Rankings are only streamed without a limit.
+    if exch and limit and len(yeartoyear_price_percent_changes) == limit:
+        next_cursor = RankingCursor.after_row(
+            yeartoyear_price_percent_changes[-1], rank_offset + limit)
 
     template_vars = {
         'exchanges': exchanges,
         'exchange': exch,
         'from_year': from_year,
         'to_year': to_year,
+        'limit': limit,
+        'rank_offset': rank_offset,
+        'next_cursor': next_cursor,
+        'sort_field': sort_field,
+        'sort_fields': [f for f, _ in RANKING_SORT_FIELDS],
+        'sort_titles': RANKING_SORT_TITLES,
+        'show_metrics': show_metrics,
+        'risk_metrics': risk_metrics,
+        'sector_rollups': sector_rollups,
         'yeartoyear_price_percent_changes': yeartoyear_price_percent_changes}
 
-    return render_template('public/home.html', **template_vars)
+    if is_streamed:
+        def generate():
+            # Close the DB cursor while the request context is still
+            # around, even if the client goes away before the end.
+            try:
+                for chunk in stream_template(
+                        'public/home.html', **template_vars):
+                    yield chunk
+            finally:
+                rows.close()
+
+        response = Response(stream_with_context(generate()))
+    else:
+        response = make_response(
+            render_template('public/home.html', **template_vars))
+
+    return _set_cache_headers(response, etag, last_modified)
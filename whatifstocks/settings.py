@@ -59,6 +59,24 @@ class Config(object):
         'WHATIFSTOCKS_MAIL_ERROR_SUBJECT_TEMPLATE',
         '[{0}] Error report: {1}')
 
+    # Mixed into ETags so that a deploy with changed templates invalidates
+    # cached pages. Heroku sets SOURCE_VERSION to the deployed commit.
+    ETAG_SALT = os_env.get(
+        'WHATIFSTOCKS_ETAG_SALT', os_env.get('SOURCE_VERSION', ''))
+    # Cache-Control max-age of the home page. With 0, browsers and proxies
+    # may store the page but must revalidate it (cheaply) on every hit.
+    PUBLIC_HOME_CACHE_MAX_AGE = (
+        os_env.get('WHATIFSTOCKS_PUBLIC_HOME_CACHE_MAX_AGE')
+        and ast.literal_eval(
+            os_env.get('WHATIFSTOCKS_PUBLIC_HOME_CACHE_MAX_AGE'))
+        or 0)
+
+    # Stocks shown per page of home page results (0 to show all).
+    PUBLIC_HOME_PAGE_SIZE = 50
+    # Stream the home page when showing all stocks (limit 0), rendering it
+    # from a server-side DB cursor as it's sent, instead of all at once.
+    PUBLIC_HOME_STREAM_ALL = True
+
     SESSION_COOKIE_NAME = 'whatifstocks_session'
     REMEMBER_COOKIE_NAME = 'whatifstocks_remember_token'
 
@@ -83,6 +101,85 @@ class Config(object):
     STOCKANALYSIS_ALPHAVANTAGE_APIKEY = os_env.get(
         'WHATIFSTOCKS_STOCKANALYSIS_ALPHAVANTAGE_APIKEY',
         'A1B2C3D4E5F6G7H8')
+    # Free Alpha Vantage keys allow 5 requests per minute.
+    STOCKANALYSIS_ALPHAVANTAGE_REQUESTS_PER_MINUTE = (
+        os_env.get(
+            'WHATIFSTOCKS_STOCKANALYSIS_ALPHAVANTAGE_REQUESTS_PER_MINUTE')
+        and ast.literal_eval(os_env.get(
+            'WHATIFSTOCKS_STOCKANALYSIS_ALPHAVANTAGE_REQUESTS_PER_MINUTE'))
+        or 5)
+    STOCKANALYSIS_ALPHAVANTAGE_BURST = (
+        os_env.get('WHATIFSTOCKS_STOCKANALYSIS_ALPHAVANTAGE_BURST')
+        and ast.literal_eval(os_env.get(
+            'WHATIFSTOCKS_STOCKANALYSIS_ALPHAVANTAGE_BURST'))
+        or 1)
+    STOCKANALYSIS_DOWNLOAD_WORKERS = (
+        os_env.get('WHATIFSTOCKS_STOCKANALYSIS_DOWNLOAD_WORKERS')
+        and ast.literal_eval(os_env.get(
+            'WHATIFSTOCKS_STOCKANALYSIS_DOWNLOAD_WORKERS'))
+        or 4)
+    STOCKANALYSIS_DOWNLOAD_MAX_TRIES = 5
+    STOCKANALYSIS_DOWNLOAD_BACKOFF_BASE = 1.0
+    STOCKANALYSIS_DOWNLOAD_BACKOFF_MAX = 120.0
+
+    STOCKANALYSIS_IMPORT_BATCH_SIZE = 10000
+
+    # Most pairs of years the multi-period API ranks in one request.
+    STOCKANALYSIS_MAX_PERIODS = 100
+    # Most portfolios the backtest API scores in one request.
+    STOCKANALYSIS_MAX_BACKTEST_PORTFOLIOS = 10000
+    # Exchanges ranked at the same time (each on its own DB connection) by
+    # the global ranking API.
+    STOCKANALYSIS_GLOBAL_RANKING_WORKERS = (
+        os_env.get('WHATIFSTOCKS_STOCKANALYSIS_GLOBAL_RANKING_WORKERS')
+        and ast.literal_eval(os_env.get(
+            'WHATIFSTOCKS_STOCKANALYSIS_GLOBAL_RANKING_WORKERS'))
+        or 4)
+
+    # 'sql' ranks stocks in the DB, 'numpy' ranks an in-memory matrix of
+    # each exchange's yearly prices (requires NumPy), and 'precomputed'
+    # reads rankings stored by the refresh_returns command.
+    STOCKANALYSIS_RANKING_ENGINE = os_env.get(
+        'WHATIFSTOCKS_STOCKANALYSIS_RANKING_ENGINE', 'sql')
+    # Read DB rankings as namedtuples, with sectors from a cached dict,
+    # rather than as ORM instances.
+    STOCKANALYSIS_LIGHT_ROWS = ast.literal_eval(
+        os_env.get('WHATIFSTOCKS_STOCKANALYSIS_LIGHT_ROWS', 'True'))
+
+    # Directory of price snapshot files written by build_snapshot. If set,
+    # the 'numpy' engine memory-maps them instead of loading from the DB.
+    STOCKANALYSIS_SNAPSHOT_DIR = os_env.get(
+        'WHATIFSTOCKS_STOCKANALYSIS_SNAPSHOT_DIR')
+
+    # Ranking results cached per worker, keyed on each exchange's data
+    # version (so imports invalidate them). Set the size to 0 to disable.
+    STOCKANALYSIS_RESULT_CACHE_SIZE = 256
+    STOCKANALYSIS_RESULT_CACHE_TTL = 3600
+
+    # Prometheus metrics, served at METRICS_PATH.
+    METRICS_ENABLED = ast.literal_eval(
+        os_env.get('WHATIFSTOCKS_METRICS_ENABLED', 'True'))
+    METRICS_PATH = '/metrics'
+
+    # SQL statements slower than this many seconds are logged as JSON lines
+    # to SLOW_QUERY_LOG_FILE (or stderr). None disables the slow-query log.
+    SLOW_QUERY_THRESHOLD = (
+        os_env.get('WHATIFSTOCKS_SLOW_QUERY_THRESHOLD')
+        and ast.literal_eval(os_env.get('WHATIFSTOCKS_SLOW_QUERY_THRESHOLD'))
+        or None)
+    SLOW_QUERY_LOG_FILE = os_env.get('WHATIFSTOCKS_SLOW_QUERY_LOG_FILE')
+    # Fraction of slow SELECTs, at least SLOW_QUERY_EXPLAIN_THRESHOLD seconds
+    # (default SLOW_QUERY_THRESHOLD), re-run with EXPLAIN (ANALYZE, BUFFERS).
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE = (
+        os_env.get('WHATIFSTOCKS_SLOW_QUERY_EXPLAIN_SAMPLE_RATE')
+        and ast.literal_eval(os_env.get(
+            'WHATIFSTOCKS_SLOW_QUERY_EXPLAIN_SAMPLE_RATE'))
+        or 0.0)
+    SLOW_QUERY_EXPLAIN_THRESHOLD = (
+        os_env.get('WHATIFSTOCKS_SLOW_QUERY_EXPLAIN_THRESHOLD')
+        and ast.literal_eval(os_env.get(
+            'WHATIFSTOCKS_SLOW_QUERY_EXPLAIN_THRESHOLD'))
+        or None)
 
 
 class ProdConfig(Config):
@@ -107,3 +204,6 @@ class TestConfig(Config):
 
     TESTING = True
     DEBUG = True
+    SQLALCHEMY_DATABASE_URI = os_env.get(
+        'WHATIFSTOCKS_TEST_DATABASE_URI',
+        'postgresql://localhost/example_test')
@@ -0,0 +1,157 @@
+"""Structured log of slow SQL statements, with sampled EXPLAIN plans."""
+from datetime import datetime
+import json
+import logging
+import random
+import timeit
+
+from flask import has_request_context, request
+import psycopg2
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_LOGGER_NAME = 'whatifstocks.slowqueries'
+EXPLAIN_SAVEPOINT = 'slow_query_explain'
+
+
+class JSONLogFormatter(logging.Formatter):
+    """Format log records whose message is a dict as one JSON line each."""
+
+    def format(self, record):
+        created_at = datetime.utcfromtimestamp(record.created)
+        fields = {
+            'time': created_at.isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name}
+
+        if isinstance(record.msg, dict):
+            fields.update(record.msg)
+        else:
+            fields['message'] = record.getMessage()
+
+        return json.dumps(fields, default=str, sort_keys=True)
+
+
+def _is_explainable(statement):
+    """Whether EXPLAIN ANALYZE can run a statement without side effects."""
+    return statement.lstrip().upper().startswith('SELECT')
+
+
+class SlowQueryLog(object):
+    """Flask extension that logs SQL statements slower than a threshold.
+
+    Slow statements are logged as JSON lines, with their parameters,
+    duration and (in a request) endpoint and URL. A sample of them
+    (``SLOW_QUERY_EXPLAIN_SAMPLE_RATE``), if at least
+    ``SLOW_QUERY_EXPLAIN_THRESHOLD`` slow, are run again on PostgreSQL
+    with ``EXPLAIN (ANALYZE, BUFFERS)`` and the plan is logged too. Only
+    SELECT statements are explained, since ANALYZE executes them.
+    """
+
+    def __init__(self, app=None, rng=random.random):
+        self.threshold = None
+        self.explain_threshold = None
+        self.explain_sample_rate = 0.0
+        self.logger = logging.getLogger(SLOW_QUERY_LOGGER_NAME)
+        self._random = rng
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['slow_query_log'] = self
+        self.threshold = app.config['SLOW_QUERY_THRESHOLD']
+        self.explain_threshold = (
+            app.config['SLOW_QUERY_EXPLAIN_THRESHOLD'] or self.threshold)
+        self.explain_sample_rate = app.config[
+            'SLOW_QUERY_EXPLAIN_SAMPLE_RATE']
+
+        if self.threshold is None:
+            return
+
+        if not self.logger.handlers:
+            handler = (
+                app.config['SLOW_QUERY_LOG_FILE'] and
+                logging.FileHandler(app.config['SLOW_QUERY_LOG_FILE']) or
+                logging.StreamHandler())
+            handler.setFormatter(JSONLogFormatter())
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+
+        if not event.contains(
+                Engine, 'before_cursor_execute', self._before_execute):
+            event.listen(
+                Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_execute(
+            self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(
+            timeit.default_timer())
+
+    def _after_execute(
+            self, conn, cursor, statement, parameters, context, executemany):
+        duration = timeit.default_timer() - conn.info['slow_query_start'].pop()
+
+        if self.threshold is None or duration < self.threshold:
+            return
+
+        entry = {
+            'event': 'slow_query',
+            'duration_ms': round(duration * 1000.0, 3),
+            'statement': statement,
+            'parameters': parameters,
+            'executemany': executemany}
+
+        if has_request_context():
+            entry['endpoint'] = request.endpoint
+            entry['url'] = request.url
+
+        if (
+                not executemany and
+                conn.dialect.name == 'postgresql' and
+                duration >= self.explain_threshold and
+                _is_explainable(statement) and
+                self._random() < self.explain_sample_rate):
+            entry['explain'] = self.explain(cursor, statement, parameters)
+
+        self.logger.warning(entry)
+
+    def explain(self, cursor, statement, parameters):
+        """Plan of a statement from EXPLAIN (ANALYZE, BUFFERS), as JSON.
+
+        Runs on a new cursor of the same DB connection, so in the same
+        transaction, and bypasses SQLAlchemy so it isn't itself logged.
+        The EXPLAIN is run in a savepoint that is always rolled back, so
+        that neither an error nor anything the statement did affects the
+        request's transaction.
+        """
+        is_in_transaction = not cursor.connection.autocommit
+        explain_cursor = cursor.connection.cursor()
+
+        try:
+            if is_in_transaction:
+                explain_cursor.execute('SAVEPOINT ' + EXPLAIN_SAVEPOINT)
+
+            try:
+                explain_cursor.execute(
+                    'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement,
+                    parameters)
+                plan = explain_cursor.fetchone()[0]
+            except psycopg2.Error as e:
+                plan = {'error': str(e)}
+
+            if is_in_transaction:
+                explain_cursor.execute(
+                    'ROLLBACK TO SAVEPOINT ' + EXPLAIN_SAVEPOINT)
+                explain_cursor.execute('RELEASE SAVEPOINT ' + EXPLAIN_SAVEPOINT)
+        except psycopg2.Error as e:
+            return {'error': str(e)}
+        finally:
+            explain_cursor.close()
+
+        if not isinstance(plan, (list, dict)):
+            plan = json.loads(plan)
+
+        return plan
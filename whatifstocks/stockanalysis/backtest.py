@@ -0,0 +1,216 @@
+"""Vectorized backtests of batches of weighted stock portfolios."""
+import numpy as np
+
+from whatifstocks.stockanalysis.pricematrix import price_matrices
+
+
+def _is_positive_finite(value):
+    try:
+        value = float(value)
+    except OverflowError:
+        # An int too large for a float.
+        return False
+
+    return value > 0.0 and bool(np.isfinite(value))
+
+
+class PortfolioBatch(object):
+    """Portfolios of stocks in one price matrix, as padded arrays.
+
+    ``holdings[p, k]`` is the matrix row of portfolio ``p``'s ``k``-th
+    stock, and ``weights[p, k]`` its weight. Portfolios with fewer stocks
+    than the widest one are padded with weight 0. Each portfolio's weights
+    are normalized to sum to 1.
+    """
+
+    def __init__(self, holdings, weights):
+        self.holdings = np.asarray(holdings, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum(axis=1, keepdims=True)
+
+    @property
+    def num_portfolios(self):
+        return self.holdings.shape[0]
+
+    @classmethod
+    def from_ticker_weights(cls, portfolios, indexes_by_ticker):
+        """Batch of portfolios given as ``{ticker_symbol: weight}`` dicts.
+
+        Raises ValueError for unknown tickers or invalid weights.
+        """
+        if not isinstance(portfolios, list) or not portfolios:
+            raise ValueError('At least one portfolio is required')
+
+        if not all(isinstance(p, dict) for p in portfolios):
+            raise ValueError(
+                'Portfolios must be {ticker_symbol: weight} objects')
+
+        width = max(len(p) for p in portfolios)
+        holdings = np.zeros((len(portfolios), width), dtype=np.int64)
+        weights = np.zeros((len(portfolios), width), dtype=np.float64)
+
+        for p, portfolio in enumerate(portfolios):
+            if not portfolio:
+                raise ValueError('Portfolio {0} has no stocks'.format(p))
+
+            for k, (ticker_symbol, weight) in enumerate(
+                    sorted(portfolio.items())):
+                if ticker_symbol not in indexes_by_ticker:
+                    raise ValueError(
+                        'Portfolio {0}: unknown ticker "{1}"'.format(
+                            p, ticker_symbol))
+
+                if (
+                        isinstance(weight, bool) or
+                        not isinstance(weight, (int, float)) or
+                        not _is_positive_finite(weight)):
+                    raise ValueError(
+                        'Portfolio {0}: weight of "{1}" must be a '
+                        'positive finite number'.format(p, ticker_symbol))
+
+                holdings[p, k] = indexes_by_ticker[ticker_symbol]
+                weights[p, k] = weight
+
+            with np.errstate(over='ignore'):
+                total_weight = weights[p].sum()
+
+            # Weights are normalized by their total, which must not overflow.
+            if not np.isfinite(total_weight):
+                raise ValueError(
+                    'Portfolio {0}: total weight is too large'.format(p))
+
+        return cls(holdings, weights)
+
+    @classmethod
+    def random(cls, candidates, num_portfolios, num_holdings, seed=0):
+        """Random equal-weight portfolios of the given candidate rows.
+
+        Stocks are drawn with replacement, so a portfolio may hold a stock
+        more than once (adding up its weight).
+        """
+        rng = np.random.RandomState(seed)
+        candidates = np.asarray(candidates, dtype=np.int64)
+        holdings = candidates[rng.randint(
+            len(candidates), size=(num_portfolios, num_holdings))]
+
+        return cls(holdings, np.ones(holdings.shape))
+
+
+def stock_indexes_by_ticker(matrix):
+    """Map of ticker symbol to row index, for a price matrix's stocks."""
+    return {
+        ticker_symbol: i
+        for i, ticker_symbol in enumerate(matrix.ticker_symbols())
+        if ticker_symbol is not None}
+
+
+def complete_stock_indexes(matrix, from_year, to_year):
+    """Rows of stocks with a positive price in every year of a range."""
+    with np.errstate(invalid='ignore'):
+        return np.flatnonzero(
+            (matrix.year_window(from_year, to_year) > 0.0).all(axis=1))
+
+
+def backtest(matrix, batch, from_year, to_year, rebalance=False):
+    """Value paths of a batch of portfolios, worth 1.0 in ``from_year``.
+
+    Without ``rebalance``, each portfolio buys its stocks in its weights
+    at ``from_year`` prices and holds them. With ``rebalance``, it is
+    brought back to its weights at the start of every year. Prices are
+    the yearly average close prices.
+
+    Returns a portfolios x years array. All portfolios are computed
+    together with NumPy broadcasting. A portfolio holding a stock without
+    a positive price in every year of the range has a path of NaN.
+    Raises ValueError unless both years are within the matrix's years,
+    which also bounds the size of the arrays.
+    """
+    if from_year >= to_year:
+        raise ValueError('from_year must be before to_year')
+
+    if not matrix.num_years:
+        raise ValueError('There are no prices to backtest with')
+
+    if from_year < matrix.first_year or to_year > matrix.last_year:
+        raise ValueError('Years must be from {0} to {1}'.format(
+            matrix.first_year, matrix.last_year))
+
+    window = matrix.year_window(from_year, to_year)
+    is_held = batch.weights > 0.0
+    prices = window[batch.holdings]
+
+    with np.errstate(invalid='ignore'):
+        is_priced = (prices > 0.0).all(axis=2)
+
+    is_complete = (is_priced | ~is_held).all(axis=1)
+    # Padding (and portfolios flagged incomplete) mustn't spread NaN.
+    prices = np.where(
+        (is_held & is_priced)[:, :, np.newaxis], prices, 1.0)
+
+    if rebalance:
+        growth = prices[:, :, 1:] / prices[:, :, :-1]
+        values = np.ones((batch.num_portfolios, window.shape[1]))
+        np.cumprod(
+            np.einsum('pk,pkt->pt', batch.weights, growth), axis=1,
+            out=values[:, 1:])
+    else:
+        shares = batch.weights / prices[:, :, 0]
+        values = np.einsum('pk,pkt->pt', shares, prices)
+
+    values[~is_complete] = np.nan
+
+    return values
+
+
+def rank_portfolios(values, limit=None):
+    """Portfolio indexes by descending final value, incomplete ones last."""
+    final_values = values[:, -1]
+    is_incomplete = np.isnan(final_values)
+    order = np.lexsort((
+        np.arange(len(final_values)),
+        -np.where(is_incomplete, 0.0, final_values),
+        is_incomplete))
+
+    return order[:limit] if limit else order
+
+
+def _float_or_none(value):
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def backtest_portfolios(exch, from_year, to_year, portfolios,
+                        rebalance=False, limit=None, include_values=True,
+                        snapshot_dir=None):
+    """Backtest ``{ticker_symbol: weight}`` portfolios of an exchange.
+
+    Returns a JSON-serializable dict, with portfolios ranked by total
+    return (each with its ``index`` in ``portfolios``). Raises ValueError
+    for invalid portfolios.
+    """
+    matrix = price_matrices.get(
+        exch.id, exch.data_version, snapshot_dir=snapshot_dir)
+    batch = PortfolioBatch.from_ticker_weights(
+        portfolios, stock_indexes_by_ticker(matrix))
+    values = backtest(
+        matrix, batch, from_year, to_year, rebalance=rebalance)
+    results = []
+
+    for index in rank_portfolios(values, limit=limit).tolist():
+        result = {
+            'index': index,
+            'final_value': _float_or_none(values[index, -1]),
+            'total_return_percent': _float_or_none(
+                (values[index, -1] - 1.0) * 100.0)}
+
+        if include_values:
+            result['values'] = [_float_or_none(v) for v in values[index]]
+
+        results.append(result)
+
+    return {
+        'exchange_symbol': exch.exchange_symbol,
+        'from_year': from_year,
+        'to_year': to_year,
+        'rebalance': rebalance,
+        'years': list(range(from_year, to_year + 1)),
+        'portfolios': results}
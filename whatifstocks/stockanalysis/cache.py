@@ -0,0 +1,112 @@
+"""Bounded in-process cache for query results."""
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResultCache(object):
+    """Thread-safe LRU cache whose entries also expire after a TTL.
+
+    Callers are expected to include a data version in each key, so that
+    entries computed from old data are never looked up again once the
+    version changes; they simply age out of the LRU order.
+
+    Listeners added with ``add_listener`` are called with ``'hit'``,
+    ``'miss'`` or ``'eviction'`` for every such event.
+    """
+
+    def __init__(self, app=None, clock=time.time):
+        self.maxsize = 0
+        self.ttl = None
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._listeners = []
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config['STOCKANALYSIS_RESULT_CACHE_SIZE']
+        self.ttl = app.config['STOCKANALYSIS_RESULT_CACHE_TTL']
+        app.extensions['result_cache'] = self
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, events):
+        for event in events:
+            for listener in self._listeners:
+                listener(event)
+
+    def get(self, key):
+        """Get ``(is_found, value)`` for a key."""
+        events = []
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            is_found, value = False, None
+
+            if entry is not None:
+                if entry[1] is None or self._clock() < entry[1]:
+                    # Re-insert to mark as most recently used.
+                    self._entries[key] = entry
+                    is_found, value = True, entry[0]
+                else:
+                    self.evictions += 1
+                    events.append('eviction')
+
+            if is_found:
+                self.hits += 1
+                events.append('hit')
+            else:
+                self.misses += 1
+                events.append('miss')
+
+        self._notify(events)
+
+        return is_found, value
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+
+        expires_at = self.ttl and self._clock() + self.ttl or None
+        events = []
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                events.append('eviction')
+
+        self._notify(events)
+
+    def get_or_create(self, key, creator):
+        """Get a cached value, or create and cache it on a miss."""
+        is_found, value = self.get(key)
+
+        if not is_found:
+            value = creator()
+            self.set(key, value)
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
@@ -2,17 +2,33 @@
 from datetime import date
 from decimal import Decimal
 import io
-from time import sleep
+import json
+import os
 
 import click
 from flask import current_app as app
 from flask.cli import with_appcontext
-import requests
 import unicodecsv as csv
 
 from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.downloader import MonthlyPricesDownloader
+from whatifstocks.stockanalysis.exports import (iter_csv_chunks,
+                                                iter_gzip_chunks,
+                                                iter_yearly_price_rows,
+                                                MULTI_PERIOD_CSV_FIELDS,
+                                                RANKING_CSV_FIELDS,
+                                                YEARLY_PRICE_CSV_FIELDS)
+from whatifstocks.stockanalysis.importers import (
+    bulk_import_monthly_prices, close_month_bit,
+    parallel_import_monthly_prices, upsert_monthly_prices)
 from whatifstocks.stockanalysis.models import (Exchange, IndustrySector,
                                                Stock, StockYearlyPrice)
+from whatifstocks.stockanalysis.multiperiod import (iter_multi_period_rows,
+                                                    parse_year_pairs)
+from whatifstocks.stockanalysis.periodreturns import (
+    mark_dirty_years, refresh_exchanges_period_returns)
+from whatifstocks.stockanalysis.queries import (
+    iter_yeartoyear_price_percent_change_rows)
 
 
 @click.group()
@@ -45,10 +61,14 @@ def create_exchange(exchange_symbol, title):
               help='Stock tickers text file')
 @click.option('--monthly-prices-output-file', type=click.File('w'),
               help='Monthly prices output file')
+@click.option('--workers', type=int, default=None,
+              help='Number of concurrent download workers')
+@click.option('--requests-per-minute', type=float, default=None,
+              help='Maximum API requests per minute, across all workers')
 @with_appcontext
 def download_stock_monthly_prices(
         exchange_symbol, ticker_symbols_file,
-        monthly_prices_output_file):
+        monthly_prices_output_file, workers, requests_per_minute):
     """Download stock monthly prices."""
     if not ticker_symbols_file:
         raise click.BadParameter(
@@ -59,70 +79,44 @@ def download_stock_monthly_prices(
 
     click.echo('{0} ticker symbols to process'.format(len(ticker_symbols)))
 
-    monthly_prices_url_pattern = app.config[
-        'STOCKANALYSIS_MONTHLY_PRICES_URL_PATTERN']
-    alphavantage_apikey = app.config['STOCKANALYSIS_ALPHAVANTAGE_APIKEY']
-    alphavantage_toofrequent_errmsg = (
-        'if you would like to have a higher API call volume')
-    max_request_tries = 5
+    if workers is None:
+        workers = app.config['STOCKANALYSIS_DOWNLOAD_WORKERS']
+    if requests_per_minute is None:
+        requests_per_minute = app.config[
+            'STOCKANALYSIS_ALPHAVANTAGE_REQUESTS_PER_MINUTE']
+
+    downloader = MonthlyPricesDownloader(
+        app.config['STOCKANALYSIS_MONTHLY_PRICES_URL_PATTERN'],
+        app.config['STOCKANALYSIS_ALPHAVANTAGE_APIKEY'],
+        exchange_symbol,
+        workers=workers,
+        requests_per_minute=requests_per_minute,
+        burst=app.config['STOCKANALYSIS_ALPHAVANTAGE_BURST'],
+        max_tries=app.config['STOCKANALYSIS_DOWNLOAD_MAX_TRIES'],
+        backoff_base=app.config['STOCKANALYSIS_DOWNLOAD_BACKOFF_BASE'],
+        backoff_max=app.config['STOCKANALYSIS_DOWNLOAD_BACKOFF_MAX'],
+        log=click.echo)
 
     monthly_prices_output_file.write(
         'ticker_symbol,close_at,close_price\n')
 
-    for ticker_symbol in ticker_symbols:
-        click.echo('Fetching monthly prices for {0}.{1}'.format(
-            ticker_symbol, exchange_symbol))
-        monthly_prices_url = monthly_prices_url_pattern.format(
-            ticker_symbol, exchange_symbol, alphavantage_apikey)
-
-        is_requested_successfully = False
-        request_tries = 0
-
-        while not is_requested_successfully and request_tries < max_request_tries:
-            request_tries += 1
-
-            click.echo('Try {0} fetching for {1}.{2}'.format(
-                request_tries, ticker_symbol, exchange_symbol))
-
-            r = requests.get(monthly_prices_url)
-            monthly_prices_json = r.json()
-
-            try:
-                monthly_prices_raw = (
-                    monthly_prices_json['Monthly Adjusted Time Series'])
-                is_requested_successfully = True
-                click.echo('Fetched successfully for {0}.{1}'.format(
-                    ticker_symbol, exchange_symbol))
-            except KeyError:
-                monthly_prices_json_str = str(monthly_prices_json)
-                if alphavantage_toofrequent_errmsg in monthly_prices_json_str:
-                    click.echo('Failed for {0}.{1}: calling too frequently'.format(
-                        ticker_symbol, exchange_symbol))
-                    if request_tries < max_request_tries:
-                        # Do a little exponential backoff each time
-                        # the request fails due to too frequent usage.
-                        sleep_secs = 10 ** request_tries
-                        click.echo('Sleeping for {0} secs'.format(sleep_secs))
-                        sleep(sleep_secs)
-                    else:
-                        click.echo('Give up on {0}.{1}'.format(
-                            ticker_symbol, exchange_symbol))
-                else:
-                    click.echo(
-                        'Failed for {0}.{1}, response was: {2}'.format(
-                            ticker_symbol, exchange_symbol,
-                            monthly_prices_json_str))
-
-        if is_requested_successfully:
-            if monthly_prices_raw:
-                for close_at, prices_raw in monthly_prices_raw.items():
-                    close_price = prices_raw['5. adjusted close']
-
-                    monthly_prices_output_file.write('{0},{1},{2}\n'.format(
-                        ticker_symbol, close_at, close_price))
-            else:
-                click.echo('No monthly prices returned for {0}.{1]'.format(
-                    ticker_symbol, exchange_symbol))
+    num_failed = 0
+
+    for result in downloader.download(ticker_symbols):
+        if result.error:
+            num_failed += 1
+        elif result.monthly_prices:
+            for close_at, prices_raw in result.monthly_prices.items():
+                close_price = prices_raw['5. adjusted close']
+
+                monthly_prices_output_file.write('{0},{1},{2}\n'.format(
+                    result.ticker_symbol, close_at, close_price))
+        else:
+            click.echo('No monthly prices returned for {0}.{1}'.format(
+                result.ticker_symbol, exchange_symbol))
+
+    if num_failed:
+        click.echo('Failed to fetch {0} ticker symbols'.format(num_failed))
 
     click.echo('Done!')
 
@@ -218,20 +212,23 @@ def import_stocks(exchange_symbol, company_info_file):
             industry_sector=ind_sector)
         db.session.add(stock)
 
+    exch.bump_data_version(commit=False)
     db.session.commit()
 
     click.echo('Done!')
 
 
-def create_stock_yearly_prices(stock, prices_by_year):
+def create_stock_yearly_prices(stock, prices_by_year, months_by_year):
     """Create stock yearly prices."""
     for year, prices in prices_by_year.items():
         close_at = date(year, 1, 1)
         close_price = sum(prices) / Decimal(len(prices))
 
         syp = StockYearlyPrice(
-            stock=stock, close_at=close_at,
-            close_price=close_price)
+            stock=stock, close_at=close_at, year=year,
+            close_price=close_price, close_price_sum=sum(prices),
+            close_price_count=len(prices),
+            close_months=months_by_year[year])
 
         db.session.add(syp)
 
@@ -239,9 +236,23 @@ def create_stock_yearly_prices(stock, prices_by_year):
 
 
 def _import_monthly_prices(exch, monthly_prices):
-    """Do import of monthly prices."""
+    """Do import of monthly prices, returning the set of years imported.
+
+    Each stock's prices are committed on their own, and each year is
+    marked dirty in the transaction of the first stock that has it. The
+    exchange's data version is bumped in every stock's transaction, so
+    that cached results never outlive committed prices.
+    """
     stock = None
     prices_by_year = {}
+    months_by_year = {}
+    years = set()
+
+    def write_stock_yearly_prices():
+        mark_dirty_years(exch.id, set(prices_by_year) - years)
+        years.update(prices_by_year)
+        exch.bump_data_version(commit=False)
+        create_stock_yearly_prices(stock, prices_by_year, months_by_year)
 
     for monthly_price_raw in monthly_prices:
         close_price_raw = monthly_price_raw['close_price']
@@ -251,8 +262,9 @@ def _import_monthly_prices(exch, monthly_prices):
             ticker_symbol = monthly_price_raw['ticker_symbol']
 
             if stock is not None and stock.ticker_symbol != ticker_symbol:
-                create_stock_yearly_prices(stock, prices_by_year)
+                write_stock_yearly_prices()
                 prices_by_year = {}
+                months_by_year = {}
 
             if stock is None or stock.ticker_symbol != ticker_symbol:
                 stock = (Stock.query
@@ -271,10 +283,56 @@ def _import_monthly_prices(exch, monthly_prices):
 
             if close_at_year not in prices_by_year:
                 prices_by_year[close_at_year] = []
+                months_by_year[close_at_year] = 0
 
             prices_by_year[close_at_year].append(close_price)
+            months_by_year[close_at_year] |= close_month_bit(close_at_raw)
+
+    write_stock_yearly_prices()
+
+    return years
+
+
+def _iter_lines_with_progress(f, progress):
+    """Iterate over lines of a file, reporting progress in bytes."""
+    for line in f:
+        progress(len(line))
+        yield line
+
+
+def _import_monthly_prices_serially(
+        exch, monthly_prices_file, file_size, bulk, incremental, batch_size):
+    """Import monthly prices by reading the file in this process.
+
+    Returns the set of years imported.
+    """
+    if incremental:
+        def do_import(monthly_prices):
+            num_rows, years = upsert_monthly_prices(
+                exch, monthly_prices, batch_size=batch_size)
+            click.echo('\n{0} yearly prices written'.format(num_rows))
+            return years
+    elif bulk:
+        def do_import(monthly_prices):
+            num_rows, years = bulk_import_monthly_prices(
+                exch, monthly_prices, batch_size=batch_size)
+            click.echo('\n{0} yearly prices written'.format(num_rows))
+            return years
+    else:
+        def do_import(monthly_prices):
+            return _import_monthly_prices(exch, monthly_prices)
 
-    create_stock_yearly_prices(stock, prices_by_year)
+    if file_size is not None:
+        with click.progressbar(length=file_size,
+                               label='Importing monthly prices') as bar:
+            monthly_prices_csv = csv.DictReader(
+                _iter_lines_with_progress(monthly_prices_file, bar.update),
+                encoding='utf-8-sig')
+            return do_import(monthly_prices_csv)
+
+    monthly_prices_csv = csv.DictReader(
+        monthly_prices_file, encoding='utf-8-sig')
+    return do_import(monthly_prices_csv)
 
 
 @stockanalysis.command()
@@ -282,8 +340,18 @@ def _import_monthly_prices(exch, monthly_prices):
               help='Exchange symbol')
 @click.option('--monthly-prices-file', type=click.File('rb'),
               help='Monthly prices file')
+@click.option('--bulk', default=False, is_flag=True,
+              help='Write yearly prices in large batches (COPY on Postgres)')
+@click.option('--batch-size', type=int, default=None,
+              help='Rows per batch (and per commit) in bulk mode')
+@click.option('--workers', type=int, default=1,
+              help='Parse the file with this many processes (implies --bulk)')
+@click.option('--incremental', default=False, is_flag=True,
+              help='Merge in only months not imported yet (Postgres only)')
 @with_appcontext
-def import_monthly_prices(exchange_symbol, monthly_prices_file):
+def import_monthly_prices(
+        exchange_symbol, monthly_prices_file, bulk, batch_size, workers,
+        incremental):
     """Import monthly prices."""
     if not monthly_prices_file:
         raise click.BadParameter(
@@ -299,33 +367,243 @@ def import_monthly_prices(exchange_symbol, monthly_prices_file):
 
     try:
         monthly_prices_file.seek(0)
-        is_seek_supported = True
-    except io.UnsupportedOperation:
-        is_seek_supported = False
+        file_size = os.fstat(monthly_prices_file.fileno()).st_size
+    except (io.UnsupportedOperation, AttributeError):
+        file_size = None
 
-    monthly_prices_csv = csv.DictReader(
-        monthly_prices_file, encoding='utf-8-sig')
+    if batch_size is None:
+        batch_size = app.config['STOCKANALYSIS_IMPORT_BATCH_SIZE']
 
-    num_prices = 0
+    if workers > 1:
+        if incremental:
+            raise click.BadParameter(
+                "--workers can't be used with --incremental")
 
-    if is_seek_supported:
-        for i, line in enumerate(monthly_prices_csv):
-            num_prices += 1
+        if file_size is None:
+            raise click.BadParameter(
+                '--workers requires --monthly-prices-file to be a '
+                'regular file, not a pipe')
 
-        click.echo('Monthly prices file scanned, {0} prices in file'.format(
-            num_prices))
+        with click.progressbar(length=file_size,
+                               label='Importing monthly prices') as bar:
+            num_rows, _ = parallel_import_monthly_prices(
+                exch, monthly_prices_file.name, workers,
+                batch_size=batch_size, progress=bar.update)
 
-        monthly_prices_file.seek(0)
+        click.echo('{0} yearly prices written'.format(num_rows))
+    else:
+        _import_monthly_prices_serially(
+            exch, monthly_prices_file, file_size, bulk, incremental,
+            batch_size)
 
-    monthly_prices_csv = csv.DictReader(
-        monthly_prices_file, encoding='utf-8-sig')
+    # The years written were marked dirty, and the data version bumped,
+    # as each batch was committed.
+    click.echo('Done!')
 
-    if is_seek_supported:
-        with click.progressbar(monthly_prices_csv,
-                               length=num_prices,
-                               label='Importing monthly prices') as bar:
-            _import_monthly_prices(exch, bar)
+
+def _write_csv_export(output_file, fields, rows, is_gzip):
+    chunks = iter_csv_chunks(fields, rows)
+
+    if is_gzip:
+        chunks = iter_gzip_chunks(chunks)
+
+    for chunk in chunks:
+        output_file.write(chunk)
+
+
+@stockanalysis.command()
+@click.option('--exchange-symbol', prompt=True,
+              help='Exchange symbol')
+@click.option('--from-year', type=int, prompt=True,
+              help='From year')
+@click.option('--to-year', type=int, prompt=True,
+              help='To year')
+@click.option('--output-file', type=click.File('wb'), default='-',
+              help='CSV output file (default: stdout)')
+@click.option('--gzip', 'is_gzip', default=False, is_flag=True,
+              help='Gzip the output')
+@with_appcontext
+def export_rankings(exchange_symbol, from_year, to_year, output_file, is_gzip):
+    """Export price percent changes between two years as CSV."""
+    exch = (Exchange.query
+                    .filter_by(exchange_symbol=exchange_symbol)
+                    .first())
+
+    if not exch:
+        raise click.BadParameter('Exchange "{0}" not found'.format(
+            exchange_symbol))
+
+    rows = iter_yeartoyear_price_percent_change_rows(
+        exch.id, from_year, to_year)
+    _write_csv_export(output_file, RANKING_CSV_FIELDS, rows, is_gzip)
+
+
+@stockanalysis.command()
+@click.option('--exchange-symbol', 'exchange_symbols', multiple=True,
+              help='Exchange symbol (repeat for several; default: all)')
+@click.option('--periods', prompt=True,
+              help='Comma-separated from-to year pairs, e.g. 2000-2010')
+@click.option('--limit', type=int, default=None,
+              help='Only export the top stocks of each ranking')
+@click.option('--output-file', type=click.File('wb'), default='-',
+              help='CSV output file (default: stdout)')
+@click.option('--gzip', 'is_gzip', default=False, is_flag=True,
+              help='Gzip the output')
+@with_appcontext
+def export_multi_period_rankings(
+        exchange_symbols, periods, limit, output_file, is_gzip):
+    """Export rankings for many pairs of years as CSV, in one query."""
+    try:
+        year_pairs = parse_year_pairs(periods)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    exchanges = Exchange.query
+
+    if exchange_symbols:
+        exchanges = exchanges.filter(
+            Exchange.exchange_symbol.in_(exchange_symbols))
+
+    exchanges = exchanges.all()
+    unknown_symbols = (
+        set(exchange_symbols) - set(e.exchange_symbol for e in exchanges))
+
+    if unknown_symbols:
+        raise click.BadParameter('Exchange "{0}" not found'.format(
+            sorted(unknown_symbols)[0]))
+
+    rows = iter_multi_period_rows(
+        [e.id for e in exchanges], year_pairs, limit=limit)
+    _write_csv_export(output_file, MULTI_PERIOD_CSV_FIELDS, rows, is_gzip)
+
+
+@stockanalysis.command()
+@click.option('--exchange-symbol', prompt=True,
+              help='Exchange symbol')
+@click.option('--output-file', type=click.File('wb'), default='-',
+              help='CSV output file (default: stdout)')
+@click.option('--gzip', 'is_gzip', default=False, is_flag=True,
+              help='Gzip the output')
+@with_appcontext
+def export_yearly_prices(exchange_symbol, output_file, is_gzip):
+    """Export all yearly prices of an exchange as CSV."""
+    exch = (Exchange.query
+                    .filter_by(exchange_symbol=exchange_symbol)
+                    .first())
+
+    if not exch:
+        raise click.BadParameter('Exchange "{0}" not found'.format(
+            exchange_symbol))
+
+    rows = iter_yearly_price_rows(exch.id)
+    _write_csv_export(output_file, YEARLY_PRICE_CSV_FIELDS, rows, is_gzip)
+
+
+@stockanalysis.command()
+@click.option('--exchange-symbol', default=None,
+              help='Only refresh this exchange (default: all exchanges)')
+@click.option('--full', default=False, is_flag=True,
+              help='Recompute all years, not just those touched by imports')
+@with_appcontext
+def refresh_returns(exchange_symbol, full):
+    """Refresh precomputed returns for all pairs of years."""
+    if exchange_symbol:
+        exch = (Exchange.query
+                        .filter_by(exchange_symbol=exchange_symbol)
+                        .first())
+
+        if not exch:
+            raise click.BadParameter('Exchange "{0}" not found'.format(
+                exchange_symbol))
+
+        exchanges = [exch]
+    else:
+        exchanges = Exchange.query.all()
+
+    refresh_exchanges_period_returns(exchanges, full=full, log=click.echo)
+
+    click.echo('Done!')
+
+
+@stockanalysis.command()
+@click.option('--exchange-symbol', prompt=True,
+              help='Exchange symbol')
+@click.option('--from-year', type=int, prompt=True,
+              help='From year')
+@click.option('--to-year', type=int, prompt=True,
+              help='To year')
+@click.option('--portfolios-file', type=click.File('r'), prompt=True,
+              help='JSON file of a list of {ticker_symbol: weight} objects')
+@click.option('--rebalance', default=False, is_flag=True,
+              help='Rebalance to the weights every year')
+@click.option('--limit', type=int, default=None,
+              help='Only output the top portfolios')
+@click.option('--output-file', type=click.File('w'), default='-',
+              help='JSON output file (default: stdout)')
+@with_appcontext
+def backtest(exchange_symbol, from_year, to_year, portfolios_file,
+             rebalance, limit, output_file):
+    """Backtest a batch of weighted portfolios."""
+    # Imported here so that NumPy is only needed for backtests.
+    from whatifstocks.stockanalysis.backtest import backtest_portfolios
+
+    exch = (Exchange.query
+                    .filter_by(exchange_symbol=exchange_symbol)
+                    .first())
+
+    if not exch:
+        raise click.BadParameter('Exchange "{0}" not found'.format(
+            exchange_symbol))
+
+    try:
+        portfolios = json.load(portfolios_file)
+        result = backtest_portfolios(
+            exch, from_year, to_year, portfolios, rebalance=rebalance,
+            limit=limit,
+            snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    json.dump(result, output_file, indent=2, sort_keys=True)
+
+
+@stockanalysis.command()
+@click.option('--exchange-symbol', default=None,
+              help='Only build this exchange (default: all exchanges)')
+@click.option('--snapshot-dir', default=None,
+              help='Snapshot directory (default: STOCKANALYSIS_SNAPSHOT_DIR)')
+@with_appcontext
+def build_snapshot(exchange_symbol, snapshot_dir):
+    """Build memory-mapped price snapshot files."""
+    # Imported here so that NumPy is only needed by the NumPy engine.
+    from whatifstocks.stockanalysis.pricematrix import build_price_snapshot
+
+    snapshot_dir = snapshot_dir or app.config['STOCKANALYSIS_SNAPSHOT_DIR']
+
+    if not snapshot_dir:
+        raise click.BadParameter(
+            '--snapshot-dir option or STOCKANALYSIS_SNAPSHOT_DIR setting '
+            'is required')
+
+    if exchange_symbol:
+        exch = (Exchange.query
+                        .filter_by(exchange_symbol=exchange_symbol)
+                        .first())
+
+        if not exch:
+            raise click.BadParameter('Exchange "{0}" not found'.format(
+                exchange_symbol))
+
+        exchanges = [exch]
     else:
-        _import_monthly_prices(exch, monthly_prices_csv)
+        exchanges = Exchange.query.all()
+
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    for exch in exchanges:
+        matrix = build_price_snapshot(exch, snapshot_dir)
+        click.echo('{0}: {1} stocks x {2} years'.format(
+            exch.exchange_symbol, matrix.num_stocks, matrix.num_years))
 
     click.echo('Done!')
@@ -0,0 +1,186 @@
+"""Concurrent, rate-limited downloader for stock monthly prices."""
+from collections import namedtuple
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ALPHAVANTAGE_MONTHLY_PRICES_KEY = 'Monthly Adjusted Time Series'
+ALPHAVANTAGE_TOOFREQUENT_ERRMSG = (
+    'if you would like to have a higher API call volume')
+ALPHAVANTAGE_ERROR_KEY = 'Error Message'
+
+
+TickerDownload = namedtuple(
+    'TickerDownload',
+    ['ticker_symbol', 'monthly_prices', 'tries', 'error'])
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter.
+
+    Tokens are added continuously at ``rate`` tokens per second, up to
+    ``capacity`` tokens. Each call to ``acquire()`` takes one token,
+    blocking the calling thread (and only that thread) until one is
+    available. A ``rate`` of ``None`` or ``0`` disables rate limiting.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.time, sleep=time.sleep):
+        self.rate = rate and float(rate) or None
+        self.capacity = float(max(capacity, 1))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute, capacity=1, **kwargs):
+        """Create a token bucket from a per-minute quota."""
+        rate = requests_per_minute and requests_per_minute / 60.0 or None
+        return cls(rate, capacity=capacity, **kwargs)
+
+    def _refill(self, now):
+        elapsed = max(now - self._updated_at, 0.0)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """Take one token, waiting until one is available."""
+        if not self.rate:
+            return 0.0
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                self._refill(self._clock())
+
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return waited
+
+                wait_secs = (1.0 - self._tokens) / self.rate
+
+            self._sleep(wait_secs)
+            waited += wait_secs
+
+
+class MonthlyPricesDownloader(object):
+    """Download monthly prices for many tickers using a pool of workers.
+
+    All workers share one ``requests.Session`` (so connections are kept
+    alive and pooled) and one ``TokenBucket`` (so the combined request
+    rate stays within the API quota). A failed ticker is retried with
+    jittered exponential backoff on its own worker thread, so it never
+    holds up the other tickers.
+    """
+
+    def __init__(
+            self, url_pattern, apikey, exchange_symbol, workers=1,
+            requests_per_minute=None, burst=1, max_tries=5,
+            backoff_base=1.0, backoff_max=60.0, timeout=30.0,
+            log=None, session=None, sleep=time.sleep):
+        self.url_pattern = url_pattern
+        self.apikey = apikey
+        self.exchange_symbol = exchange_symbol
+        self.workers = max(workers, 1)
+        self.rate_limiter = TokenBucket.per_minute(
+            requests_per_minute, capacity=burst, sleep=sleep)
+        self.max_tries = max_tries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.log = log or (lambda msg: None)
+        self.session = session or self._create_session()
+        self._sleep = sleep
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def backoff_secs(self, request_tries):
+        """Full-jitter exponential backoff for the given try number."""
+        ceiling = min(
+            self.backoff_max, self.backoff_base * (2 ** request_tries))
+        return random.uniform(0, ceiling)
+
+    def fetch(self, ticker_symbol):
+        """Fetch monthly prices for one ticker, retrying as needed."""
+        monthly_prices_url = self.url_pattern.format(
+            ticker_symbol, self.exchange_symbol, self.apikey)
+        ticker_label = '{0}.{1}'.format(ticker_symbol, self.exchange_symbol)
+        error = None
+        request_tries = 0
+
+        while request_tries < self.max_tries:
+            request_tries += 1
+            self.rate_limiter.acquire()
+            self.log('Try {0} fetching for {1}'.format(
+                request_tries, ticker_label))
+
+            try:
+                r = self.session.get(monthly_prices_url, timeout=self.timeout)
+                monthly_prices_json = r.json()
+            except (requests.RequestException, ValueError) as e:
+                error = 'request failed: {0}'.format(e)
+                monthly_prices_json = None
+
+            if monthly_prices_json is not None:
+                try:
+                    monthly_prices_raw = (
+                        monthly_prices_json[ALPHAVANTAGE_MONTHLY_PRICES_KEY])
+                    self.log('Fetched successfully for {0}'.format(
+                        ticker_label))
+                    return TickerDownload(
+                        ticker_symbol, monthly_prices_raw, request_tries,
+                        None)
+                except (KeyError, TypeError):
+                    monthly_prices_json_str = str(monthly_prices_json)
+
+                    if (
+                            ALPHAVANTAGE_TOOFREQUENT_ERRMSG
+                            in monthly_prices_json_str):
+                        error = 'calling too frequently'
+                    else:
+                        # Not a transient failure (e.g. unknown symbol), so
+                        # retrying would only burn through the quota.
+                        error = 'response was: {0}'.format(
+                            monthly_prices_json_str)
+                        self.log('Failed for {0}, {1}'.format(
+                            ticker_label, error))
+                        return TickerDownload(
+                            ticker_symbol, None, request_tries, error)
+
+            self.log('Failed for {0}: {1}'.format(ticker_label, error))
+
+            if request_tries < self.max_tries:
+                sleep_secs = self.backoff_secs(request_tries)
+                self.log('Sleeping for {0:.1f} secs before retrying {1}'.format(
+                    sleep_secs, ticker_label))
+                self._sleep(sleep_secs)
+
+        self.log('Give up on {0}'.format(ticker_label))
+        return TickerDownload(ticker_symbol, None, request_tries, error)
+
+    def download(self, ticker_symbols):
+        """Download all tickers, yielding results as they complete."""
+        if self.workers == 1:
+            for ticker_symbol in ticker_symbols:
+                yield self.fetch(ticker_symbol)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.fetch, ticker_symbol)
+                for ticker_symbol in ticker_symbols]
+
+            for future in as_completed(futures):
+                yield future.result()
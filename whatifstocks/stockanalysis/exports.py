@@ -0,0 +1,74 @@
+"""Streaming CSV exports of stock analysis data."""
+import io
+import zlib
+
+import unicodecsv as csv
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import Stock, StockYearlyPrice
+from whatifstocks.stockanalysis.queries import STREAM_BATCH_SIZE
+
+RANKING_CSV_FIELDS = (
+    'rank', 'ticker_symbol', 'title', 'industry_sector',
+    'avg_close_price_from', 'avg_close_price_to', 'price_change_percent')
+
+MULTI_PERIOD_CSV_FIELDS = (
+    ('exchange_symbol', 'from_year', 'to_year') + RANKING_CSV_FIELDS)
+
+YEARLY_PRICE_CSV_FIELDS = (
+    'ticker_symbol', 'year', 'close_at', 'close_price')
+
+
+def iter_yearly_price_rows(exchange_id, batch_size=STREAM_BATCH_SIZE):
+    """Stream an exchange's yearly prices as dicts, ordered by ticker."""
+    query = (
+        db.session
+          .query(
+              Stock.ticker_symbol, StockYearlyPrice.year,
+              StockYearlyPrice.close_at, StockYearlyPrice.close_price)
+          .join(StockYearlyPrice, StockYearlyPrice.stock_id == Stock.id)
+          .filter(Stock.exchange_id == exchange_id)
+          .order_by(Stock.ticker_symbol, StockYearlyPrice.close_at)
+          .yield_per(batch_size))
+
+    for ticker_symbol, year, close_at, close_price in query:
+        yield {
+            'ticker_symbol': ticker_symbol,
+            'year': year,
+            'close_at': close_at.isoformat(),
+            'close_price': close_price}
+
+
+def iter_csv_chunks(fields, rows, rows_per_chunk=STREAM_BATCH_SIZE):
+    """Encode dict rows as UTF-8 CSV, yielding one bytes chunk per batch."""
+    buf = io.BytesIO()
+    writer = csv.DictWriter(
+        buf, fields, encoding='utf-8', extrasaction='ignore')
+    writer.writeheader()
+    num_buffered = 0
+
+    for row in rows:
+        writer.writerow(row)
+        num_buffered += 1
+
+        if num_buffered >= rows_per_chunk:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            num_buffered = 0
+
+    yield buf.getvalue()
+
+
+def iter_gzip_chunks(chunks, compresslevel=6):
+    """Gzip a stream of bytes chunks, without buffering the whole stream."""
+    compressor = zlib.compressobj(
+        compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
@@ -0,0 +1,110 @@
+"""Rankings of the stocks of several exchanges together."""
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+
+from flask import current_app as app
+
+from whatifstocks.stockanalysis.models import Exchange
+from whatifstocks.stockanalysis.queries import (
+    yeartoyear_price_percent_change_ranking)
+
+GLOBAL_RANKING_FIELDS = (
+    'rank', 'exchange_symbol', 'stock_id', 'ticker_symbol', 'title',
+    'industry_sector', 'avg_close_price_from', 'avg_close_price_to',
+    'price_change_percent')
+
+
+def _exchange_ranking(flask_app, exchange_id, from_year, to_year, limit,
+                      cursor):
+    """One exchange's ranking, in its own app context.
+
+    Each worker thread gets its own DB session, so the exchanges' queries
+    run at the same time on separate connections.
+    """
+    with flask_app.app_context():
+        exch = Exchange.query.get(exchange_id)
+
+        return yeartoyear_price_percent_change_ranking(
+            exch, from_year, to_year, limit=limit, cursor=cursor)
+
+
+def _merge_keyed_rows(exchange_index, exchange_symbol, rows):
+    """Rows keyed on their order in a ranking, for ``heapq.merge``.
+
+    Stock IDs are unique across exchanges, so keys never tie and rows
+    are never compared.
+    """
+    for row in rows:
+        yield (-row[-1], row[0].id, exchange_index, exchange_symbol, row)
+
+
+def iter_global_ranking(exchanges, from_year, to_year, limit=None,
+                        cursor=None, workers=4):
+    """Stream the ranking of the stocks of all the given exchanges.
+
+    Each exchange is ranked as on its own, with the configured engine and
+    result cache, up to ``workers`` exchanges at a time on separate DB
+    connections, so this takes about as long as the largest one. Since
+    each ranking is ordered by descending change and then by stock ID,
+    and a ``RankingCursor``'s change and stock ID mean the same in every
+    exchange, they are then merged lazily into one ranking in that order.
+    With a ``limit``, only each exchange's top ``limit`` rows are needed.
+
+    Yields ``(exchange_symbol, row)`` tuples, with rows like those of the
+    single exchange ranking.
+    """
+    exchanges = list(exchanges)
+
+    if cursor is not None:
+        # The cursor's rank is in the global ranking, not in any one
+        # exchange's, so only its change and stock ID mean the same in
+        # each of them.
+        cursor = cursor._replace(rank=None)
+
+    if workers == 1 or len(exchanges) <= 1:
+        rankings = [
+            yeartoyear_price_percent_change_ranking(
+                exch, from_year, to_year, limit=limit, cursor=cursor)
+            for exch in exchanges]
+    else:
+        flask_app = app._get_current_object()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _exchange_ranking, flask_app, exch.id, from_year,
+                    to_year, limit, cursor)
+                for exch in exchanges]
+            rankings = [future.result() for future in futures]
+
+    merged_rows = heapq.merge(*[
+        _merge_keyed_rows(i, exch.exchange_symbol, rows)
+        for i, (exch, rows) in enumerate(zip(exchanges, rankings))])
+
+    for keyed_row in itertools.islice(merged_rows, limit or None):
+        yield keyed_row[3], keyed_row[4]
+
+
+def iter_global_ranking_rows(exchanges, from_year, to_year, limit=None,
+                             cursor=None, workers=4):
+    """Stream the ranking of several exchanges as dicts."""
+    rank = cursor and cursor.rank or 0
+
+    for exchange_symbol, row in iter_global_ranking(
+            exchanges, from_year, to_year, limit=limit, cursor=cursor,
+            workers=workers):
+        (stock, industry_sector, avg_close_price_from, avg_close_price_to,
+         price_change_percent) = row
+        rank += 1
+
+        yield {
+            'rank': rank,
+            'exchange_symbol': exchange_symbol,
+            'stock_id': stock.id,
+            'title': stock.title,
+            'ticker_symbol': stock.ticker_symbol,
+            'industry_sector': industry_sector.title,
+            'avg_close_price_from': avg_close_price_from,
+            'avg_close_price_to': avg_close_price_to,
+            'price_change_percent': price_change_percent}
@@ -0,0 +1,94 @@
+"""Stats of price changes between every pair of years, for heatmaps."""
+import warnings
+
+import numpy as np
+
+from whatifstocks.extensions import result_cache
+from whatifstocks.stockanalysis.pricematrix import (price_matrices,
+                                                    round_half_away)
+
+HEATMAP_FIELDS = (
+    'from_year', 'to_year', 'num_stocks', 'median_price_change_percent',
+    'top_decile_price_change_percent', 'best_stock_id',
+    'best_ticker_symbol', 'best_price_change_percent')
+
+HEATMAP_METRICS = (
+    'median_price_change_percent', 'top_decile_price_change_percent',
+    'best_price_change_percent')
+
+
+def period_heatmap_cells(matrix):
+    """Stats of the changes between every ``from_year < to_year`` pair.
+
+    For each pair with any stocks priced in both years, returns a dict
+    with the number of stocks, the median change, the top-decile cutoff
+    (the 90th percentile change), and the best stock and its change.
+    Changes are computed as in the ranking query, one from year at a
+    time for all stocks and to years at once, so the work is
+    O(stocks x years^2) with a loop over years only.
+    """
+    prices = np.asarray(matrix.prices)
+    ticker_symbols = None
+    cells = []
+
+    with np.errstate(invalid='ignore'):
+        is_priced = prices > 0.0
+
+    for i in range(matrix.num_years - 1):
+        prices_from = prices[:, i:i + 1]
+        prices_to = prices[:, i + 1:]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change_percent = round_half_away(
+                (prices_to - prices_from) / prices_from * 100.0)
+
+        change_percent[~(is_priced[:, i:i + 1] & is_priced[:, i + 1:])] = (
+            np.nan)
+        is_valid = ~np.isnan(change_percent)
+        num_stocks = is_valid.sum(axis=0)
+
+        if not num_stocks.any():
+            continue
+
+        with warnings.catch_warnings():
+            # Pairs without any stocks are skipped below.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            # Rounded like the ranking's and the sector rollups' changes.
+            medians = round_half_away(
+                np.nanmedian(change_percent, axis=0))
+            top_deciles = round_half_away(
+                np.nanpercentile(change_percent, 90, axis=0))
+
+        # The first of equal changes has the lowest stock ID, as in the
+        # ranking, since matrix rows are ordered by stock ID.
+        best_indexes = np.where(
+            is_valid, change_percent, -np.inf).argmax(axis=0)
+
+        if ticker_symbols is None:
+            ticker_symbols = matrix.ticker_symbols()
+
+        for j in np.flatnonzero(num_stocks).tolist():
+            best_index = int(best_indexes[j])
+            cells.append({
+                'from_year': matrix.first_year + i,
+                'to_year': matrix.first_year + i + 1 + j,
+                'num_stocks': int(num_stocks[j]),
+                'median_price_change_percent': float(medians[j]),
+                'top_decile_price_change_percent': float(top_deciles[j]),
+                'best_stock_id': int(matrix.stock_ids[best_index]),
+                'best_ticker_symbol': ticker_symbols[best_index],
+                'best_price_change_percent': float(
+                    change_percent[best_index, j])})
+
+    return cells
+
+
+def period_heatmap(exch, snapshot_dir=None):
+    """Heatmap cells of an exchange, cached on its data version."""
+    def create():
+        return period_heatmap_cells(price_matrices.get(
+            exch.id, exch.data_version, snapshot_dir=snapshot_dir))
+
+    cache_key = ('period_heatmap', exch.id, exch.data_version)
+
+    return result_cache.get_or_create(cache_key, create)
@@ -0,0 +1,527 @@
+"""Bulk, set-based importers for stock prices."""
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+import io
+from multiprocessing import Pool
+import os
+
+import click
+
+from whatifstocks.compat import text_type
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import Stock, StockYearlyPrice
+from whatifstocks.stockanalysis.periodreturns import mark_dirty_years
+
+PRICE_SCALE = 4
+PRICE_QUANTUM = Decimal('0.0001')
+# Monthly prices are summed at a finer scale than they're stored at, so that
+# sums and averages are only rounded once, like the Decimal importers do.
+AGGREGATE_SCALE = 10
+
+UPSERT_MONTHLY_PRICES_SQL = """
+INSERT INTO stock_yearly_price (
+    stock_id, close_at, year, close_price, close_price_sum,
+    close_price_count, close_months)
+SELECT
+    imported.stock_id, make_date(imported.year, 1, 1), imported.year,
+    round(sum(imported.close_price) / count(*), 4),
+    sum(imported.close_price), count(*),
+    bit_or(1 << (imported.month - 1))
+FROM (
+    SELECT DISTINCT ON (stock_id, year, month)
+        stock_id, year, month, close_price
+    FROM monthly_price_import
+    ORDER BY stock_id, year, month, close_at DESC) AS imported
+LEFT OUTER JOIN stock_yearly_price AS existing
+    ON existing.year = imported.year
+    AND existing.stock_id = imported.stock_id
+WHERE existing.id IS NULL
+    OR existing.close_months & (1 << (imported.month - 1)) = 0
+GROUP BY imported.stock_id, imported.year
+ON CONFLICT ON CONSTRAINT _syp_sid_price_uc DO UPDATE SET
+    close_price = round(
+        (stock_yearly_price.close_price_sum + excluded.close_price_sum) /
+        (stock_yearly_price.close_price_count + excluded.close_price_count),
+        4),
+    close_price_sum = (
+        stock_yearly_price.close_price_sum + excluded.close_price_sum),
+    close_price_count = (
+        stock_yearly_price.close_price_count + excluded.close_price_count),
+    close_months = stock_yearly_price.close_months | excluded.close_months
+RETURNING year
+"""
+
+
+def close_month_bit(close_at_raw):
+    """Bit for the month of a ``YYYY-MM-DD`` date (bit 0 is January)."""
+    return 1 << (int(close_at_raw.split('-')[1]) - 1)
+
+
+def stock_ids_by_ticker(exchange_id):
+    """Map of ticker symbol to stock ID for all stocks in an exchange."""
+    return dict(
+        db.session.query(Stock.ticker_symbol, Stock.id)
+                  .filter(Stock.exchange_id == exchange_id))
+
+
+def _yearly_price_rows(stock_id, prices_by_year):
+    for year in sorted(prices_by_year):
+        price_sum, price_count, months = prices_by_year[year]
+        close_price = (price_sum / price_count).quantize(
+            PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+        yield (
+            stock_id, date(year, 1, 1), close_price,
+            price_sum.quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP),
+            price_count, months)
+
+
+def iter_yearly_prices(monthly_prices, stock_ids):
+    """Stream yearly average price rows from monthly price rows.
+
+    Monthly prices must be grouped by ticker symbol (as written by
+    ``download_stock_monthly_prices``). Only one ticker's running
+    per-year sums are held in memory at a time, so memory use doesn't
+    depend on the size of the input.
+
+    Yields ``(stock_id, close_at, close_price, close_price_sum,
+    close_price_count, close_months)`` tuples.
+    """
+    ticker_symbol = None
+    stock_id = None
+    prices_by_year = {}
+    seen_ticker_symbols = set()
+
+    for monthly_price_raw in monthly_prices:
+        close_price = Decimal(monthly_price_raw['close_price'])
+
+        if close_price == Decimal('0'):
+            continue
+
+        row_ticker_symbol = monthly_price_raw['ticker_symbol']
+
+        if row_ticker_symbol != ticker_symbol:
+            if stock_id is not None:
+                for row in _yearly_price_rows(stock_id, prices_by_year):
+                    yield row
+
+            if row_ticker_symbol in seen_ticker_symbols:
+                raise click.BadParameter(
+                    'Monthly prices for "{0}" are not grouped together'.format(
+                        row_ticker_symbol))
+
+            if row_ticker_symbol not in stock_ids:
+                raise click.BadParameter(
+                    'No stock found for ticker symbol "{0}"'.format(
+                        row_ticker_symbol))
+
+            ticker_symbol = row_ticker_symbol
+            stock_id = stock_ids[ticker_symbol]
+            seen_ticker_symbols.add(ticker_symbol)
+            prices_by_year = {}
+
+        close_at_raw = monthly_price_raw['close_at']
+        close_at_year = int(close_at_raw.split('-')[0])
+        price_sum, price_count, months = prices_by_year.get(
+            close_at_year, (Decimal('0'), 0, 0))
+        prices_by_year[close_at_year] = (
+            price_sum + close_price, price_count + 1,
+            months | close_month_bit(close_at_raw))
+
+    if stock_id is not None:
+        for row in _yearly_price_rows(stock_id, prices_by_year):
+            yield row
+
+
+def _copy_yearly_prices(connection, rows):
+    """Write rows with PostgreSQL COPY."""
+    buf = io.StringIO()
+
+    for (stock_id, close_at, close_price, price_sum, price_count,
+         months) in rows:
+        buf.write(u'{0},{1},{2},{3},{4},{5},{6}\n'.format(
+            stock_id, close_at.isoformat(), close_at.year,
+            text_type(close_price), text_type(price_sum), price_count,
+            months))
+
+    buf.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY {0} (stock_id, close_at, year, close_price, '
+            'close_price_sum, close_price_count, close_months) '
+            'FROM STDIN WITH (FORMAT csv)'.format(
+                StockYearlyPrice.__tablename__),
+            buf)
+    finally:
+        cursor.close()
+
+
+def _insert_yearly_prices(connection, rows):
+    """Write rows with a multi-row INSERT."""
+    connection.execute(
+        StockYearlyPrice.__table__.insert().values([
+            {'stock_id': stock_id, 'close_at': close_at,
+             'year': close_at.year, 'close_price': close_price,
+             'close_price_sum': price_sum, 'close_price_count': price_count,
+             'close_months': months}
+            for (stock_id, close_at, close_price, price_sum, price_count,
+                 months) in rows]))
+
+
+def write_yearly_prices(exch, yearly_prices, batch_size=10000):
+    """Write yearly price rows in batches, committing after each batch.
+
+    Uses COPY on PostgreSQL and a multi-row INSERT elsewhere. Each year is
+    marked dirty in the transaction of the first batch that writes it, so
+    that a refresh of the period returns can't miss a committed batch, and
+    the exchange's data version is bumped in every batch's transaction, so
+    that cached results never outlive a committed batch, even if a later
+    one fails. Returns the number of rows written and the set of years
+    written.
+    """
+    num_rows = 0
+    years = set()
+    batch = []
+
+    def flush():
+        connection = db.session.connection()
+
+        if connection.dialect.name == 'postgresql':
+            _copy_yearly_prices(connection, batch)
+        else:
+            _insert_yearly_prices(connection, batch)
+
+        batch_years = set(row[1].year for row in batch)
+        mark_dirty_years(exch.id, batch_years - years)
+        years.update(batch_years)
+        exch.bump_data_version(commit=False)
+        db.session.commit()
+
+    for row in yearly_prices:
+        batch.append(row)
+
+        if len(batch) >= batch_size:
+            flush()
+            num_rows += len(batch)
+            batch = []
+
+    if batch:
+        flush()
+        num_rows += len(batch)
+
+    return num_rows, years
+
+
+def bulk_import_monthly_prices(exch, monthly_prices, batch_size=10000):
+    """Import monthly prices as yearly averages using batched writes.
+
+    Returns the number of rows written and the set of years written.
+    """
+    stock_ids = stock_ids_by_ticker(exch.id)
+
+    return write_yearly_prices(
+        exch, iter_yearly_prices(monthly_prices, stock_ids),
+        batch_size=batch_size)
+
+
+def parse_fixed_point(price_raw, scale=PRICE_SCALE):
+    """Parse a decimal string into an integer number of 10**-scale units.
+
+    Digits beyond ``scale`` decimal places are rounded half up, e.g.
+    ``parse_fixed_point('12.34567')`` is ``123457``.
+    """
+    whole, _, fraction = price_raw.strip().partition('.')
+    fraction = fraction.ljust(scale + 1, '0')
+    value = int(whole or '0') * (10 ** scale) + int(fraction[:scale])
+
+    if int(fraction[scale]) >= 5:
+        value += 1
+
+    return value
+
+
+def fixed_point_decimal(value, scale=PRICE_SCALE):
+    """A fixed-point integer as a Decimal, rounded half up to a price."""
+    return Decimal(value).scaleb(-scale).quantize(
+        PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def fixed_point_average(price_sum, price_count, scale=PRICE_SCALE):
+    """Average of fixed-point integers, rounded half up to a price."""
+    divisor = price_count * 10 ** (scale - PRICE_SCALE)
+    avg = (2 * price_sum + divisor) // (2 * divisor)
+    return Decimal(avg).scaleb(-PRICE_SCALE)
+
+
+def chunk_offsets(path, num_chunks):
+    """Split a file into byte ranges that start and end on line boundaries.
+
+    The first range starts after the header line. Returns a list of
+    ``(start, end)`` tuples.
+    """
+    file_size = os.path.getsize(path)
+    offsets = []
+
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+
+        for i in range(1, num_chunks + 1):
+            if i == num_chunks:
+                end = file_size
+            else:
+                f.seek(max(start, file_size * i // num_chunks))
+                f.readline()
+                end = f.tell()
+
+            if end > start:
+                offsets.append((start, end))
+                start = end
+
+    return offsets
+
+
+def read_csv_header(path):
+    """Column names from the header line of a CSV file."""
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8-sig')
+
+    return [col.strip() for col in header.split(',')]
+
+
+def aggregate_monthly_prices_chunk(args):
+    """Sum and count monthly prices by (ticker symbol, year) for a chunk.
+
+    Runs in a worker process. Prices are summed as fixed-point integers of
+    ``AGGREGATE_SCALE`` decimal places.
+    Returns ``(bytes_read, {(ticker_symbol, year): [sum, count, months]})``,
+    where ``months`` is a bitmask of the months seen.
+    """
+    path, start, end, col_indexes = args
+    ticker_col, close_at_col, close_price_col = col_indexes
+    aggregates = {}
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8').splitlines()
+
+    for line in lines:
+        if not line:
+            continue
+
+        cols = line.split(',')
+        close_price = parse_fixed_point(
+            cols[close_price_col], scale=AGGREGATE_SCALE)
+
+        if not close_price:
+            continue
+
+        close_at_raw = cols[close_at_col]
+        key = (cols[ticker_col], int(close_at_raw.split('-')[0]))
+        month_bit = close_month_bit(close_at_raw)
+        agg = aggregates.get(key)
+
+        if agg is None:
+            aggregates[key] = [close_price, 1, month_bit]
+        else:
+            agg[0] += close_price
+            agg[1] += 1
+            agg[2] |= month_bit
+
+    return end - start, aggregates
+
+
+def merge_aggregates(aggregates, partial):
+    """Merge partial (ticker symbol, year) sums and counts into aggregates."""
+    for key, (price_sum, price_count, months) in partial.items():
+        agg = aggregates.get(key)
+
+        if agg is None:
+            aggregates[key] = [price_sum, price_count, months]
+        else:
+            agg[0] += price_sum
+            agg[1] += price_count
+            agg[2] |= months
+
+    return aggregates
+
+
+def parallel_aggregate_monthly_prices(
+        path, workers, chunks_per_worker=4, max_chunk_bytes=32 * 1024 * 1024,
+        progress=None):
+    """Aggregate a monthly prices CSV file using a pool of processes.
+
+    The file is split into byte ranges, each parsed and aggregated in a
+    worker process, and the partial aggregates merged as they come back.
+    ``progress`` is called with the number of bytes processed so far.
+    """
+    header = read_csv_header(path)
+
+    try:
+        col_indexes = (
+            header.index('ticker_symbol'), header.index('close_at'),
+            header.index('close_price'))
+    except ValueError:
+        raise click.BadParameter(
+            'Monthly prices file must have ticker_symbol, close_at and '
+            'close_price columns')
+
+    num_chunks = max(
+        workers * chunks_per_worker,
+        os.path.getsize(path) // max_chunk_bytes + 1)
+    tasks = [
+        (path, start, end, col_indexes)
+        for start, end in chunk_offsets(path, num_chunks)]
+    aggregates = {}
+
+    if progress and tasks:
+        # Account for the header line, which no chunk includes.
+        progress(tasks[0][1])
+
+    pool = Pool(processes=workers)
+    try:
+        for bytes_read, partial in pool.imap_unordered(
+                aggregate_monthly_prices_chunk, tasks):
+            merge_aggregates(aggregates, partial)
+
+            if progress:
+                progress(bytes_read)
+    finally:
+        pool.terminate()
+
+    return aggregates
+
+
+def iter_aggregated_yearly_prices(aggregates, stock_ids):
+    """Yearly price rows from merged (ticker symbol, year) aggregates."""
+    for (ticker_symbol, year) in sorted(aggregates):
+        if ticker_symbol not in stock_ids:
+            raise click.BadParameter(
+                'No stock found for ticker symbol "{0}"'.format(
+                    ticker_symbol))
+
+        price_sum, price_count, months = aggregates[(ticker_symbol, year)]
+
+        yield (
+            stock_ids[ticker_symbol], date(year, 1, 1),
+            fixed_point_average(
+                price_sum, price_count, scale=AGGREGATE_SCALE),
+            fixed_point_decimal(price_sum, scale=AGGREGATE_SCALE),
+            price_count, months)
+
+
+def parallel_import_monthly_prices(
+        exch, path, workers, batch_size=10000, progress=None):
+    """Import a monthly prices file, parsing it in parallel processes.
+
+    Returns the number of rows written and the set of years written.
+    """
+    stock_ids = stock_ids_by_ticker(exch.id)
+    aggregates = parallel_aggregate_monthly_prices(
+        path, workers, progress=progress)
+
+    return write_yearly_prices(
+        exch, iter_aggregated_yearly_prices(aggregates, stock_ids),
+        batch_size=batch_size)
+
+
+def has_untracked_yearly_prices(exchange_id):
+    """Whether an exchange has yearly prices without monthly totals."""
+    return db.session.query(
+        StockYearlyPrice.query
+                        .join(Stock, StockYearlyPrice.stock_id == Stock.id)
+                        .filter(Stock.exchange_id == exchange_id)
+                        .filter(StockYearlyPrice.close_months.is_(None))
+                        .exists()).scalar()
+
+
+def _copy_monthly_prices(connection, rows):
+    """Stage monthly price rows in the import table with COPY."""
+    buf = io.StringIO()
+
+    for stock_id, close_at, year, month, close_price in rows:
+        buf.write(u'{0},{1},{2},{3},{4}\n'.format(
+            stock_id, close_at, year, month, text_type(close_price)))
+
+    buf.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY monthly_price_import '
+            '(stock_id, close_at, year, month, close_price) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buf)
+    finally:
+        cursor.close()
+
+
+def upsert_monthly_prices(exch, monthly_prices, batch_size=10000):
+    """Merge monthly prices into yearly prices, skipping months seen before.
+
+    Monthly prices are staged in a temporary table, then merged with a
+    single INSERT ... ON CONFLICT that adds only months missing from each
+    stock year's running totals, and recomputes the average of just those
+    stock years. If a month has several prices, only its latest is used.
+    The whole import, including marking its years dirty and bumping the
+    exchange's data version, is one transaction. PostgreSQL only.
+
+    Returns the number of yearly prices written and the set of their years.
+    """
+    connection = db.session.connection()
+
+    if connection.dialect.name != 'postgresql':
+        raise click.BadParameter('Incremental import requires PostgreSQL')
+
+    if has_untracked_yearly_prices(exch.id):
+        raise click.BadParameter(
+            'Exchange "{0}" has yearly prices imported without monthly '
+            'totals, delete them and import them again first'.format(
+                exch.exchange_symbol))
+
+    stock_ids = stock_ids_by_ticker(exch.id)
+    connection.execute(
+        'CREATE TEMPORARY TABLE monthly_price_import ('
+        'stock_id integer NOT NULL, close_at date NOT NULL, '
+        'year integer NOT NULL, month integer NOT NULL, '
+        'close_price numeric(12,4) NOT NULL) '
+        'ON COMMIT DROP')
+    batch = []
+
+    for monthly_price_raw in monthly_prices:
+        close_price = Decimal(monthly_price_raw['close_price'])
+
+        if close_price == Decimal('0'):
+            continue
+
+        ticker_symbol = monthly_price_raw['ticker_symbol']
+
+        if ticker_symbol not in stock_ids:
+            raise click.BadParameter(
+                'No stock found for ticker symbol "{0}"'.format(
+                    ticker_symbol))
+
+        close_at_raw = monthly_price_raw['close_at']
+        year, month = close_at_raw.split('-')[:2]
+        batch.append((
+            stock_ids[ticker_symbol], close_at_raw, int(year), int(month),
+            close_price))
+
+        if len(batch) >= batch_size:
+            _copy_monthly_prices(connection, batch)
+            batch = []
+
+    if batch:
+        _copy_monthly_prices(connection, batch)
+
+    connection.execute('ANALYZE monthly_price_import')
+    years = [row[0] for row in connection.execute(UPSERT_MONTHLY_PRICES_SQL)]
+    mark_dirty_years(exch.id, years)
+
+    if years:
+        exch.bump_data_version(commit=False)
+
+    db.session.commit()
+
+    return len(years), set(years)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from whatifstocks.database import (Model, reference_col, SurrogatePK,
                                    Titled)
 from whatifstocks.extensions import db
@@ -8,6 +10,13 @@ class Exchange(SurrogatePK, Titled, Model):
 
     exchange_symbol = db.Column(
         db.String(255), nullable=False, default='')
+    # Incremented whenever the exchange's stocks or prices change.
+    data_version = db.Column(
+        db.Integer(), nullable=False, default=0, server_default='0')
+    # When the data version was last bumped (UTC).
+    data_updated_at = db.Column(
+        db.DateTime(), nullable=False, default=datetime.utcnow,
+        server_default=db.func.now())
 
     stocks = db.relationship(
         'Stock', backref=db.backref('exchange'),
@@ -17,6 +26,13 @@ class Exchange(SurrogatePK, Titled, Model):
         db.UniqueConstraint(
             'exchange_symbol', name='_exch_symbol_uc'),)
 
+    def bump_data_version(self, commit=True):
+        """Mark the exchange's data as changed."""
+        # Increment in SQL, so that concurrent imports can't lose a bump.
+        self.data_version = Exchange.data_version + 1
+        self.data_updated_at = datetime.utcnow()
+        return self.save(commit=commit)
+
     def __repr__(self):
         return ((
             'Exchange(id={0}, exchange_symbol="{1}", '
@@ -70,15 +86,74 @@ class StockYearlyPrice(SurrogatePK, Model):
     __tablename__ = 'stock_yearly_price'
 
     close_at = db.Column(db.Date(), nullable=False)
+    year = db.Column(db.Integer(), nullable=False)
     close_price = db.Column(db.Numeric(12,4), nullable=False)
     stock_id = reference_col('stock')
 
+    # Running totals of the monthly prices averaged into close_price, and
+    # a bitmask of their months (bit 0 is January), so that incremental
+    # imports can merge in only the months not seen yet. NULL for prices
+    # imported before these were tracked.
+    close_price_sum = db.Column(db.Numeric(16,4), nullable=True)
+    close_price_count = db.Column(db.Integer(), nullable=True)
+    close_months = db.Column(db.Integer(), nullable=True)
+
+    # The covering index also INCLUDEs close_price on Postgres 11+
+    # (see migration 3f1c2a9d7e54), so the ranking query can be
+    # answered with an index-only scan.
+    __table_args__ = (
+        db.UniqueConstraint(
+            'stock_id', 'close_at', name='_syp_sid_price_uc'),
+        db.Index('_syp_year_sid_ix', 'year', 'stock_id'),)
+
+    def __repr__(self):
+        return ((
+            'StockYearlyPrice(id={0}, close_at={1}, year={2}, '
+            'close_price={3}, stock_id={4})').format(
+                self.id, self.close_at, self.year, self.close_price,
+                self.stock_id))
+
+
+class StockPeriodReturn(SurrogatePK, Model):
+    """Precomputed price change of a stock between two years."""
+
+    __tablename__ = 'stock_period_return'
+
+    exchange_id = reference_col('exchange')
+    stock_id = reference_col('stock')
+    from_year = db.Column(db.Integer(), nullable=False)
+    to_year = db.Column(db.Integer(), nullable=False)
+    avg_close_price_from = db.Column(db.Numeric(12,4), nullable=False)
+    avg_close_price_to = db.Column(db.Numeric(12,4), nullable=False)
+    price_change_percent = db.Column(db.Numeric(), nullable=False)
+    rank = db.Column(db.Integer(), nullable=False)
+
     __table_args__ = (
         db.UniqueConstraint(
-            'stock_id', 'close_at', name='_syp_sid_price_uc'),)
+            'exchange_id', 'from_year', 'to_year', 'rank',
+            name='_spr_eid_years_rank_uc'),)
+
+    def __repr__(self):
+        return ((
+            'StockPeriodReturn(id={0}, exchange_id={1}, stock_id={2}, '
+            'from_year={3}, to_year={4}, price_change_percent={5}, '
+            'rank={6})').format(
+                self.id, self.exchange_id, self.stock_id, self.from_year,
+                self.to_year, self.price_change_percent, self.rank))
+
+
+class ExchangeDirtyYear(SurrogatePK, Model):
+    """A year whose period returns need to be recomputed for an exchange."""
+
+    __tablename__ = 'exchange_dirty_year'
+
+    exchange_id = reference_col('exchange')
+    year = db.Column(db.Integer(), nullable=False)
+
+    __table_args__ = (
+        db.Index('_edy_eid_year_ix', 'exchange_id', 'year'),)
 
     def __repr__(self):
         return ((
-            'StockYearlyPrice(id={0}, close_at={1}, '
-            'close_price={2}, stock_id={3})').format(
-                self.id, self.close_at, self.close_price, self.stock_id))
+            'ExchangeDirtyYear(id={0}, exchange_id={1}, year={2})').format(
+                self.id, self.exchange_id, self.year))
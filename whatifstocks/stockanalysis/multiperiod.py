@@ -0,0 +1,147 @@
+"""Rankings for many pairs of years, across exchanges, in one query."""
+from sqlalchemy import and_, literal_column, select, tuple_
+from sqlalchemy.sql import func
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import (Exchange, IndustrySector,
+                                               Stock, StockYearlyPrice)
+from whatifstocks.stockanalysis.queries import STREAM_BATCH_SIZE
+
+MULTI_PERIOD_FIELDS = (
+    'exchange_symbol', 'from_year', 'to_year', 'rank', 'stock_id',
+    'ticker_symbol', 'title', 'industry_sector', 'avg_close_price_from',
+    'avg_close_price_to', 'price_change_percent')
+
+
+def parse_year_pairs(periods_raw):
+    """Parse comma-separated ``from-to`` year pairs, e.g. ``2000-2010``.
+
+    Returns a list of ``(from_year, to_year)`` tuples without duplicates,
+    raising ValueError if any pair is invalid.
+    """
+    year_pairs = []
+
+    for period_raw in periods_raw.split(','):
+        period_raw = period_raw.strip()
+
+        if not period_raw:
+            continue
+
+        try:
+            from_year_raw, to_year_raw = period_raw.split('-')
+            year_pair = (int(from_year_raw), int(to_year_raw))
+        except ValueError:
+            raise ValueError(
+                'Invalid period "{0}" (expected from_year-to_year)'.format(
+                    period_raw))
+
+        if year_pair not in year_pairs:
+            year_pairs.append(year_pair)
+
+    if not year_pairs:
+        raise ValueError('At least one period is required')
+
+    return year_pairs
+
+
+def multi_period_query(exchange_ids, year_pairs, limit=None):
+    """Query the rankings of several exchanges for several pairs of years.
+
+    The yearly average prices of every year in any pair are aggregated
+    once, in a single scan of ``stock_yearly_price``, and then joined to
+    themselves for every pair. Changes and ranks are the same as in
+    ``yeartoyear_price_percent_change_query``. Pass ``limit`` to get only
+    the top rows of each ranking.
+
+    Rows are ordered by exchange symbol, from year, to year and rank.
+    """
+    syp_t = StockYearlyPrice.__table__
+    s_t = Stock.__table__
+    is_t = IndustrySector.__table__
+    e_t = Exchange.__table__
+    years = sorted(set(year for year_pair in year_pairs for year in year_pair))
+
+    prices = (
+        select([
+            syp_t.c.stock_id, s_t.c.exchange_id, syp_t.c.year,
+            func.avg(syp_t.c.close_price).label('avg_close_price')])
+            .select_from(syp_t.join(s_t, syp_t.c.stock_id == s_t.c.id))
+            .where(and_(
+                s_t.c.exchange_id.in_(exchange_ids),
+                syp_t.c.year.in_(years)))
+            .group_by(syp_t.c.stock_id, s_t.c.exchange_id, syp_t.c.year)
+            .cte('prices'))
+    prices_from = prices.alias('prices_from')
+    prices_to = prices.alias('prices_to')
+
+    price_change_percent = func.round(
+        (prices_to.c.avg_close_price - prices_from.c.avg_close_price) /
+        prices_from.c.avg_close_price * literal_column('100.0'),
+        4)
+    rank = func.row_number().over(
+        partition_by=[
+            prices_from.c.exchange_id, prices_from.c.year, prices_to.c.year],
+        order_by=[price_change_percent.desc(), prices_from.c.stock_id])
+
+    changes = (
+        select([
+            prices_from.c.exchange_id,
+            prices_from.c.stock_id,
+            prices_from.c.year.label('from_year'),
+            prices_to.c.year.label('to_year'),
+            rank.label('rank'),
+            func.round(prices_from.c.avg_close_price, 4).label(
+                'avg_close_price_from'),
+            func.round(prices_to.c.avg_close_price, 4).label(
+                'avg_close_price_to'),
+            price_change_percent.label('price_change_percent')])
+            .select_from(prices_from.join(prices_to, and_(
+                prices_from.c.stock_id == prices_to.c.stock_id,
+                tuple_(prices_from.c.year, prices_to.c.year).in_(
+                    year_pairs))))
+            .where(and_(
+                prices_from.c.avg_close_price > 0,
+                prices_to.c.avg_close_price > 0))
+            .alias('changes'))
+
+    query = (
+        select([
+            e_t.c.exchange_symbol, changes.c.from_year, changes.c.to_year,
+            changes.c.rank, changes.c.stock_id, s_t.c.ticker_symbol,
+            s_t.c.title, is_t.c.title.label('industry_sector'),
+            changes.c.avg_close_price_from, changes.c.avg_close_price_to,
+            changes.c.price_change_percent])
+            .select_from(
+                changes.join(s_t, changes.c.stock_id == s_t.c.id)
+                       .join(is_t, s_t.c.industry_sector_id == is_t.c.id)
+                       .join(e_t, changes.c.exchange_id == e_t.c.id))
+            .order_by(
+                e_t.c.exchange_symbol, changes.c.from_year,
+                changes.c.to_year, changes.c.rank))
+
+    if limit:
+        query = query.where(changes.c.rank <= limit)
+
+    return query
+
+
+def iter_multi_period_rows(
+        exchange_ids, year_pairs, limit=None, batch_size=STREAM_BATCH_SIZE):
+    """Stream multi-period ranking rows as dicts, from a server-side cursor."""
+    result = (
+        db.session
+          .connection()
+          .execution_options(stream_results=True)
+          .execute(multi_period_query(exchange_ids, year_pairs, limit=limit)))
+
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+
+            if not rows:
+                break
+
+            for row in rows:
+                yield dict(zip(MULTI_PERIOD_FIELDS, row))
+    finally:
+        result.close()
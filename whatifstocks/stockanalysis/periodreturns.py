@@ -0,0 +1,243 @@
+"""Precomputed stock returns for every pair of years."""
+from sqlalchemy import and_, literal, literal_column, or_, select
+from sqlalchemy.sql import func
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import (ExchangeDirtyYear,
+                                               IndustrySector, Stock,
+                                               StockPeriodReturn,
+                                               StockYearlyPrice)
+from whatifstocks.stockanalysis.rankingrows import LightRankingResult
+
+
+def mark_dirty_years(exchange_id, years):
+    """Record that an exchange's prices changed for the given years.
+
+    Doesn't commit. Each call adds new rows, so that a refresh that is
+    already running can't clear a mark made after it started.
+    """
+    if not years:
+        return
+
+    db.session.bulk_insert_mappings(
+        ExchangeDirtyYear,
+        [{'exchange_id': exchange_id, 'year': year} for year in set(years)])
+
+
+def dirty_years_by_exchange():
+    """Map of exchange ID to ``(dirty row IDs, set of dirty years)``."""
+    dirty = {}
+
+    for edy_id, exchange_id, year in (
+            db.session.query(
+                ExchangeDirtyYear.id, ExchangeDirtyYear.exchange_id,
+                ExchangeDirtyYear.year)):
+        edy_ids, years = dirty.setdefault(exchange_id, ([], set()))
+        edy_ids.append(edy_id)
+        years.add(year)
+
+    return dirty
+
+
+def has_dirty_years(exchange_id, years):
+    """Whether any of the given years are awaiting a refresh."""
+    return db.session.query(
+        ExchangeDirtyYear.query
+                         .filter(ExchangeDirtyYear.exchange_id == exchange_id)
+                         .filter(ExchangeDirtyYear.year.in_(years))
+                         .exists()).scalar()
+
+
+def can_use_precomputed_returns(exchange_id, from_year, to_year):
+    """Whether the precomputed returns of a pair of years are up to date."""
+    return from_year < to_year and not has_dirty_years(
+        exchange_id, [from_year, to_year])
+
+
+def refresh_period_returns(exchange_id, years=None):
+    """Recompute an exchange's returns for pairs of years.
+
+    Recomputes every ``from_year < to_year`` pair where either year is in
+    ``years`` (or every pair if ``years`` is None), in a single
+    INSERT ... SELECT. Doesn't commit. Returns the number of rows written.
+    """
+    spr_t = StockPeriodReturn.__table__
+    syp_t = StockYearlyPrice.__table__
+    s_t = Stock.__table__
+
+    delete = spr_t.delete().where(spr_t.c.exchange_id == exchange_id)
+
+    if years is not None:
+        years = sorted(years)
+        delete = delete.where(or_(
+            spr_t.c.from_year.in_(years), spr_t.c.to_year.in_(years)))
+
+    db.session.execute(delete)
+
+    prices = (
+        select([
+            syp_t.c.stock_id, syp_t.c.year,
+            func.avg(syp_t.c.close_price).label('avg_close_price')])
+            .select_from(syp_t.join(s_t, syp_t.c.stock_id == s_t.c.id))
+            .where(s_t.c.exchange_id == exchange_id)
+            .group_by(syp_t.c.stock_id, syp_t.c.year)
+            .cte('prices'))
+    prices_from = prices.alias('prices_from')
+    prices_to = prices.alias('prices_to')
+
+    # Same expression as the live ranking query, so results are identical.
+    price_change_percent = func.round(
+        (prices_to.c.avg_close_price - prices_from.c.avg_close_price) /
+        prices_from.c.avg_close_price * literal_column('100.0'),
+        4)
+    rank = func.row_number().over(
+        partition_by=[prices_from.c.year, prices_to.c.year],
+        order_by=[price_change_percent.desc(), prices_from.c.stock_id])
+
+    where_clauses = [
+        prices_from.c.avg_close_price > 0,
+        prices_to.c.avg_close_price > 0]
+
+    if years is not None:
+        where_clauses.append(or_(
+            prices_from.c.year.in_(years), prices_to.c.year.in_(years)))
+
+    returns = (
+        select([
+            literal(exchange_id), prices_from.c.stock_id,
+            prices_from.c.year, prices_to.c.year,
+            func.round(prices_from.c.avg_close_price, 4),
+            func.round(prices_to.c.avg_close_price, 4),
+            price_change_percent, rank])
+            .select_from(prices_from.join(prices_to, and_(
+                prices_from.c.stock_id == prices_to.c.stock_id,
+                prices_from.c.year < prices_to.c.year)))
+            .where(and_(*where_clauses)))
+
+    result = db.session.execute(spr_t.insert().from_select(
+        [
+            'exchange_id', 'stock_id', 'from_year', 'to_year',
+            'avg_close_price_from', 'avg_close_price_to',
+            'price_change_percent', 'rank'],
+        returns))
+
+    return result.rowcount
+
+
+def refresh_exchanges_period_returns(exchanges, full=False, log=None):
+    """Refresh returns for the years touched since the last refresh.
+
+    With ``full``, all years are recomputed. Each exchange is refreshed
+    and committed in its own transaction, together with clearing the
+    dirty marks it handled.
+    """
+    log = log or (lambda msg: None)
+    dirty = dirty_years_by_exchange()
+
+    for exch in exchanges:
+        edy_ids, years = dirty.get(exch.id, ([], set()))
+
+        if not (full or years):
+            continue
+
+        num_rows = refresh_period_returns(
+            exch.id, years=(None if full else years))
+
+        if edy_ids:
+            (ExchangeDirtyYear.query
+                              .filter(ExchangeDirtyYear.id.in_(edy_ids))
+                              .delete(synchronize_session=False))
+
+        db.session.commit()
+
+        log('{0}: {1} returns refreshed for {2}'.format(
+            exch.exchange_symbol, num_rows,
+            full and 'all years' or '{0} years'.format(len(years))))
+
+
+def yeartoyear_price_percent_change_precomputed_query(
+        exchange_id, from_year, to_year, limit=None, cursor=None,
+        light=False):
+    """Query precomputed percent change in prices between two years.
+
+    Same columns (``light`` or not) and order as
+    ``yeartoyear_price_percent_change_query``, but read with an index
+    range scan over the stored ranks. Keyset pagination only needs the
+    cursor's rank. A cursor without a rank (whose rank isn't one in this
+    ranking) is compared on its change and stock ID instead, like in the
+    live query.
+    """
+    spr_t = StockPeriodReturn.__table__.alias('stock_period_return')
+    s_t = Stock.__table__.alias('stock')
+    is_t = IndustrySector.__table__.alias('industry_sector')
+    price_cols = [
+        spr_t.c.avg_close_price_from.label('avg_close_price_from'),
+        spr_t.c.avg_close_price_to.label('avg_close_price_to'),
+        spr_t.c.price_change_percent.label('price_change_percent')]
+
+    if light:
+        select_cols = [
+            s_t.c.id, s_t.c.title, s_t.c.ticker_symbol,
+            s_t.c.industry_sector_id] + price_cols
+        from_query = spr_t.join(s_t, spr_t.c.stock_id == s_t.c.id)
+    else:
+        select_cols = [
+            s_t.c.id, s_t.c.title, s_t.c.ticker_symbol,
+            s_t.c.exchange_id, s_t.c.industry_sector_id,
+            is_t.c.id, is_t.c.title] + price_cols
+        from_query = (
+            spr_t.join(s_t, spr_t.c.stock_id == s_t.c.id)
+                 .join(is_t, s_t.c.industry_sector_id == is_t.c.id))
+
+    where_clauses = [
+        spr_t.c.exchange_id == exchange_id,
+        spr_t.c.from_year == from_year,
+        spr_t.c.to_year == to_year]
+
+    if cursor is not None and cursor.rank is not None:
+        where_clauses.append(spr_t.c.rank > cursor.rank)
+    elif cursor is not None:
+        where_clauses.append(or_(
+            spr_t.c.price_change_percent < cursor.price_change_percent,
+            and_(
+                spr_t.c.price_change_percent == cursor.price_change_percent,
+                spr_t.c.stock_id > cursor.stock_id)))
+
+    query = (
+        select(select_cols, use_labels=True)
+            .select_from(from_query)
+            .where(and_(*where_clauses))
+            .order_by(spr_t.c.rank))
+
+    if limit:
+        query = query.limit(limit)
+
+    return query
+
+
+def yeartoyear_price_percent_change_precomputed_result(
+        exchange_id, from_year, to_year, limit=None, cursor=None,
+        light=False):
+    """Result for precomputed percent change in prices between two years.
+
+    Returns None if the precomputed returns can't be used for these years,
+    because they are out of order or awaiting a refresh. With ``light``,
+    returns a ``LightRankingResult``.
+    """
+    if not can_use_precomputed_returns(exchange_id, from_year, to_year):
+        return None
+
+    query = yeartoyear_price_percent_change_precomputed_query(
+        exchange_id, from_year, to_year, limit=limit, cursor=cursor,
+        light=light)
+
+    if light:
+        return LightRankingResult(query)
+
+    return (
+        db.session
+          .query(
+              Stock, IndustrySector,
+              'avg_close_price_from', 'avg_close_price_to',
+              'price_change_percent')
+          .from_statement(query))
@@ -0,0 +1,383 @@
+"""Dense in-memory price matrices for vectorized stock analysis."""
+from collections import namedtuple
+from decimal import Decimal
+import threading
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.sql import func
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import (IndustrySector, Stock,
+                                               StockYearlyPrice)
+from whatifstocks.stockanalysis.rankingrows import (industry_sector_cache,
+                                                    RankingRow, RankingStock)
+from whatifstocks.stockanalysis.snapshot import (read_snapshot,
+                                                 snapshot_file_id,
+                                                 snapshot_path,
+                                                 write_snapshot)
+
+# Stand-ins for Stock and IndustrySector, built from a snapshot's
+# dictionary without querying the DB.
+SnapshotStock = namedtuple(
+    'SnapshotStock',
+    'id title ticker_symbol exchange_id industry_sector_id')
+SnapshotIndustrySector = namedtuple('SnapshotIndustrySector', 'id title')
+
+
+def round_half_away(values, decimals=4):
+    """Round like Postgres's ``ROUND`` on numerics, halves away from zero.
+
+    ``np.round`` rounds halves to even, and a change or an average that is
+    exactly half way in decimal is often a hair either side of it as a
+    float, so values within float error of half way count as half way.
+    """
+    scale = 10.0 ** decimals
+    scaled = np.abs(values) * scale
+    tolerance = 1e-8 + scaled * 1e-13
+
+    # Adding 0.0 turns the -0.0 of small negative values into 0.0.
+    return np.sign(values) * np.floor(scaled + 0.5 + tolerance) / scale + 0.0
+
+
+class PriceMatrix(object):
+    """Yearly prices of one exchange's stocks as a stocks x years matrix.
+
+    ``prices[i, j]`` is the average close price of stock ``stock_ids[i]``
+    in year ``first_year + j``, or NaN if there is no price for that year.
+    Stock IDs are sorted ascending.
+
+    A matrix opened from a snapshot also has the ``data_version`` it was
+    built from, and ``stocks``, a list of ``(stock, industry_sector)``
+    stand-ins in the same order as ``stock_ids``.
+    """
+
+    def __init__(self, exchange_id, stock_ids, first_year, prices,
+                 data_version=None, stocks=None):
+        self.exchange_id = exchange_id
+        self.stock_ids = np.asarray(stock_ids, dtype=np.int64)
+        self.first_year = first_year
+        self.prices = prices
+        self.data_version = data_version
+        self.stocks = stocks
+
+    @property
+    def num_stocks(self):
+        return self.prices.shape[0]
+
+    @property
+    def num_years(self):
+        return self.prices.shape[1]
+
+    @property
+    def last_year(self):
+        return self.first_year + self.num_years - 1
+
+    @property
+    def years(self):
+        return np.arange(
+            self.first_year, self.first_year + self.num_years,
+            dtype=np.int64)
+
+    @classmethod
+    def load(cls, exchange_id):
+        """Load an exchange's yearly prices from the DB."""
+        syp_t = StockYearlyPrice.__table__
+        s_t = Stock.__table__
+
+        query = (
+            select([
+                syp_t.c.stock_id, syp_t.c.year,
+                func.avg(syp_t.c.close_price)])
+                .select_from(syp_t.join(s_t, syp_t.c.stock_id == s_t.c.id))
+                .where(s_t.c.exchange_id == exchange_id)
+                .group_by(syp_t.c.stock_id, syp_t.c.year))
+
+        rows = db.session.execute(query).fetchall()
+
+        if not rows:
+            return cls(exchange_id, [], 0, np.empty((0, 0)))
+
+        row_stock_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        row_years = np.array([r[1] for r in rows], dtype=np.int64)
+        row_prices = np.array([r[2] for r in rows], dtype=np.float64)
+
+        stock_ids, stock_idx = np.unique(row_stock_ids, return_inverse=True)
+        first_year = int(row_years.min())
+        num_years = int(row_years.max()) - first_year + 1
+
+        prices = np.full((len(stock_ids), num_years), np.nan)
+        prices[stock_idx, row_years - first_year] = row_prices
+
+        return cls(exchange_id, stock_ids, first_year, prices)
+
+    @classmethod
+    def open_snapshot(cls, path):
+        """Open a snapshot file, memory-mapping its prices.
+
+        Returns ``(matrix, file_id)``.
+        """
+        meta, stock_ids, prices, file_id = read_snapshot(path)
+        industry_sectors = [
+            SnapshotIndustrySector(sector_id, title)
+            for sector_id, title in meta['industry_sectors']]
+        stocks = [
+            (SnapshotStock(
+                stock_id, title, ticker_symbol, meta['exchange_id'],
+                industry_sectors[sector_index].id),
+             industry_sectors[sector_index])
+            for stock_id, ticker_symbol, title, sector_index in zip(
+                stock_ids.tolist(), meta['ticker_symbols'], meta['titles'],
+                meta['industry_sector_indexes'])]
+
+        matrix = cls(
+            meta['exchange_id'], stock_ids, meta['first_year'], prices,
+            data_version=meta['data_version'], stocks=stocks)
+
+        return matrix, file_id
+
+    def write_snapshot(self, path, data_version):
+        """Write this matrix, with its stocks' details, to a snapshot file."""
+        stocks_by_id = {
+            stock.id: (stock, industry_sector)
+            for stock, industry_sector in (
+                db.session
+                  .query(Stock, IndustrySector)
+                  .join(IndustrySector,
+                        Stock.industry_sector_id == IndustrySector.id)
+                  .filter(Stock.exchange_id == self.exchange_id))}
+        sector_indexes = {}
+        meta = {
+            'exchange_id': self.exchange_id,
+            'data_version': data_version,
+            'first_year': self.first_year,
+            'ticker_symbols': [],
+            'titles': [],
+            'industry_sector_indexes': [],
+            'industry_sectors': []}
+
+        for stock_id in self.stock_ids.tolist():
+            stock, industry_sector = stocks_by_id[stock_id]
+
+            if industry_sector.id not in sector_indexes:
+                sector_indexes[industry_sector.id] = len(sector_indexes)
+                meta['industry_sectors'].append(
+                    (industry_sector.id, industry_sector.title))
+
+            meta['ticker_symbols'].append(stock.ticker_symbol)
+            meta['titles'].append(stock.title)
+            meta['industry_sector_indexes'].append(
+                sector_indexes[industry_sector.id])
+
+        write_snapshot(path, meta, self.stock_ids, self.prices)
+
+    def ticker_symbols(self):
+        """Ticker symbols of the matrix's stocks, in row order."""
+        if self.stocks is not None:
+            return [stock.ticker_symbol for stock, _ in self.stocks]
+
+        ticker_symbols_by_id = dict(
+            db.session
+              .query(Stock.id, Stock.ticker_symbol)
+              .filter(Stock.exchange_id == self.exchange_id))
+
+        return [
+            ticker_symbols_by_id.get(stock_id)
+            for stock_id in self.stock_ids.tolist()]
+
+    def year_window(self, from_year, to_year):
+        """Prices of all stocks from ``from_year`` to ``to_year`` inclusive.
+
+        A writable stocks x years copy. Raises ValueError unless both years
+        are within the matrix's years, so that the window (whose years may
+        come from a request) is never larger than the matrix.
+        """
+        if not self.first_year <= from_year <= to_year <= self.last_year:
+            raise ValueError('Years must be from {0} to {1}'.format(
+                self.first_year, self.last_year))
+
+        return np.array(
+            self.prices[:, from_year - self.first_year:
+                        to_year - self.first_year + 1])
+
+    def stocks_and_sectors(self, indexes):
+        """``(stock, industry_sector)`` pairs of the given matrix rows.
+
+        Stand-ins from the snapshot's dictionary if the matrix came from a
+        snapshot, otherwise ``RankingStock`` and ``RankingIndustrySector``
+        namedtuples loaded in one query. Never model instances, since the
+        rows built from them are cached and shared across threads.
+        """
+        if self.stocks is not None:
+            return [self.stocks[index] for index in indexes]
+
+        stocks_by_id = {
+            stock_id: RankingStock(
+                stock_id, title, ticker_symbol, industry_sector_id)
+            for stock_id, title, ticker_symbol, industry_sector_id in (
+                db.session
+                  .query(
+                      Stock.id, Stock.title, Stock.ticker_symbol,
+                      Stock.industry_sector_id)
+                  .filter(Stock.exchange_id == self.exchange_id))}
+
+        stocks = [
+            stocks_by_id[stock_id]
+            for stock_id in self.stock_ids[list(indexes)].tolist()]
+
+        return [
+            (stock, industry_sector_cache.get(stock.industry_sector_id))
+            for stock in stocks]
+
+    def year_prices(self, year):
+        """Prices of all stocks in the given year (all NaN if no data)."""
+        j = year - self.first_year
+
+        if 0 <= j < self.num_years:
+            return self.prices[:, j]
+
+        return np.full(self.num_stocks, np.nan)
+
+    def price_change_percent(
+            self, from_year, to_year, limit=None, cursor=None):
+        """Percent change in price between two years, ranked.
+
+        Only stocks with a positive price in both years are included.
+        Changes are rounded to 4 decimal places, as in the SQL query.
+        Returns ``(indexes, prices_from, prices_to, change_percent)``,
+        where ``indexes`` are row indexes into the matrix, ordered by
+        descending change and then by ascending stock ID.
+
+        With a ``cursor``, only rows after the cursor are returned. With a
+        ``limit``, only the top ``limit`` rows are fully sorted.
+        """
+        prices_from = self.year_prices(from_year)
+        prices_to = self.year_prices(to_year)
+
+        with np.errstate(invalid='ignore'):
+            is_valid = (prices_from > 0.0) & (prices_to > 0.0)
+
+        indexes = np.flatnonzero(is_valid)
+        prices_from = prices_from[indexes]
+        prices_to = prices_to[indexes]
+        change_percent = round_half_away(
+            (prices_to - prices_from) / prices_from * 100.0)
+        stock_ids = self.stock_ids[indexes]
+
+        if cursor is not None:
+            cursor_pct = float(cursor.price_change_percent)
+            is_after = (
+                (change_percent < cursor_pct) |
+                ((change_percent == cursor_pct) &
+                 (stock_ids > cursor.stock_id)))
+            selected = np.flatnonzero(is_after)
+        else:
+            selected = np.arange(len(indexes))
+
+        if limit and limit < len(selected):
+            # Partial top-K: keep the rows whose change is at least the
+            # K-th largest (ties included), then sort only those.
+            neg_change = -change_percent[selected]
+            kth = np.partition(neg_change, limit - 1)[limit - 1]
+            selected = selected[neg_change <= kth]
+
+        order = selected[np.lexsort(
+            (stock_ids[selected], -change_percent[selected]))]
+
+        if limit:
+            order = order[:limit]
+
+        return (
+            indexes[order], prices_from[order], prices_to[order],
+            change_percent[order])
+
+
+class PriceMatrixCache(object):
+    """Per-process cache of price matrices, one per exchange.
+
+    A matrix is reloaded whenever the exchange's data version changes.
+    With a ``snapshot_dir``, the matrix is memory-mapped from the
+    exchange's snapshot file if that was built from the current data
+    version, and reopened whenever a new snapshot replaces it. Otherwise
+    it is loaded from the DB.
+    """
+
+    def __init__(self):
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def get(self, exchange_id, data_version, snapshot_dir=None):
+        """Get an exchange's price matrix, loading it if stale or missing."""
+        path = snapshot_dir and snapshot_path(snapshot_dir, exchange_id)
+        file_id = path and snapshot_file_id(path)
+
+        with self._lock:
+            entry = self._matrices.get(exchange_id)
+
+        if entry is not None and entry[1:] == (data_version, file_id):
+            return entry[0]
+
+        matrix = None
+
+        if file_id is not None:
+            snapshot, file_id = PriceMatrix.open_snapshot(path)
+
+            if snapshot.data_version == data_version:
+                matrix = snapshot
+
+        if matrix is None:
+            matrix = PriceMatrix.load(exchange_id)
+
+        with self._lock:
+            self._matrices[exchange_id] = (matrix, data_version, file_id)
+
+        return matrix
+
+    def clear(self):
+        with self._lock:
+            self._matrices.clear()
+
+
+price_matrices = PriceMatrixCache()
+
+
+def _decimal(value):
+    return Decimal('{0:.4f}'.format(round_half_away(value)))
+
+
+def build_price_snapshot(exch, snapshot_dir):
+    """Build an exchange's snapshot file from the DB.
+
+    Returns the matrix written.
+    """
+    data_version = exch.data_version
+    matrix = PriceMatrix.load(exch.id)
+    matrix.write_snapshot(snapshot_path(snapshot_dir, exch.id), data_version)
+
+    return matrix
+
+
+def yeartoyear_price_percent_change_matrix_result(
+        exchange_id, from_year, to_year, data_version=None, limit=None,
+        cursor=None, snapshot_dir=None):
+    """Percent change in prices between from and to year, using NumPy.
+
+    Returns a list of ``RankingRow`` namedtuples, the same shape as the
+    rows of ``yeartoyear_price_percent_change_result``. If the matrix came
+    from a snapshot, stocks and sectors are stand-ins from its dictionary.
+    """
+    matrix = price_matrices.get(
+        exchange_id, data_version, snapshot_dir=snapshot_dir)
+    indexes, prices_from, prices_to, change_percent = (
+        matrix.price_change_percent(
+            from_year, to_year, limit=limit, cursor=cursor))
+
+    if not len(indexes):
+        return []
+
+    return [
+        RankingRow(
+            stock, industry_sector, _decimal(prices_from[i]),
+            _decimal(prices_to[i]), _decimal(change_percent[i]))
+        for i, (stock, industry_sector) in enumerate(
+            matrix.stocks_and_sectors(indexes.tolist()))]
@@ -1,15 +1,95 @@
 """Stock analysis queries."""
-from sqlalchemy import and_, select, text
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app as app
+from sqlalchemy import and_, cast, literal_column, Numeric, select, text
 from sqlalchemy.sql import func
 
-from whatifstocks.extensions import db
+from whatifstocks.extensions import db, result_cache
 from whatifstocks.stockanalysis.models import (Stock, Exchange,
                                                IndustrySector,
                                                StockYearlyPrice)
+from whatifstocks.stockanalysis.periodreturns import (
+    can_use_precomputed_returns,
+    yeartoyear_price_percent_change_precomputed_query,
+    yeartoyear_price_percent_change_precomputed_result)
+from whatifstocks.stockanalysis.rankingrows import (LightRankingResult,
+                                                    plain_ranking_row)
+
+
+# Rows fetched from a server-side cursor at a time when streaming.
+STREAM_BATCH_SIZE = 500
+
+PRICE_CHANGE_PERCENT_SQL = (
+    'ROUND(('
+    '(prices_to.avg_close_price - prices_from.avg_close_price) / '
+    'prices_from.avg_close_price) '
+    '* 100.0, '
+    '4)')
+
+# Fields a ranking can be sorted by, and whether each sorts descending.
+# Every order puts the "best" stocks first: the biggest gains, and the
+# lowest volatility and shallowest drawdowns. All but the first need
+# the risk metrics of ``riskmetrics``.
+RANKING_SORT_FIELDS = (
+    ('price_change_percent', True),
+    ('cagr_percent', True),
+    ('volatility_percent', False),
+    ('max_drawdown_percent', True))
+
+
+SectorRollup = namedtuple(
+    'SectorRollup',
+    'industry_sector_id industry_sector num_stocks '
+    'median_price_change_percent mean_price_change_percent '
+    'best_price_change_percent worst_price_change_percent')
+
+
+class RankingCursor(namedtuple(
+        'RankingCursor', ['price_change_percent', 'stock_id', 'rank'])):
+    """Keyset pagination cursor: the last row of the previous page."""
 
+    __slots__ = ()
 
-def yeartoyear_price_percent_change_query(exchange_id, from_year, to_year):
-    """Query percent change in prices between from and to year."""
+    def encode(self):
+        return '{0}_{1}_{2}'.format(
+            self.price_change_percent, self.stock_id, self.rank)
+
+    @classmethod
+    def decode(cls, cursor_raw):
+        """Decode a cursor string, raising ValueError if it's invalid."""
+        try:
+            price_change_percent_raw, stock_id_raw, rank_raw = (
+                cursor_raw.split('_'))
+            return cls(
+                Decimal(price_change_percent_raw), int(stock_id_raw),
+                int(rank_raw))
+        except (ValueError, InvalidOperation):
+            raise ValueError('Invalid cursor "{0}"'.format(cursor_raw))
+
+    @classmethod
+    def after_row(cls, row, rank):
+        """Cursor for the page after a ``(stock, ..., change)`` row."""
+        return cls(row[-1], row[0].id, rank)
+
+
+def yeartoyear_price_percent_change_query(
+        exchange_id, from_year, to_year, limit=None, cursor=None,
+        light=False):
+    """Query percent change in prices between from and to year.
+
+    Filters on the indexed ``year`` column so that each price subquery is
+    an index-only scan of ``_syp_year_sid_ix``. The subqueries are already
+    grouped by stock, so the outer query doesn't need a GROUP BY.
+
+    Rows are ordered by descending change, then by stock ID. Pass
+    ``limit`` to get only the top rows, and a ``RankingCursor`` to get
+    the rows after it (keyset pagination).
+
+    With ``light``, only the displayed stock columns and the sector ID are
+    selected, without joining ``industry_sector``.
+    """
     s_t = Stock.__table__.alias('stock')
     is_t = IndustrySector.__table__.alias('industry_sector')
     syp_from_t = StockYearlyPrice.__table__.alias('syp_from')
@@ -22,21 +102,22 @@ def yeartoyear_price_percent_change_query(exchange_id, from_year, to_year):
         'ROUND(CAST(prices_to.avg_close_price AS numeric), 4) '
         'AS avg_close_price_to')
     price_change_percent_col = text(
-        'ROUND(('
-        '(prices_to.avg_close_price - prices_from.avg_close_price) / '
-        'prices_from.avg_close_price) '
-        '* 100.0, '
-        '4) AS price_change_percent')
-
-    stock_cols = [
-        s_t.c.id, s_t.c.title, s_t.c.ticker_symbol, s_t.c.exchange_id,
-        s_t.c.industry_sector_id]
-    industry_sector_cols = [is_t.c.id, is_t.c.title]
-
-    select_cols = (
-        stock_cols + industry_sector_cols + [
-            avg_close_price_from_col, avg_close_price_to_col,
-            price_change_percent_col])
+        PRICE_CHANGE_PERCENT_SQL + ' AS price_change_percent')
+
+    price_cols = [
+        avg_close_price_from_col, avg_close_price_to_col,
+        price_change_percent_col]
+
+    if light:
+        select_cols = [
+            s_t.c.id, s_t.c.title, s_t.c.ticker_symbol,
+            s_t.c.industry_sector_id] + price_cols
+    else:
+        stock_cols = [
+            s_t.c.id, s_t.c.title, s_t.c.ticker_symbol, s_t.c.exchange_id,
+            s_t.c.industry_sector_id]
+        industry_sector_cols = [is_t.c.id, is_t.c.title]
+        select_cols = stock_cols + industry_sector_cols + price_cols
 
     prices_from_sq = (
         select(
@@ -45,7 +126,7 @@ def yeartoyear_price_percent_change_query(exchange_id, from_year, to_year):
                 func.avg(syp_from_t.c.close_price).label('avg_close_price')],
             use_labels=True)
             .select_from(syp_from_t)
-            .where(func.extract('year', syp_from_t.c.close_at) == from_year)
+            .where(syp_from_t.c.year == from_year)
             .group_by(syp_from_t.c.stock_id)
             .alias('prices_from'))
 
@@ -56,37 +137,61 @@ def yeartoyear_price_percent_change_query(exchange_id, from_year, to_year):
                 func.avg(syp_to_t.c.close_price).label('avg_close_price')],
             use_labels=True)
             .select_from(syp_to_t)
-            .where(func.extract('year', syp_to_t.c.close_at) == to_year)
+            .where(syp_to_t.c.year == to_year)
             .group_by(syp_to_t.c.stock_id)
             .alias('prices_to'))
 
+    from_query = s_t
+
+    if not light:
+        from_query = from_query.join(
+            is_t, s_t.c.industry_sector_id == is_t.c.id)
+
     from_query = (
-        s_t.join(is_t, s_t.c.industry_sector_id == is_t.c.id)
-           .join(prices_from_sq, s_t.c.id == prices_from_sq.c.stock_id)
-           .join(prices_to_sq, s_t.c.id == prices_to_sq.c.stock_id))
+        from_query.join(prices_from_sq, s_t.c.id == prices_from_sq.c.stock_id)
+                  .join(prices_to_sq, s_t.c.id == prices_to_sq.c.stock_id))
 
-    group_by_cols = (
-        stock_cols + industry_sector_cols + [
-            text('avg_close_price_from'), text('avg_close_price_to'),
-            prices_from_sq.c.avg_close_price, prices_to_sq.c.avg_close_price])
+    where_clauses = [
+        s_t.c.exchange_id == exchange_id,
+        text('prices_to.avg_close_price > 0.0'),
+        text('prices_from.avg_close_price > 0.0')]
+
+    if cursor is not None:
+        where_clauses.append(
+            text(
+                '({0} < :cursor_pct OR '
+                '({0} = :cursor_pct AND stock.id > :cursor_stock_id))'.format(
+                    PRICE_CHANGE_PERCENT_SQL))
+            .bindparams(
+                cursor_pct=cursor.price_change_percent,
+                cursor_stock_id=cursor.stock_id))
 
     query = (
         select(select_cols, use_labels=True)
             .select_from(from_query)
-            .where(and_(
-                s_t.c.exchange_id == exchange_id,
-                text('prices_to.avg_close_price > 0.0'),
-                text('prices_from.avg_close_price > 0.0')))
-            .group_by(*group_by_cols)
-            .order_by(text('price_change_percent DESC')))
+            .where(and_(*where_clauses))
+            .order_by(text('price_change_percent DESC'), s_t.c.id))
+
+    if limit:
+        query = query.limit(limit)
 
     return query
 
 
-def yeartoyear_price_percent_change_result(exchange_id, from_year, to_year):
-    """Result for percent change in prices between from and to year."""
+def yeartoyear_price_percent_change_result(
+        exchange_id, from_year, to_year, limit=None, cursor=None,
+        light=False):
+    """Result for percent change in prices between from and to year.
+
+    With ``light``, returns a ``LightRankingResult``, whose rows are
+    namedtuples rather than ORM instances.
+    """
     query = yeartoyear_price_percent_change_query(
-        exchange_id, from_year, to_year)
+        exchange_id, from_year, to_year, limit=limit, cursor=cursor,
+        light=light)
+
+    if light:
+        return LightRankingResult(query)
 
     # Craft the results such that each row gets populated with proper
     # model instances for all the models in question, plus the score.
@@ -99,3 +204,197 @@ def yeartoyear_price_percent_change_result(exchange_id, from_year, to_year):
           .from_statement(query))
 
     return result
+
+
+def yeartoyear_sector_rollup_query(ranking_query):
+    """Query per-sector stats of the changes in a ``light`` ranking query.
+
+    The ranking is grouped by sector in the DB, so that each sector's
+    median, mean, best and worst change and number of stocks come from
+    one query. Sectors are ordered by descending median change.
+    """
+    ranking_sq = ranking_query.order_by(None).alias('ranking')
+    is_t = IndustrySector.__table__.alias('industry_sector')
+    price_change_percent_col = literal_column('ranking.price_change_percent')
+
+    return (
+        select([
+            is_t.c.id, is_t.c.title,
+            func.count().label('num_stocks'),
+            func.round(
+                cast(
+                    func.percentile_cont(0.5).within_group(
+                        price_change_percent_col),
+                    Numeric),
+                4).label('median_price_change_percent'),
+            func.round(func.avg(price_change_percent_col), 4).label(
+                'mean_price_change_percent'),
+            func.max(price_change_percent_col).label(
+                'best_price_change_percent'),
+            func.min(price_change_percent_col).label(
+                'worst_price_change_percent')])
+            .select_from(ranking_sq.join(
+                is_t,
+                ranking_sq.c.stock_industry_sector_id == is_t.c.id))
+            .group_by(is_t.c.id, is_t.c.title)
+            .order_by(
+                text('median_price_change_percent DESC'), is_t.c.title))
+
+
+def yeartoyear_sector_rollup_result(
+        exchange_id, from_year, to_year, precomputed=False):
+    """Per-sector stats of percent change between from and to year.
+
+    Returns a list of ``SectorRollup`` rows. With ``precomputed``, the
+    stats are of the ``stock_period_return`` table's ranking.
+    """
+    ranking_query_func = (
+        precomputed and yeartoyear_price_percent_change_precomputed_query or
+        yeartoyear_price_percent_change_query)
+    query = yeartoyear_sector_rollup_query(ranking_query_func(
+        exchange_id, from_year, to_year, light=True))
+
+    return [SectorRollup(*row) for row in db.session.execute(query)]
+
+
+def iter_yeartoyear_price_percent_change_rows(
+        exchange_id, from_year, to_year, limit=None, cursor=None,
+        batch_size=STREAM_BATCH_SIZE):
+    """Stream ranking rows as dicts, from a server-side DB cursor."""
+    query = yeartoyear_price_percent_change_query(
+        exchange_id, from_year, to_year, limit=limit, cursor=cursor)
+    result = (
+        db.session
+          .connection()
+          .execution_options(stream_results=True)
+          .execute(query))
+    rank = cursor and cursor.rank or 0
+
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+
+            if not rows:
+                break
+
+            for row in rows:
+                rank += 1
+                yield {
+                    'rank': rank,
+                    'stock_id': row[0],
+                    'title': row[1],
+                    'ticker_symbol': row[2],
+                    'industry_sector': row[6],
+                    'avg_close_price_from': row[7],
+                    'avg_close_price_to': row[8],
+                    'price_change_percent': row[9]}
+    finally:
+        result.close()
+
+
+def iter_yeartoyear_price_percent_change_ranking(
+        exch, from_year, to_year, cursor=None, batch_size=STREAM_BATCH_SIZE):
+    """Stream the whole ranking, as rows like those of the ranking result.
+
+    With the ``'sql'`` and ``'precomputed'`` engines, rows are fetched
+    ``batch_size`` at a time from a server-side DB cursor, and nothing is
+    cached, so memory use doesn't grow with the number of stocks.
+    """
+    engine = app.config['STOCKANALYSIS_RANKING_ENGINE']
+    light = app.config['STOCKANALYSIS_LIGHT_ROWS']
+
+    if engine == 'numpy':
+        for row in yeartoyear_price_percent_change_ranking(
+                exch, from_year, to_year, cursor=cursor):
+            yield row
+
+        return
+
+    result = None
+
+    if engine == 'precomputed':
+        result = yeartoyear_price_percent_change_precomputed_result(
+            exch.id, from_year, to_year, cursor=cursor, light=light)
+
+    if result is None:
+        result = yeartoyear_price_percent_change_result(
+            exch.id, from_year, to_year, cursor=cursor, light=light)
+
+    for row in result.yield_per(batch_size):
+        yield row
+
+
+def yeartoyear_price_percent_change_ranking(
+        exch, from_year, to_year, limit=None, cursor=None):
+    """Percent change in prices between from and to year.
+
+    Uses the engine set in ``STOCKANALYSIS_RANKING_ENGINE``: ``'sql'`` to
+    aggregate in the DB, ``'numpy'`` to rank an in-memory price matrix, or
+    ``'precomputed'`` to read the ``stock_period_return`` table (falling
+    back to ``'sql'`` for years awaiting ``refresh_returns``).
+    Results are cached, keyed on the exchange's data version, and
+    returned as a list of ``RankingRow`` namedtuples (never ORM instances,
+    since cached rows are shared across threads). With
+    ``STOCKANALYSIS_LIGHT_ROWS``, the DB engines read them without
+    building ORM instances at all.
+    """
+    engine = app.config['STOCKANALYSIS_RANKING_ENGINE']
+    light = app.config['STOCKANALYSIS_LIGHT_ROWS']
+
+    def plain_rows(result):
+        if light:
+            return result.all()
+
+        return [plain_ranking_row(row) for row in result.all()]
+
+    def create():
+        if engine == 'precomputed':
+            result = yeartoyear_price_percent_change_precomputed_result(
+                exch.id, from_year, to_year, limit=limit, cursor=cursor,
+                light=light)
+
+            if result is not None:
+                return plain_rows(result)
+
+        if engine == 'numpy':
+            # Imported here so that NumPy is only needed by the NumPy engine.
+            from whatifstocks.stockanalysis.pricematrix import (
+                yeartoyear_price_percent_change_matrix_result)
+
+            return yeartoyear_price_percent_change_matrix_result(
+                exch.id, from_year, to_year, data_version=exch.data_version,
+                limit=limit, cursor=cursor,
+                snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+
+        return plain_rows(yeartoyear_price_percent_change_result(
+            exch.id, from_year, to_year, limit=limit, cursor=cursor,
+            light=light))
+
+    cache_key = (
+        'yeartoyear_price_percent_change', engine, exch.id,
+        exch.data_version, from_year, to_year, limit, cursor)
+
+    return result_cache.get_or_create(cache_key, create)
+
+
+def yeartoyear_sector_rollups(exch, from_year, to_year):
+    """Per-sector stats of percent change between from and to year.
+
+    Computed in the DB, from the precomputed returns if the engine is
+    ``'precomputed'`` and they are up to date (the ``'numpy'`` engine
+    uses the ``'sql'`` query). Results are cached like rankings.
+    """
+    engine = app.config['STOCKANALYSIS_RANKING_ENGINE']
+
+    def create():
+        return yeartoyear_sector_rollup_result(
+            exch.id, from_year, to_year,
+            precomputed=(
+                engine == 'precomputed' and
+                can_use_precomputed_returns(exch.id, from_year, to_year)))
+
+    cache_key = (
+        'yeartoyear_sector_rollups', engine, exch.id, exch.data_version,
+        from_year, to_year)
+
+    return result_cache.get_or_create(cache_key, create)
@@ -0,0 +1,119 @@
+"""Lightweight ranking rows, read without building ORM instances."""
+from collections import namedtuple
+import threading
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import IndustrySector
+
+RankingStock = namedtuple(
+    'RankingStock', 'id title ticker_symbol industry_sector_id')
+RankingIndustrySector = namedtuple('RankingIndustrySector', 'id title')
+RankingRow = namedtuple(
+    'RankingRow',
+    'stock industry_sector avg_close_price_from avg_close_price_to '
+    'price_change_percent')
+
+
+class IndustrySectorCache(object):
+    """Industry sectors by ID, loaded all at once and reloaded on a miss.
+
+    Sectors are only ever added (by ``import_stocks``), never renamed, so
+    a loaded sector stays valid and an unknown ID means a new sector.
+    """
+
+    def __init__(self):
+        self._sectors_by_id = {}
+        self._lock = threading.Lock()
+
+    def get(self, industry_sector_id):
+        industry_sector = self._sectors_by_id.get(industry_sector_id)
+
+        if industry_sector is None:
+            self.reload()
+            industry_sector = self._sectors_by_id[industry_sector_id]
+
+        return industry_sector
+
+    def reload(self):
+        sectors_by_id = {
+            sector_id: RankingIndustrySector(sector_id, title)
+            for sector_id, title in db.session.query(
+                IndustrySector.id, IndustrySector.title)}
+
+        with self._lock:
+            self._sectors_by_id = sectors_by_id
+
+    def clear(self):
+        with self._lock:
+            self._sectors_by_id = {}
+
+
+industry_sector_cache = IndustrySectorCache()
+
+
+def plain_ranking_row(row):
+    """A ``RankingRow`` copy of a ranking row of ORM instances.
+
+    Cached rankings are shared by every request and thread, so they must
+    not hold ORM instances, which belong to one thread's session.
+    """
+    (stock, industry_sector, avg_close_price_from, avg_close_price_to,
+     price_change_percent) = row
+
+    return RankingRow(
+        RankingStock(
+            stock.id, stock.title, stock.ticker_symbol,
+            stock.industry_sector_id),
+        RankingIndustrySector(industry_sector.id, industry_sector.title),
+        avg_close_price_from, avg_close_price_to, price_change_percent)
+
+
+class LightRankingResult(object):
+    """Result of a ranking query built with ``light=True``.
+
+    Rows are ``RankingRow`` namedtuples of a ``RankingStock``, a shared
+    ``RankingIndustrySector`` and the prices and change, so they unpack
+    like ORM ranking rows. Has the ``Query`` methods that ranking results
+    are read with.
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+    def _ranking_rows(self, rows):
+        get_industry_sector = industry_sector_cache.get
+
+        for (
+                stock_id, title, ticker_symbol, industry_sector_id,
+                avg_close_price_from, avg_close_price_to,
+                price_change_percent) in rows:
+            yield RankingRow(
+                RankingStock(
+                    stock_id, title, ticker_symbol, industry_sector_id),
+                get_industry_sector(industry_sector_id),
+                avg_close_price_from, avg_close_price_to,
+                price_change_percent)
+
+    def all(self):
+        return list(self._ranking_rows(
+            db.session.execute(self.query).fetchall()))
+
+    def yield_per(self, batch_size):
+        """Iterate over rows fetched from a server-side DB cursor."""
+        result = (
+            db.session
+              .connection()
+              .execution_options(stream_results=True)
+              .execute(self.query))
+
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+
+                if not rows:
+                    break
+
+                for row in self._ranking_rows(rows):
+                    yield row
+        finally:
+            result.close()
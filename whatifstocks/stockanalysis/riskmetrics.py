@@ -0,0 +1,184 @@
+"""Annualized return, volatility and drawdown of stocks between two years."""
+from collections import namedtuple
+from decimal import Decimal
+import warnings
+
+import numpy as np
+
+from whatifstocks.extensions import result_cache
+from whatifstocks.stockanalysis.pricematrix import (price_matrices,
+                                                    round_half_away)
+from whatifstocks.stockanalysis.queries import RANKING_SORT_FIELDS
+
+RISK_METRIC_FIELDS = (
+    'cagr_percent', 'volatility_percent', 'max_drawdown_percent')
+
+RiskMetrics = namedtuple('RiskMetrics', RISK_METRIC_FIELDS)
+
+# The ranking of one pair of years, with every sort field's values. Each
+# array has one element per ranked stock; ``indexes`` are matrix rows.
+RiskMetricTable = namedtuple(
+    'RiskMetricTable',
+    'matrix indexes prices_from prices_to price_change_percent '
+    'cagr_percent volatility_percent max_drawdown_percent')
+
+
+def window_risk_metrics(matrix, from_year, to_year):
+    """CAGR, volatility and max drawdown of all stocks, as percentages.
+
+    Computed with NumPy for every stock at once, from the yearly average
+    prices of ``from_year`` to ``to_year``:
+
+    - CAGR, the compound annual growth rate between the two years.
+    - Volatility, the sample standard deviation of the yearly returns
+      (which are already annual, so need no scaling). NaN with fewer than
+      two yearly returns.
+    - Max drawdown, the largest fall from a previous peak, as a negative
+      percentage (0 if the price never fell).
+
+    Years without a positive price are skipped. Returns ``(cagr,
+    volatility, max_drawdown)`` arrays, with NaN for stocks without a
+    positive price in both ``from_year`` and ``to_year``, and for every
+    stock if ``from_year`` isn't before ``to_year`` or either is outside
+    the matrix's years.
+    """
+    if not matrix.first_year <= from_year < to_year <= matrix.last_year:
+        nans = np.full(matrix.num_stocks, np.nan)
+        return nans, nans.copy(), nans.copy()
+
+    window = matrix.year_window(from_year, to_year)
+
+    with np.errstate(invalid='ignore'):
+        window[~(window > 0.0)] = np.nan
+
+    prices_from = window[:, 0]
+    prices_to = window[:, -1]
+    yearly_returns = window[:, 1:] / window[:, :-1] - 1.0
+    running_max = np.fmax.accumulate(window, axis=1)
+
+    with warnings.catch_warnings():
+        # Stocks without enough prices are NaN, as documented.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        cagr = (
+            np.power(prices_to / prices_from, 1.0 / (to_year - from_year)) -
+            1.0) * 100.0
+        volatility = np.nanstd(yearly_returns, axis=1, ddof=1) * 100.0
+        max_drawdown = np.nanmin(window / running_max - 1.0, axis=1) * 100.0
+
+    volatility[(~np.isnan(yearly_returns)).sum(axis=1) < 2] = np.nan
+    is_invalid = np.isnan(prices_from) | np.isnan(prices_to)
+
+    for metric in (cagr, volatility, max_drawdown):
+        metric[is_invalid] = np.nan
+
+    return (
+        round_half_away(cagr), round_half_away(volatility),
+        round_half_away(max_drawdown))
+
+
+def risk_metric_table(exch, from_year, to_year, snapshot_dir=None):
+    """The ranked stocks of a pair of years, with their risk metrics.
+
+    Cached, keyed on the exchange's data version, so that sorting the
+    same pair of years by another field doesn't recompute anything.
+    """
+    def create():
+        matrix = price_matrices.get(
+            exch.id, exch.data_version, snapshot_dir=snapshot_dir)
+        indexes, prices_from, prices_to, change_percent = (
+            matrix.price_change_percent(from_year, to_year))
+        cagr, volatility, max_drawdown = window_risk_metrics(
+            matrix, from_year, to_year)
+
+        return RiskMetricTable(
+            matrix, indexes, prices_from, prices_to, change_percent,
+            cagr[indexes], volatility[indexes], max_drawdown[indexes])
+
+    cache_key = (
+        'risk_metric_table', exch.id, exch.data_version, from_year, to_year)
+
+    return result_cache.get_or_create(cache_key, create)
+
+
+def sort_risk_metric_table(table, sort_field):
+    """Positions in the table's arrays, ordered by a sort field.
+
+    Ties are ordered by stock ID, and stocks without a value come last.
+    """
+    is_descending = dict(RANKING_SORT_FIELDS)[sort_field]
+    values = getattr(table, sort_field)
+    is_missing = np.isnan(values)
+    values = np.where(is_missing, 0.0, values)
+
+    return np.lexsort((
+        table.matrix.stock_ids[table.indexes],
+        -values if is_descending else values,
+        is_missing))
+
+
+def _decimal_or_none(value):
+    if np.isnan(value):
+        return None
+
+    return Decimal('{0:.4f}'.format(round_half_away(value)))
+
+
+def risk_metric_ranking(exch, from_year, to_year,
+                        sort_field='price_change_percent', limit=None,
+                        offset=0, snapshot_dir=None):
+    """Ranking of a pair of years, sorted by any of the sort fields.
+
+    Returns ``(rows, risk_metrics)``: rows shaped like those of
+    ``yeartoyear_price_percent_change_ranking``, and a ``RiskMetrics`` of
+    Decimals (or None) for each row. The first ``offset`` rows are
+    skipped, and only ``limit`` rows are returned if given.
+    """
+    table = risk_metric_table(
+        exch, from_year, to_year, snapshot_dir=snapshot_dir)
+    order = sort_risk_metric_table(table, sort_field)[offset:]
+
+    if limit:
+        order = order[:limit]
+
+    stocks_and_sectors = table.matrix.stocks_and_sectors(
+        table.indexes[order].tolist())
+    rows = []
+    risk_metrics = []
+
+    for i, stock_and_sector in zip(order.tolist(), stocks_and_sectors):
+        rows.append(stock_and_sector + (
+            _decimal_or_none(table.prices_from[i]),
+            _decimal_or_none(table.prices_to[i]),
+            _decimal_or_none(table.price_change_percent[i])))
+        risk_metrics.append(RiskMetrics(
+            _decimal_or_none(table.cagr_percent[i]),
+            _decimal_or_none(table.volatility_percent[i]),
+            _decimal_or_none(table.max_drawdown_percent[i])))
+
+    return rows, risk_metrics
+
+
+def iter_risk_metric_ranking_rows(exch, from_year, to_year,
+                                  sort_field='price_change_percent',
+                                  limit=None, offset=0, snapshot_dir=None):
+    """Ranking rows with risk metrics, as dicts for the JSON API."""
+    rows, risk_metrics = risk_metric_ranking(
+        exch, from_year, to_year, sort_field=sort_field, limit=limit,
+        offset=offset, snapshot_dir=snapshot_dir)
+
+    for rank, (row, metrics) in enumerate(
+            zip(rows, risk_metrics), offset + 1):
+        (stock, industry_sector, avg_close_price_from, avg_close_price_to,
+         price_change_percent) = row
+        row_dict = {
+            'rank': rank,
+            'stock_id': stock.id,
+            'title': stock.title,
+            'ticker_symbol': stock.ticker_symbol,
+            'industry_sector': industry_sector.title,
+            'avg_close_price_from': avg_close_price_from,
+            'avg_close_price_to': avg_close_price_to,
+            'price_change_percent': price_change_percent}
+        row_dict.update(metrics._asdict())
+
+        yield row_dict
@@ -0,0 +1,117 @@
+"""Memory-mapped price snapshot files, shared by all worker processes.
+
+A snapshot file is a fixed header (magic and metadata length), JSON
+metadata, then, aligned to ``SNAPSHOT_ALIGNMENT`` bytes, the stock IDs as
+little-endian int64s and the stocks x years price matrix as little-endian
+float64s in row-major order. The arrays are opened with ``numpy.memmap``,
+so every process that opens a snapshot shares one copy in the page cache.
+"""
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'WISSNAP1'
+SNAPSHOT_HEADER = struct.Struct('<8sQ')
+SNAPSHOT_ALIGNMENT = 64
+SNAPSHOT_STOCK_IDS_DTYPE = np.dtype('<i8')
+SNAPSHOT_PRICES_DTYPE = np.dtype('<f8')
+
+
+def snapshot_path(snapshot_dir, exchange_id):
+    """Path of an exchange's snapshot file."""
+    return os.path.join(
+        snapshot_dir, 'exchange-{0}.snapshot'.format(exchange_id))
+
+
+def snapshot_file_id(path):
+    """ID of the file currently at a path, or None if there is none.
+
+    Changes whenever a new snapshot is renamed into place.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return (st.st_dev, st.st_ino)
+
+
+def _data_offset(meta_len):
+    offset = SNAPSHOT_HEADER.size + meta_len
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+def write_snapshot(path, meta, stock_ids, prices):
+    """Write a snapshot file, atomically replacing any existing one.
+
+    The file is written to a temporary file in the same directory and
+    renamed into place, so processes never see a partly written snapshot,
+    and processes that still have the old snapshot mapped keep using it.
+    """
+    meta = dict(
+        meta, num_stocks=prices.shape[0], num_years=prices.shape[1])
+    meta_bytes = json.dumps(meta, sort_keys=True).encode('utf-8')
+    padding = _data_offset(len(meta_bytes)) - (
+        SNAPSHOT_HEADER.size + len(meta_bytes))
+
+    snapshot_dir, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=snapshot_dir, prefix='.' + filename, suffix='.tmp')
+    is_renamed = False
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(meta_bytes)))
+            f.write(meta_bytes)
+            f.write(b'\0' * padding)
+            f.write(np.ascontiguousarray(
+                stock_ids, dtype=SNAPSHOT_STOCK_IDS_DTYPE).tobytes())
+            f.write(np.ascontiguousarray(
+                prices, dtype=SNAPSHOT_PRICES_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+        is_renamed = True
+    finally:
+        # Whatever went wrong, don't leave the temporary file behind.
+        if not is_renamed:
+            os.remove(tmp_path)
+
+
+def read_snapshot(path):
+    """Open a snapshot file, memory-mapping its arrays.
+
+    Returns ``(meta, stock_ids, prices, file_id)``. The arrays are
+    read-only and stay valid after the file is replaced.
+    """
+    with open(path, 'rb') as f:
+        magic, meta_len = SNAPSHOT_HEADER.unpack(
+            f.read(SNAPSHOT_HEADER.size))
+
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('{0} is not a price snapshot'.format(path))
+
+        meta = json.loads(f.read(meta_len).decode('utf-8'))
+        st = os.fstat(f.fileno())
+        num_stocks, num_years = meta['num_stocks'], meta['num_years']
+        offset = _data_offset(meta_len)
+
+        if num_stocks and num_years:
+            # Map the already open file, in case it's replaced meanwhile.
+            stock_ids = np.memmap(
+                f, dtype=SNAPSHOT_STOCK_IDS_DTYPE, mode='r', offset=offset,
+                shape=(num_stocks,))
+            prices = np.memmap(
+                f, dtype=SNAPSHOT_PRICES_DTYPE, mode='r',
+                offset=offset + num_stocks * SNAPSHOT_STOCK_IDS_DTYPE.itemsize,
+                shape=(num_stocks, num_years))
+        else:
+            stock_ids = np.empty(0, dtype=SNAPSHOT_STOCK_IDS_DTYPE)
+            prices = np.empty((num_stocks, num_years))
+
+    return meta, stock_ids, prices, (st.st_dev, st.st_ino)
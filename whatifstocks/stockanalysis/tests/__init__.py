@@ -0,0 +1 @@
+"""Tests for the stockanalysis package."""
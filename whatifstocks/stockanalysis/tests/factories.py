@@ -0,0 +1,44 @@
+"""Test data for the stockanalysis tests."""
+from datetime import date
+from decimal import Decimal
+
+from whatifstocks.extensions import db
+from whatifstocks.stockanalysis.models import (Exchange, IndustrySector,
+                                               Stock, StockYearlyPrice)
+
+
+def create_exchange(exchange_symbol, prices_by_ticker,
+                    industry_sector_title='Widgets'):
+    """An exchange with stocks and their monthly close prices.
+
+    ``prices_by_ticker`` maps each ticker symbol to a dict of lists of
+    close prices (strings, floats or Decimals) by year, one per month
+    from January. Stocks are created in ticker symbol order, so their IDs
+    are too.
+    """
+    exch = Exchange.create(
+        title='{0} exchange'.format(exchange_symbol),
+        exchange_symbol=exchange_symbol)
+    industry_sector = IndustrySector.query.filter_by(
+        title=industry_sector_title).first()
+
+    if industry_sector is None:
+        industry_sector = IndustrySector.create(title=industry_sector_title)
+
+    for ticker_symbol in sorted(prices_by_ticker):
+        stock = Stock.create(
+            title='{0} Ltd'.format(ticker_symbol),
+            ticker_symbol=ticker_symbol, exchange_id=exch.id,
+            industry_sector_id=industry_sector.id)
+
+        for year, prices in sorted(prices_by_ticker[ticker_symbol].items()):
+            for month, close_price in enumerate(prices, 1):
+                db.session.add(StockYearlyPrice(
+                    close_at=date(year, month, 28), year=year,
+                    close_price=Decimal(str(close_price)),
+                    stock_id=stock.id))
+
+    exch.bump_data_version(commit=False)
+    db.session.commit()
+
+    return exch
@@ -0,0 +1,87 @@
+"""Tests for the stockanalysis JSON API."""
+import json
+
+import pytest
+
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+RANKING_URL = (
+    '/stockanalysis/api/yeartoyear-price-percent-changes'
+    '?exchange_symbol=AX&from_year=2000&to_year=2001')
+
+
+def create_ax_exchange():
+    return create_exchange('AX', {
+        'AAA': {2000: [1.0, 3.0], 2001: [4.0]},
+        'AAB': {2000: [2.0], 2001: [1.0]},
+        'AAC': {2000: [2.0], 2001: [5.0]}})
+
+
+@pytest.mark.database
+class TestRankingAPI:
+
+    def test_ndjson(self, db, app):
+        create_ax_exchange()
+
+        response = app.test_client().get(RANKING_URL)
+        rows = [
+            json.loads(line)
+            for line in response.data.decode('utf-8').splitlines()]
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert [
+            (row['rank'], row['ticker_symbol'], row['industry_sector'],
+             row['avg_close_price_from'], row['avg_close_price_to'],
+             row['price_change_percent'])
+            for row in rows] == [
+                (1, 'AAC', 'Widgets', 2.0, 5.0, 150.0),
+                (2, 'AAA', 'Widgets', 2.0, 4.0, 100.0),
+                (3, 'AAB', 'Widgets', 2.0, 1.0, -50.0)]
+
+    def test_json_fields_and_pages(self, db, app):
+        create_ax_exchange()
+        client = app.test_client()
+
+        first_page = json.loads(client.get(
+            RANKING_URL + '&format=json&limit=2'
+            '&fields=rank,ticker_symbol,stock_id,price_change_percent'
+        ).data.decode('utf-8'))
+        last_row = first_page[-1]
+        cursor = '{0}_{1}_{2}'.format(
+            last_row['price_change_percent'], last_row['stock_id'],
+            last_row['rank'])
+        second_page = json.loads(client.get(
+            RANKING_URL + '&format=json&limit=2&fields=rank,ticker_symbol'
+            '&cursor=' + cursor).data.decode('utf-8'))
+
+        assert set(first_page[0]) == {
+            'rank', 'ticker_symbol', 'stock_id', 'price_change_percent'}
+        assert [row['ticker_symbol'] for row in first_page] == ['AAC', 'AAA']
+        assert second_page == [{'rank': 3, 'ticker_symbol': 'AAB'}]
+
+    def test_empty_json(self, db, app):
+        create_ax_exchange()
+
+        response = app.test_client().get(
+            RANKING_URL.replace('2001', '2005') + '&format=json')
+
+        assert json.loads(response.data.decode('utf-8')) == []
+
+    @pytest.mark.parametrize('query_string,status_code', [
+        ('from_year=2000&to_year=2001', 400),
+        ('exchange_symbol=NZ&from_year=2000&to_year=2001', 404),
+        ('exchange_symbol=AX&from_year=x&to_year=2001', 400),
+        ('exchange_symbol=AX&from_year=2000&to_year=2001&limit=-1', 400),
+        ('exchange_symbol=AX&from_year=2000&to_year=2001&cursor=x', 400),
+        ('exchange_symbol=AX&from_year=2000&to_year=2001&fields=x', 400),
+        ('exchange_symbol=AX&from_year=2000&to_year=2001&format=xml', 400)])
+    def test_invalid_args(self, db, app, query_string, status_code):
+        create_ax_exchange()
+
+        response = app.test_client().get(
+            '/stockanalysis/api/yeartoyear-price-percent-changes?' +
+            query_string)
+
+        assert response.status_code == status_code
+        assert 'error' in json.loads(response.data.decode('utf-8'))
@@ -0,0 +1,92 @@
+"""Tests for portfolio backtests."""
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from whatifstocks.stockanalysis.backtest import (  # noqa: E402
+    backtest, PortfolioBatch)
+from whatifstocks.stockanalysis.pricematrix import PriceMatrix  # noqa: E402
+from whatifstocks.stockanalysis.tests.factories import (  # noqa: E402
+    create_exchange)
+
+
+def make_matrix():
+    return PriceMatrix(1, [1, 2, 3], 2000, np.array([
+        [1.0, 2.0, 4.0],
+        [2.0, 2.0, 1.0],
+        [1.0, np.nan, 1.0]]))
+
+
+@pytest.mark.pureunit
+class TestBacktest:
+
+    def test_buy_and_hold(self):
+        batch = PortfolioBatch([[0, 1], [2, 0]], [[1.0, 1.0], [1.0, 0.0]])
+
+        values = backtest(make_matrix(), batch, 2000, 2002)
+
+        np.testing.assert_allclose(values[0], [1.0, 1.5, 2.25])
+        assert np.isnan(values[1]).all()
+
+    def test_rebalance(self):
+        batch = PortfolioBatch([[0, 1]], [[1.0, 1.0]])
+
+        values = backtest(make_matrix(), batch, 2000, 2002, rebalance=True)
+
+        np.testing.assert_allclose(values[0], [1.0, 1.5, 1.875])
+
+    @pytest.mark.parametrize('from_year,to_year', [
+        (2001, 2001), (1999, 2002), (2000, 2003), (-10 ** 12, 10 ** 12)])
+    def test_invalid_years(self, from_year, to_year):
+        batch = PortfolioBatch([[0]], [[1.0]])
+
+        with pytest.raises(ValueError):
+            backtest(make_matrix(), batch, from_year, to_year)
+
+
+@pytest.mark.database
+class TestBacktestAPI:
+
+    def post(self, app, **body):
+        body = dict({
+            'exchange_symbol': 'AX', 'from_year': 2000, 'to_year': 2001,
+            'portfolios': [{'AAA': 1}]}, **body)
+        response = app.test_client().post(
+            '/stockanalysis/api/backtest', data=json.dumps(body),
+            content_type='application/json')
+
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_backtest(self, db, app):
+        create_exchange('AX', {'AAA': {2000: ['1.0'], 2001: ['1.5']}})
+
+        status_code, result = self.post(app)
+
+        assert status_code == 200
+        assert result['portfolios'] == [{
+            'index': 0, 'final_value': 1.5, 'total_return_percent': 50.0,
+            'values': [1.0, 1.5]}]
+
+    @pytest.mark.parametrize('body', [
+        {'from_year': True},
+        {'to_year': '2001'},
+        {'from_year': 1999},
+        {'to_year': 10 ** 12},
+        {'limit': True},
+        {'rebalance': 1},
+        {'include_values': 'no'},
+        {'portfolios': [{'AAA': float('inf')}]},
+        {'portfolios': [{'AAA': 10 ** 400}]},
+        {'portfolios': [{'AAA': 0}]},
+        {'portfolios': [{'AAA': 1e308, 'AAB': 1e308}]}])
+    def test_invalid_args(self, db, app, body):
+        create_exchange('AX', {
+            'AAA': {2000: ['1.0'], 2001: ['1.5']},
+            'AAB': {2000: ['1.0'], 2001: ['2.0']}})
+
+        status_code, result = self.post(app, **body)
+
+        assert status_code == 400
+        assert 'error' in result
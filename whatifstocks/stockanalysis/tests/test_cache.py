@@ -0,0 +1,90 @@
+"""Tests for the query result cache."""
+import pytest
+
+from whatifstocks.stockanalysis.cache import ResultCache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def result_cache(maxsize=2, ttl=None, clock=None):
+    cache = ResultCache(clock=clock or Clock())
+    cache.maxsize = maxsize
+    cache.ttl = ttl
+    events = []
+    cache.add_listener(events.append)
+
+    return cache, events
+
+
+@pytest.mark.pureunit
+class TestResultCache:
+
+    def test_get_and_set(self):
+        cache, events = result_cache()
+
+        assert cache.get('a') == (False, None)
+        cache.set('a', None)
+        assert cache.get('a') == (True, None)
+        assert events == ['miss', 'hit']
+
+    def test_least_recently_used_is_evicted(self):
+        cache, events = result_cache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('b') == (False, None)
+        assert cache.get('a') == (True, 1)
+        assert cache.get('c') == (True, 3)
+        assert events == ['hit', 'eviction', 'miss', 'hit', 'hit']
+        assert cache.stats() == {
+            'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1,
+            'evictions': 1}
+
+    def test_entries_expire(self):
+        clock = Clock()
+        cache, events = result_cache(ttl=60, clock=clock)
+        cache.set('a', 1)
+        clock.now += 59
+
+        assert cache.get('a') == (True, 1)
+
+        clock.now += 1
+
+        assert cache.get('a') == (False, None)
+        assert events == ['hit', 'eviction', 'miss']
+        assert cache.stats()['size'] == 0
+
+    def test_zero_size_disables_cache(self):
+        cache, events = result_cache(maxsize=0)
+        cache.set('a', 1)
+
+        assert cache.get('a') == (False, None)
+        assert cache.stats()['size'] == 0
+
+    def test_get_or_create(self):
+        cache, events = result_cache()
+        calls = []
+
+        def creator():
+            calls.append(None)
+            return len(calls)
+
+        assert cache.get_or_create('a', creator) == 1
+        assert cache.get_or_create('a', creator) == 1
+        assert len(calls) == 1
+
+    def test_clear(self):
+        cache, events = result_cache()
+        cache.set('a', 1)
+        cache.clear()
+
+        assert cache.get('a') == (False, None)
@@ -0,0 +1,203 @@
+"""Tests for the monthly prices downloader."""
+import pytest
+import requests
+
+from whatifstocks.benchmarks.stubserver import StubAlphaVantageServer
+from whatifstocks.stockanalysis.downloader import (
+    ALPHAVANTAGE_MONTHLY_PRICES_KEY, MonthlyPricesDownloader, TokenBucket)
+
+URL_PATTERN = 'http://stub/query?symbol={0}.{1}&apikey={2}'
+MONTHLY_PRICES = {'2017-12-29': {'5. adjusted close': '1.0'}}
+
+
+class FakeClock(object):
+    """A clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+
+class FakeResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        if isinstance(self.body, Exception):
+            raise self.body
+
+        return self.body
+
+
+class FakeSession(object):
+    """Answers each GET with the next of the given bodies."""
+
+    def __init__(self, bodies):
+        self.bodies = list(bodies)
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        body = self.bodies.pop(0)
+
+        if isinstance(body, requests.RequestException):
+            raise body
+
+        return FakeResponse(body)
+
+
+def make_downloader(session, clock, **kwargs):
+    downloader = MonthlyPricesDownloader(
+        URL_PATTERN, 'KEY', 'AX', session=session, sleep=clock.sleep,
+        **kwargs)
+    downloader.rate_limiter._clock = clock
+
+    return downloader
+
+
+@pytest.mark.pureunit
+class TestTokenBucket:
+
+    def test_disabled_never_waits(self):
+        clock = FakeClock()
+        bucket = TokenBucket(None, clock=clock, sleep=clock.sleep)
+
+        assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+        assert clock.sleeps == []
+
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2.0, capacity=3, clock=clock, sleep=clock.sleep)
+        waits = [bucket.acquire() for _ in range(5)]
+
+        # The first 3 tokens are there at once, then one every 0.5 secs.
+        assert waits[:3] == [0.0, 0.0, 0.0]
+        assert waits[3:] == [pytest.approx(0.5), pytest.approx(0.5)]
+        assert clock.now == pytest.approx(1001.0)
+
+    def test_refills_up_to_capacity_only(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1.0, capacity=2, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        bucket.acquire()
+        clock.now += 100.0
+
+        assert [bucket.acquire() for _ in range(3)] == [
+            0.0, 0.0, pytest.approx(1.0)]
+
+    def test_per_minute(self):
+        assert TokenBucket.per_minute(300).rate == pytest.approx(5.0)
+        assert TokenBucket.per_minute(None).rate is None
+
+
+@pytest.mark.pureunit
+class TestMonthlyPricesDownloader:
+
+    def test_backoff_is_jittered_below_capped_ceiling(self):
+        downloader = make_downloader(
+            FakeSession([]), FakeClock(), backoff_base=1.0, backoff_max=10.0)
+
+        for request_tries, ceiling in ((1, 2.0), (2, 4.0), (3, 8.0),
+                                       (4, 10.0), (10, 10.0)):
+            backoffs = [
+                downloader.backoff_secs(request_tries) for _ in range(200)]
+
+            assert all(0.0 <= b <= ceiling for b in backoffs)
+            # Full jitter spreads retries over the whole range.
+            assert max(backoffs) > ceiling / 2
+
+    def test_fetch_success(self):
+        session = FakeSession([
+            {ALPHAVANTAGE_MONTHLY_PRICES_KEY: MONTHLY_PRICES}])
+        result = make_downloader(session, FakeClock()).fetch('ABC')
+
+        assert result == ('ABC', MONTHLY_PRICES, 1, None)
+        assert session.urls == [URL_PATTERN.format('ABC', 'AX', 'KEY')]
+
+    def test_fetch_retries_throttling_and_failures_with_backoff(self):
+        clock = FakeClock()
+        session = FakeSession([
+            {'Note': 'Thank you for using Alpha Vantage! Please visit '
+                     'https://www.alphavantage.co/premium/ if you would '
+                     'like to have a higher API call volume.'},
+            requests.ConnectionError('connection reset'),
+            ValueError('No JSON object could be decoded'),
+            {ALPHAVANTAGE_MONTHLY_PRICES_KEY: MONTHLY_PRICES}])
+        downloader = make_downloader(
+            session, clock, max_tries=5, backoff_base=1.0, backoff_max=60.0)
+        result = downloader.fetch('ABC')
+
+        assert result == ('ABC', MONTHLY_PRICES, 4, None)
+        # A jittered backoff after each of the 3 failed tries.
+        assert len(clock.sleeps) == 3
+        assert all(
+            0.0 <= secs <= 2.0 ** tries
+            for tries, secs in enumerate(clock.sleeps, 1))
+
+    def test_fetch_gives_up_after_max_tries(self):
+        clock = FakeClock()
+        session = FakeSession(
+            [requests.Timeout('timed out')] * 3)
+        result = make_downloader(session, clock, max_tries=3).fetch('ABC')
+
+        assert result.monthly_prices is None
+        assert result.tries == 3
+        assert 'timed out' in result.error
+        # No backoff after the last try.
+        assert len(clock.sleeps) == 2
+
+    def test_fetch_doesnt_retry_unknown_symbol(self):
+        clock = FakeClock()
+        session = FakeSession([{'Error Message': 'Invalid API call.'}])
+        result = make_downloader(session, clock).fetch('NOPE')
+
+        assert result.monthly_prices is None
+        assert result.tries == 1
+        assert 'Invalid API call' in result.error
+        assert clock.sleeps == []
+
+    def test_requests_are_rate_limited(self):
+        clock = FakeClock()
+        session = FakeSession(
+            [{ALPHAVANTAGE_MONTHLY_PRICES_KEY: MONTHLY_PRICES}] * 4)
+        downloader = make_downloader(
+            session, clock, requests_per_minute=60, burst=1)
+        results = list(downloader.download(['A', 'B', 'C', 'D']))
+
+        assert [r.ticker_symbol for r in results] == ['A', 'B', 'C', 'D']
+        # One request per second, after the first.
+        assert clock.now == pytest.approx(1003.0)
+
+
+def test_download_from_stub_server():
+    """Concurrent downloads from a local stub that fails some requests."""
+    server = StubAlphaVantageServer(
+        error_rate=0.3, unknown_rate=0.2, seed=1).start()
+
+    try:
+        downloader = MonthlyPricesDownloader(
+            server.url_pattern, 'KEY', 'AX', workers=4, max_tries=20,
+            backoff_base=0.001, backoff_max=0.01)
+        tickers = ['T{0}'.format(i) for i in range(20)]
+        results = {r.ticker_symbol: r for r in downloader.download(tickers)}
+    finally:
+        server.stop()
+
+    assert sorted(results) == sorted(tickers)
+
+    for ticker_symbol, result in results.items():
+        if server.is_symbol_unknown('{0}.AX'.format(ticker_symbol)):
+            assert result.monthly_prices is None
+        else:
+            assert result.error is None
+            assert len(result.monthly_prices) == 12 * 20
+
+    assert server.stats()['errors'] > 0
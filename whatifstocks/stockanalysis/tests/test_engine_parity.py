@@ -0,0 +1,120 @@
+"""The SQL and NumPy ranking engines must return the same rankings."""
+from decimal import Decimal
+import itertools
+import random
+
+import pytest
+
+from whatifstocks.stockanalysis.queries import (
+    RankingCursor, yeartoyear_price_percent_change_result)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+np = pytest.importorskip('numpy')
+
+from whatifstocks.stockanalysis.pricematrix import (  # noqa: E402
+    yeartoyear_price_percent_change_matrix_result)
+
+
+def sql_ranking(exch, from_year, to_year, limit=None, cursor=None):
+    return yeartoyear_price_percent_change_result(
+        exch.id, from_year, to_year, limit=limit, cursor=cursor,
+        light=True).all()
+
+
+def numpy_ranking(exch, from_year, to_year, limit=None, cursor=None):
+    return yeartoyear_price_percent_change_matrix_result(
+        exch.id, from_year, to_year, data_version=exch.data_version,
+        limit=limit, cursor=cursor)
+
+
+def ranking_values(rows):
+    """Stock IDs and prices as strings, so that 0.0000 != -0.0000."""
+    return [
+        (row[0].id, str(row[2]), str(row[3]), str(row[4])) for row in rows]
+
+
+@pytest.mark.database
+class TestEngineParity:
+
+    def test_half_way_values_round_away_from_zero(self, db):
+        exch = create_exchange('AX', {
+            # +0.00125% and -0.00125%.
+            'AAA': {2000: ['8.0000'], 2001: ['8.0001']},
+            'AAB': {2000: ['8.0000'], 2001: ['7.9999']},
+            # An average of 1.00015.
+            'AAC': {2000: ['1.0001', '1.0002'], 2001: ['2.0000']},
+            # Ties with AAA.
+            'AAD': {2000: ['8.0000'], 2001: ['8.0001']},
+            # 0% and -0.000001%, which both round to 0.0000.
+            'AAE': {2000: ['3.0000'], 2001: ['3.0000']},
+            'AAF': {2000: ['10000.0000'], 2001: ['9999.9999']},
+            # No positive price in one of the years, so not ranked.
+            'AAG': {2000: ['0.0000'], 2001: ['1.0000']},
+            'AAH': {2000: ['1.0000']}})
+
+        sql_rows = sql_ranking(exch, 2000, 2001)
+        numpy_rows = numpy_ranking(exch, 2000, 2001)
+
+        assert ranking_values(numpy_rows) == ranking_values(sql_rows)
+        assert [row[0].ticker_symbol for row in numpy_rows] == [
+            'AAC', 'AAA', 'AAD', 'AAE', 'AAF', 'AAB']
+        assert numpy_rows[0][2] == Decimal('1.0002')
+        assert [str(row[4]) for row in numpy_rows[1:]] == [
+            '0.0013', '0.0013', '0.0000', '0.0000', '-0.0013']
+
+    def test_random_prices(self, db):
+        rng = random.Random(1)
+        years = range(2000, 2005)
+        prices_by_ticker = {}
+
+        for i in range(120):
+            prices_by_ticker['S{0:03d}'.format(i)] = {
+                year: [
+                    '{0:.4f}'.format(rng.choice((
+                        rng.uniform(0.0001, 2.0), rng.uniform(1.0, 5000.0))))
+                    for _ in range(rng.randint(1, 12))]
+                for year in years if rng.random() < 0.9}
+
+        # Copies of other stocks' prices, so that there are ties.
+        for i in range(20):
+            prices_by_ticker['T{0:03d}'.format(i)] = prices_by_ticker[
+                'S{0:03d}'.format(i)]
+
+        exch = create_exchange('AX', prices_by_ticker)
+
+        for from_year, to_year in itertools.permutations(years, 2):
+            sql_rows = sql_ranking(exch, from_year, to_year)
+
+            assert len(sql_rows) > 50
+            assert ranking_values(
+                numpy_ranking(exch, from_year, to_year)) == (
+                    ranking_values(sql_rows))
+
+    def test_pages(self, db):
+        rng = random.Random(2)
+        exch = create_exchange('AX', {
+            'S{0:03d}'.format(i): {
+                2000: [rng.choice(('1.0000', '2.0000'))],
+                2001: [rng.choice(('1.0000', '1.5000', '3.0000'))]}
+            for i in range(50)})
+        pages = {}
+
+        for engine, ranking in (('sql', sql_ranking),
+                                ('numpy', numpy_ranking)):
+            cursor = None
+            rows = []
+
+            while True:
+                page = ranking(exch, 2000, 2001, limit=7, cursor=cursor)
+                rows.extend(page)
+
+                if len(page) < 7:
+                    break
+
+                cursor = RankingCursor.after_row(page[-1], len(rows))
+
+            pages[engine] = ranking_values(rows)
+
+        assert pages['numpy'] == pages['sql']
+        assert pages['sql'] == ranking_values(sql_ranking(exch, 2000, 2001))
+        assert len(pages['sql']) == 50
@@ -0,0 +1,83 @@
+"""Tests for the CSV exports."""
+import gzip
+import io
+
+import pytest
+import unicodecsv as csv
+
+from whatifstocks.stockanalysis.exports import (iter_csv_chunks,
+                                                iter_gzip_chunks)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+
+def read_csv(data):
+    return list(csv.reader(io.BytesIO(data), encoding='utf-8'))
+
+
+@pytest.mark.pureunit
+class TestChunks:
+
+    def test_csv_chunks(self):
+        rows = [{'a': i, 'b': u'\xe9{0}'.format(i), 'c': 'x'}
+                for i in range(5)]
+
+        chunks = list(iter_csv_chunks(('a', 'b'), rows, rows_per_chunk=2))
+
+        assert len(chunks) == 3
+        assert read_csv(b''.join(chunks)) == [['a', 'b']] + [
+            [str(i), u'\xe9{0}'.format(i)] for i in range(5)]
+
+    def test_gzip_chunks(self):
+        chunks = [b'a,b\r\n', b'', b'1,2\r\n' * 1000]
+
+        data = b''.join(iter_gzip_chunks(iter(chunks)))
+
+        assert gzip.GzipFile(fileobj=io.BytesIO(data)).read() == (
+            b''.join(chunks))
+
+
+@pytest.mark.database
+class TestExports:
+
+    def create_ax_exchange(self):
+        return create_exchange('AX', {
+            'AAB': {2000: [2.0], 2001: [1.0]},
+            'AAA': {2000: [1.0, 3.0], 2001: [4.0]}})
+
+    def test_ranking(self, db, app):
+        self.create_ax_exchange()
+
+        response = app.test_client().get(
+            '/stockanalysis/export/yeartoyear-price-percent-changes.csv'
+            '?exchange_symbol=AX&from_year=2000&to_year=2001')
+
+        assert response.mimetype == 'text/csv'
+        assert response.headers['Content-Disposition'] == (
+            'attachment; filename="AX-2000-2001-price-percent-changes.csv"')
+        assert read_csv(response.data) == [
+            ['rank', 'ticker_symbol', 'title', 'industry_sector',
+             'avg_close_price_from', 'avg_close_price_to',
+             'price_change_percent'],
+            ['1', 'AAA', 'AAA Ltd', 'Widgets', '2.0000', '4.0000',
+             '100.0000'],
+            ['2', 'AAB', 'AAB Ltd', 'Widgets', '2.0000', '1.0000',
+             '-50.0000']]
+
+    def test_gzipped_yearly_prices(self, db, app):
+        self.create_ax_exchange()
+
+        response = app.test_client().get(
+            '/stockanalysis/export/yearly-prices.csv'
+            '?exchange_symbol=AX&gzip=1')
+        data = gzip.GzipFile(fileobj=io.BytesIO(response.data)).read()
+
+        assert response.mimetype == 'application/gzip'
+        assert response.headers['Content-Disposition'] == (
+            'attachment; filename="AX-yearly-prices.csv.gz"')
+        assert read_csv(data) == [
+            ['ticker_symbol', 'year', 'close_at', 'close_price'],
+            ['AAA', '2000', '2000-01-28', '1.0000'],
+            ['AAA', '2000', '2000-02-28', '3.0000'],
+            ['AAA', '2001', '2001-01-28', '4.0000'],
+            ['AAB', '2000', '2000-01-28', '2.0000'],
+            ['AAB', '2001', '2001-01-28', '1.0000']]
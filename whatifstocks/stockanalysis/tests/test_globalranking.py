@@ -0,0 +1,68 @@
+"""Tests for rankings of several exchanges together."""
+import random
+
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.globalranking import iter_global_ranking_rows
+from whatifstocks.stockanalysis.periodreturns import refresh_period_returns
+from whatifstocks.stockanalysis.queries import RankingCursor
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+
+def create_exchanges():
+    rng = random.Random(3)
+    exchanges = []
+
+    for exchange_symbol, ticker_prefix in (('AX', 'A'), ('NZ', 'N')):
+        exchanges.append(create_exchange(exchange_symbol, {
+            '{0}{1:02d}'.format(ticker_prefix, i): {
+                2000: [rng.choice(('1.0000', '2.0000', '4.0000'))],
+                2001: [rng.choice(('1.0000', '2.0000', '3.0000'))]}
+            for i in range(rng.randint(10, 20))}))
+
+    for exch in exchanges:
+        refresh_period_returns(exch.id)
+
+    _db.session.commit()
+
+    return exchanges
+
+
+def ranking_pages(exchanges, page_size, workers):
+    cursor = None
+    rows = []
+
+    while True:
+        page = list(iter_global_ranking_rows(
+            exchanges, 2000, 2001, limit=page_size, cursor=cursor,
+            workers=workers))
+        rows.extend(page)
+
+        if len(page) < page_size:
+            return rows
+
+        cursor = RankingCursor(
+            page[-1]['price_change_percent'], page[-1]['stock_id'],
+            page[-1]['rank'])
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('engine', ('sql', 'numpy', 'precomputed'))
+@pytest.mark.parametrize('workers', (1, 2))
+def test_pages_of_global_ranking(db, app, monkeypatch, engine, workers):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+
+    monkeypatch.setitem(app.config, 'STOCKANALYSIS_RANKING_ENGINE', engine)
+    exchanges = create_exchanges()
+    rows = list(iter_global_ranking_rows(
+        exchanges, 2000, 2001, workers=workers))
+    keys = [(-row['price_change_percent'], row['stock_id']) for row in rows]
+
+    assert set(row['exchange_symbol'] for row in rows) == {'AX', 'NZ'}
+    assert keys == sorted(keys)
+    assert [row['rank'] for row in rows] == list(range(1, len(rows) + 1))
+
+    for page_size in (1, 4, 7):
+        assert ranking_pages(exchanges, page_size, workers) == rows
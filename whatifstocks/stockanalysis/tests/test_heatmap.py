@@ -0,0 +1,100 @@
+"""Tests for the all pairs of years heatmap."""
+import itertools
+import json
+import random
+
+import pytest
+
+from whatifstocks.stockanalysis.queries import (
+    iter_yeartoyear_price_percent_change_rows, yeartoyear_sector_rollups)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+np = pytest.importorskip('numpy')
+
+from whatifstocks.stockanalysis.heatmap import period_heatmap  # noqa: E402
+
+
+def create_random_exchange():
+    rng = random.Random(5)
+    prices_by_ticker = {
+        'A{0:02d}'.format(i): {
+            year: [
+                '{0:.4f}'.format(rng.uniform(0.0001, 50.0))
+                for _ in range(rng.randint(1, 12))]
+            for year in range(2000, 2006) if rng.random() < 0.7}
+        for i in range(40)}
+    # No prices after 2004 but this one's, so the 2005 pairs are small.
+    prices_by_ticker['A00'][2005] = ['1.0000']
+
+    return create_exchange('AX', prices_by_ticker)
+
+
+@pytest.mark.database
+def test_cells_match_rankings(db):
+    exch = create_random_exchange()
+
+    year_pairs = []
+
+    cells = period_heatmap(exch)
+
+    for from_year, to_year in itertools.combinations(range(2000, 2006), 2):
+        rows = list(iter_yeartoyear_price_percent_change_rows(
+            exch.id, from_year, to_year))
+
+        if not rows:
+            continue
+
+        changes = [float(row['price_change_percent']) for row in rows]
+        year_pairs.append((from_year, to_year))
+        cell = cells[len(year_pairs) - 1]
+
+        assert (cell['from_year'], cell['to_year']) == (from_year, to_year)
+        assert cell['num_stocks'] == len(rows)
+        assert (
+            cell['best_stock_id'], cell['best_ticker_symbol'],
+            cell['best_price_change_percent']) == (
+                rows[0]['stock_id'], rows[0]['ticker_symbol'], changes[0])
+        assert cell['median_price_change_percent'] == pytest.approx(
+            np.median(changes), abs=1e-4)
+        assert cell['top_decile_price_change_percent'] == pytest.approx(
+            np.percentile(changes, 90), abs=1e-4)
+
+    assert len(cells) == len(year_pairs)
+
+
+@pytest.mark.database
+def test_median_is_rounded_like_sector_rollups(db):
+    # Changes of 0.0033% and 0.0100%, so the median is 0.00665%.
+    exch = create_exchange('AX', {
+        'AAA': {2000: ['3.0'], 2001: ['3.0001']},
+        'AAB': {2000: ['3.0'], 2001: ['3.0003']}})
+
+    cell, = period_heatmap(exch)
+    rollup, = yeartoyear_sector_rollups(exch, 2000, 2001)
+
+    assert cell['median_price_change_percent'] == 0.0067
+    assert cell['median_price_change_percent'] == float(
+        rollup.median_price_change_percent)
+
+
+@pytest.mark.database
+def test_api(db, app):
+    create_exchange('AX', {
+        'AAA': {2000: [1.0], 2001: [2.0], 2002: [3.0]},
+        'AAB': {2000: [2.0], 2001: [5.0]}})
+    client = app.test_client()
+
+    response = client.get(
+        '/stockanalysis/api/heatmap?exchange_symbol=AX&format=json'
+        '&fields=from_year,to_year,num_stocks,best_ticker_symbol')
+    html_response = client.get(
+        '/stockanalysis/heatmap?exchange_symbol=AX&metric=x')
+
+    assert json.loads(response.data.decode('utf-8')) == [
+        {'from_year': 2000, 'to_year': 2001, 'num_stocks': 2,
+         'best_ticker_symbol': 'AAB'},
+        {'from_year': 2000, 'to_year': 2002, 'num_stocks': 1,
+         'best_ticker_symbol': 'AAA'},
+        {'from_year': 2001, 'to_year': 2002, 'num_stocks': 1,
+         'best_ticker_symbol': 'AAA'}]
+    assert html_response.status_code == 404
@@ -0,0 +1,252 @@
+"""Tests for the monthly prices importers."""
+from decimal import Decimal, ROUND_HALF_UP
+import random
+
+import click
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.commands import (_import_monthly_prices,
+                                                 import_monthly_prices)
+from whatifstocks.stockanalysis.importers import (
+    AGGREGATE_SCALE, PRICE_QUANTUM, bulk_import_monthly_prices, chunk_offsets,
+    fixed_point_average, parallel_import_monthly_prices, parse_fixed_point,
+    upsert_monthly_prices)
+from whatifstocks.stockanalysis.models import (Exchange, ExchangeDirtyYear,
+                                               Stock, StockYearlyPrice)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+MONTHLY_PRICES = [
+    {'ticker_symbol': 'AAA', 'close_at': '2000-01-31', 'close_price': '1.0'},
+    {'ticker_symbol': 'AAA', 'close_at': '2000-02-29', 'close_price': '2.0'},
+    {'ticker_symbol': 'AAA', 'close_at': '2001-01-31', 'close_price': '3.0'},
+    {'ticker_symbol': 'AAB', 'close_at': '2002-01-31', 'close_price': '4.0'},
+    {'ticker_symbol': 'AAB', 'close_at': '2002-02-28', 'close_price': '5.0'},
+    # No such stock, so the import fails here.
+    {'ticker_symbol': 'ZZZ', 'close_at': '2003-01-31', 'close_price': '6.0'}]
+
+
+def random_monthly_prices(seed=0):
+    """Monthly prices grouped by ticker, some of them 0 (no price)."""
+    rng = random.Random(seed)
+    monthly_prices = []
+
+    for ticker_symbol in ('AAA', 'AAB', 'AAC', 'AAD'):
+        for year in range(2000, 2003):
+            for month in sorted(rng.sample(range(1, 13), rng.randint(1, 12))):
+                monthly_prices.append({
+                    'ticker_symbol': ticker_symbol,
+                    'close_at': '{0}-{1:02d}-28'.format(year, month),
+                    'close_price': rng.choice((
+                        '0', '{0:.4f}'.format(rng.uniform(0.0001, 500.0)),
+                        '{0:.1f}'.format(rng.uniform(0.1, 5.0)),
+                        '{0:.6f}'.format(rng.uniform(0.0001, 5.0))))})
+
+    return monthly_prices
+
+
+def yearly_prices():
+    return sorted(
+        _db.session.query(
+            Stock.ticker_symbol, StockYearlyPrice.year,
+            StockYearlyPrice.close_at, StockYearlyPrice.close_price,
+            StockYearlyPrice.close_price_sum,
+            StockYearlyPrice.close_price_count,
+            StockYearlyPrice.close_months)
+        .select_from(StockYearlyPrice)
+        .join(Stock, StockYearlyPrice.stock_id == Stock.id))
+
+
+def dirty_years():
+    return set(year for year, in _db.session.query(ExchangeDirtyYear.year))
+
+
+def price_years():
+    return set(year for year, in _db.session.query(StockYearlyPrice.year))
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('import_monthly_prices', (
+    lambda exch, monthly_prices: bulk_import_monthly_prices(
+        exch, monthly_prices, batch_size=1),
+    _import_monthly_prices))
+def test_committed_years_are_marked_dirty(db, import_monthly_prices):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}})
+
+    with pytest.raises(click.BadParameter):
+        import_monthly_prices(exch, MONTHLY_PRICES)
+
+    _db.session.rollback()
+
+    assert price_years() == {2000, 2001, 2002}
+    assert dirty_years() == price_years()
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('args', (
+    [], ['--bulk', '--batch-size', '1'],
+    ['--workers', '2', '--batch-size', '1']))
+def test_failed_import_command_bumps_data_version(db, app, tmpdir, args):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}})
+    exchange_id, data_version = exch.id, exch.data_version
+    path = str(tmpdir.join('monthly_prices.csv'))
+    write_monthly_prices_csv(path, MONTHLY_PRICES)
+
+    result = CliRunner().invoke(
+        import_monthly_prices,
+        ['--exchange-symbol', 'AX', '--monthly-prices-file', path] + args,
+        obj=ScriptInfo(create_app=lambda info: app))
+    _db.session.rollback()
+
+    assert result.exit_code == 2
+    assert price_years() == {2000, 2001, 2002}
+    assert Exchange.query.get(exchange_id).data_version > data_version
+
+
+@pytest.mark.database
+def test_upsert_marks_years_dirty(db):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}})
+    data_version = exch.data_version
+
+    num_rows, years = upsert_monthly_prices(exch, MONTHLY_PRICES[:-1])
+
+    assert (num_rows, years) == (3, {2000, 2001, 2002})
+    assert dirty_years() == years
+    assert exch.data_version == data_version + 1
+
+
+@pytest.mark.database
+def test_upsert_uses_latest_price_of_month(db):
+    exch = create_exchange('AX', {'AAA': {}})
+
+    upsert_monthly_prices(exch, [
+        {'ticker_symbol': 'AAA', 'close_at': '2000-01-31',
+         'close_price': '1.0'},
+        {'ticker_symbol': 'AAA', 'close_at': '2000-01-14',
+         'close_price': '9.0'},
+        {'ticker_symbol': 'AAA', 'close_at': '2000-02-29',
+         'close_price': '2.0'}])
+
+    yearly_price = StockYearlyPrice.query.one()
+
+    assert yearly_price.close_price == Decimal('1.5')
+    assert yearly_price.close_price_count == 2
+
+
+@pytest.mark.database
+def test_bulk_import_matches_import(db):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}, 'AAC': {}, 'AAD': {}})
+    monthly_prices = random_monthly_prices()
+    _import_monthly_prices(exch, monthly_prices)
+    expected = yearly_prices()
+    StockYearlyPrice.query.delete()
+    _db.session.commit()
+
+    num_rows, years = bulk_import_monthly_prices(
+        exch, monthly_prices, batch_size=5)
+
+    assert (num_rows, years) == (len(expected), {2000, 2001, 2002})
+    assert yearly_prices() == expected
+
+
+@pytest.mark.database
+def test_bulk_import_requires_grouped_tickers(db):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}})
+
+    with pytest.raises(click.BadParameter):
+        bulk_import_monthly_prices(
+            exch, [MONTHLY_PRICES[0], MONTHLY_PRICES[3], MONTHLY_PRICES[1]])
+
+
+def write_monthly_prices_csv(path, monthly_prices):
+    with open(path, 'w') as f:
+        f.write('ticker_symbol,close_at,close_price\n')
+
+        for monthly_price in monthly_prices:
+            f.write('{ticker_symbol},{close_at},{close_price}\n'.format(
+                **monthly_price))
+
+
+@pytest.mark.pureunit
+@pytest.mark.parametrize('price_raw,value', [
+    ('12.3456', 123456), ('12.34565', 123457), ('12.34564', 123456),
+    ('7', 70000), ('0.5', 5000), ('.00005', 1), (' 3.1 ', 31000)])
+def test_parse_fixed_point(price_raw, value):
+    assert parse_fixed_point(price_raw) == value
+
+
+@pytest.mark.pureunit
+@pytest.mark.parametrize('num_chunks', (1, 2, 3, 7, 100))
+def test_chunk_offsets(tmpdir, num_chunks):
+    path = str(tmpdir.join('monthly_prices.csv'))
+    write_monthly_prices_csv(path, random_monthly_prices())
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offsets = chunk_offsets(path, num_chunks)
+    header_end = data.index(b'\n') + 1
+
+    assert 1 <= len(offsets) <= num_chunks
+    assert offsets[0][0] == header_end
+    assert offsets[-1][1] == len(data)
+
+    for (_, end), (start, _) in zip(offsets, offsets[1:]):
+        assert end == start
+        assert data[end - 1:end] == b'\n'
+
+
+@pytest.mark.database
+def test_parallel_import_matches_bulk_import(db, tmpdir):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}, 'AAC': {}, 'AAD': {}})
+    monthly_prices = random_monthly_prices()
+    bulk_import_monthly_prices(exch, monthly_prices)
+    expected = yearly_prices()
+    StockYearlyPrice.query.delete()
+    _db.session.commit()
+    path = str(tmpdir.join('monthly_prices.csv'))
+    write_monthly_prices_csv(path, monthly_prices)
+    progress = []
+
+    num_rows, years = parallel_import_monthly_prices(
+        exch, path, 2, batch_size=5, progress=progress.append)
+
+    assert (num_rows, years) == (len(expected), {2000, 2001, 2002})
+    assert yearly_prices() == expected
+    assert sum(progress) == tmpdir.join('monthly_prices.csv').size()
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('workers', (1, 2))
+def test_committed_batches_bump_data_version(db, tmpdir, workers):
+    exch = create_exchange('AX', {'AAA': {}, 'AAB': {}})
+    data_version = exch.data_version
+    path = str(tmpdir.join('monthly_prices.csv'))
+    write_monthly_prices_csv(path, MONTHLY_PRICES)
+
+    with pytest.raises(click.BadParameter):
+        if workers > 1:
+            parallel_import_monthly_prices(exch, path, workers, batch_size=1)
+        else:
+            bulk_import_monthly_prices(exch, MONTHLY_PRICES, batch_size=1)
+
+    _db.session.rollback()
+
+    assert price_years() == {2000, 2001, 2002}
+    assert Exchange.query.get(exch.id).data_version > data_version
+
+
+@pytest.mark.pureunit
+@pytest.mark.parametrize('prices', [
+    ('1.00005', '1.00005'), ('0.00015', '0.00014', '0.00016'),
+    ('204.404512', '204.404537'), ('3.3333', '3.3333', '3.3334')])
+def test_fixed_point_average_matches_decimal(prices):
+    price_sum = sum(
+        parse_fixed_point(price, scale=AGGREGATE_SCALE) for price in prices)
+    expected = (sum(Decimal(p) for p in prices) / len(prices)).quantize(
+        PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+
+    assert fixed_point_average(
+        price_sum, len(prices), scale=AGGREGATE_SCALE) == expected
@@ -0,0 +1,105 @@
+"""Tests for the multi-period rankings."""
+import itertools
+import json
+import random
+
+import pytest
+
+from whatifstocks.stockanalysis.multiperiod import (iter_multi_period_rows,
+                                                    parse_year_pairs)
+from whatifstocks.stockanalysis.queries import (
+    iter_yeartoyear_price_percent_change_rows)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+RANKING_VALUE_FIELDS = (
+    'rank', 'stock_id', 'ticker_symbol', 'avg_close_price_from',
+    'avg_close_price_to', 'price_change_percent')
+
+
+def random_prices_by_ticker(rng, ticker_prefix, years):
+    return {
+        '{0}{1:02d}'.format(ticker_prefix, i): {
+            year: [
+                '{0:.4f}'.format(rng.uniform(0.0001, 50.0))
+                for _ in range(rng.randint(1, 12))]
+            for year in years if rng.random() < 0.8}
+        for i in range(30)}
+
+
+def ranking_values(rows):
+    return [tuple(str(row[f]) for f in RANKING_VALUE_FIELDS) for row in rows]
+
+
+@pytest.mark.pureunit
+class TestParseYearPairs:
+
+    def test_parse(self):
+        assert parse_year_pairs(' 2000-2010,,2005-2006, 2000-2010 ') == [
+            (2000, 2010), (2005, 2006)]
+
+    @pytest.mark.parametrize('periods_raw', [
+        '', ' , ', '2000', '2000-', '2000-2010-2020', 'x-2010'])
+    def test_invalid(self, periods_raw):
+        with pytest.raises(ValueError):
+            parse_year_pairs(periods_raw)
+
+
+@pytest.mark.database
+class TestMultiPeriodRows:
+
+    def test_matches_single_period_rankings(self, db):
+        rng = random.Random(4)
+        years = range(2000, 2004)
+        exchanges = [
+            create_exchange('AX', random_prices_by_ticker(rng, 'A', years)),
+            create_exchange('NZ', random_prices_by_ticker(rng, 'N', years))]
+        year_pairs = list(itertools.permutations(years, 2))
+
+        rows = list(iter_multi_period_rows(
+            [e.id for e in exchanges], year_pairs, limit=20))
+
+        for exch in exchanges:
+            for from_year, to_year in year_pairs:
+                expected = list(iter_yeartoyear_price_percent_change_rows(
+                    exch.id, from_year, to_year, limit=20))
+
+                assert len(expected) >= 10
+                assert ranking_values(
+                    row for row in rows
+                    if (row['exchange_symbol'], row['from_year'],
+                        row['to_year']) == (
+                            exch.exchange_symbol, from_year, to_year)) == (
+                    ranking_values(expected))
+
+        assert [
+            (row['exchange_symbol'], row['from_year'], row['to_year'],
+             row['rank'])
+            for row in rows] == sorted(
+                (row['exchange_symbol'], row['from_year'], row['to_year'],
+                 row['rank'])
+                for row in rows)
+
+    def test_api(self, db, app):
+        create_exchange('AX', {
+            'AAA': {2000: [1.0], 2001: [2.0], 2002: [3.0]},
+            'AAB': {2000: [2.0], 2001: [5.0], 2002: [1.0]}})
+        client = app.test_client()
+
+        response = client.get(
+            '/stockanalysis/api/multi-period-changes?exchange_symbols=AX'
+            '&periods=2000-2001,2001-2002&format=json'
+            '&fields=from_year,to_year,rank,ticker_symbol')
+        invalid_response = client.get(
+            '/stockanalysis/api/multi-period-changes?exchange_symbols=AX'
+            '&periods=2000')
+
+        assert json.loads(response.data.decode('utf-8')) == [
+            {'from_year': 2000, 'to_year': 2001, 'rank': 1,
+             'ticker_symbol': 'AAB'},
+            {'from_year': 2000, 'to_year': 2001, 'rank': 2,
+             'ticker_symbol': 'AAA'},
+            {'from_year': 2001, 'to_year': 2002, 'rank': 1,
+             'ticker_symbol': 'AAA'},
+            {'from_year': 2001, 'to_year': 2002, 'rank': 2,
+             'ticker_symbol': 'AAB'}]
+        assert invalid_response.status_code == 400
@@ -0,0 +1,72 @@
+"""Tests for the precomputed returns of every pair of years."""
+import random
+
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.importers import (bulk_import_monthly_prices,
+                                                  upsert_monthly_prices)
+from whatifstocks.stockanalysis.models import (ExchangeDirtyYear,
+                                               StockPeriodReturn)
+from whatifstocks.stockanalysis.periodreturns import (
+    can_use_precomputed_returns, refresh_exchanges_period_returns,
+    refresh_period_returns)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+TICKER_SYMBOLS = ('AAA', 'AAB', 'AAC', 'AAD', 'AAE', 'AAF')
+
+
+def random_monthly_prices(rng, years, months):
+    return [
+        {'ticker_symbol': ticker_symbol,
+         'close_at': '{0}-{1:02d}-28'.format(year, month),
+         'close_price': '{0:.4f}'.format(rng.uniform(0.5, 50.0))}
+        for ticker_symbol in TICKER_SYMBOLS
+        for year in years
+        for month in months
+        if rng.random() < 0.8]
+
+
+def period_returns():
+    return sorted(
+        _db.session.query(
+            StockPeriodReturn.exchange_id, StockPeriodReturn.stock_id,
+            StockPeriodReturn.from_year, StockPeriodReturn.to_year,
+            StockPeriodReturn.avg_close_price_from,
+            StockPeriodReturn.avg_close_price_to,
+            StockPeriodReturn.price_change_percent,
+            StockPeriodReturn.rank))
+
+
+@pytest.mark.database
+def test_incremental_refresh_matches_full_refresh(db):
+    rng = random.Random(6)
+    exch = create_exchange('AX', {t: {} for t in TICKER_SYMBOLS})
+    bulk_import_monthly_prices(exch, random_monthly_prices(
+        rng, range(2000, 2004), range(1, 7)))
+    refresh_exchanges_period_returns([exch], full=True)
+
+    assert ExchangeDirtyYear.query.count() == 0
+    assert can_use_precomputed_returns(exch.id, 2001, 2002)
+
+    upsert_monthly_prices(
+        exch, random_monthly_prices(rng, (2002, 2004), range(7, 13)))
+
+    assert can_use_precomputed_returns(exch.id, 2000, 2001)
+    assert not can_use_precomputed_returns(exch.id, 2001, 2002)
+    assert not can_use_precomputed_returns(exch.id, 2003, 2004)
+    assert not can_use_precomputed_returns(exch.id, 2001, 2000)
+
+    refresh_exchanges_period_returns([exch])
+    refreshed = period_returns()
+    refresh_period_returns(exch.id)
+    _db.session.commit()
+
+    assert ExchangeDirtyYear.query.count() == 0
+    assert set(
+        (from_year, to_year)
+        for _, _, from_year, to_year, _, _, _, _ in refreshed) == set(
+            (from_year, to_year)
+            for from_year in range(2000, 2005)
+            for to_year in range(from_year + 1, 2005))
+    assert refreshed == period_returns()
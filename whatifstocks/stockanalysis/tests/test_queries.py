@@ -0,0 +1,61 @@
+"""Tests for the ranking queries."""
+from decimal import Decimal
+import json
+
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.queries import (
+    RankingCursor, yeartoyear_price_percent_change_query)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+
+@pytest.mark.pureunit
+class TestRankingCursor:
+
+    @pytest.mark.parametrize('cursor', [
+        RankingCursor(Decimal('12.3456'), 7, 3),
+        RankingCursor(Decimal('-100.0000'), 1, 250),
+        RankingCursor(Decimal('0E-4'), 12, 1)])
+    def test_round_trip(self, cursor):
+        assert RankingCursor.decode(cursor.encode()) == cursor
+
+    @pytest.mark.parametrize('cursor_raw', [
+        '', '12.5', '12.5_7', '12.5_7_3_1', 'x_7_3', '12.5_x_3', '12.5_7_'])
+    def test_invalid(self, cursor_raw):
+        with pytest.raises(ValueError):
+            RankingCursor.decode(cursor_raw)
+
+
+def plan_index_names(plan):
+    """Names of the indexes scanned anywhere in a JSON query plan."""
+    index_names = set()
+
+    if 'Index Name' in plan:
+        index_names.add(plan['Index Name'])
+
+    for subplan in plan.get('Plans', []):
+        index_names |= plan_index_names(subplan)
+
+    return index_names
+
+
+@pytest.mark.database
+def test_ranking_query_uses_year_index(db):
+    exch = create_exchange('AX', {
+        'A{0:03d}'.format(i): {
+            year: [1.0 + i] for year in range(1990, 2010)}
+        for i in range(50)})
+    query = yeartoyear_price_percent_change_query(exch.id, 2000, 2005)
+    sql = str(query.compile(
+        dialect=_db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+    _db.session.execute('ANALYZE stock_yearly_price')
+    _db.session.execute('SET LOCAL enable_seqscan = off')
+    plan = _db.session.execute('EXPLAIN (FORMAT JSON) ' + sql).scalar()
+
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+
+    assert 'EXTRACT' not in sql.upper()
+    assert '_syp_year_sid_ix' in plan_index_names(plan[0]['Plan'])
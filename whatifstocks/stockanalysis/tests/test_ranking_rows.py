@@ -0,0 +1,51 @@
+"""Cached rankings must be plain rows, usable from any thread."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.periodreturns import refresh_period_returns
+from whatifstocks.stockanalysis.queries import (
+    yeartoyear_price_percent_change_ranking)
+from whatifstocks.stockanalysis.rankingrows import (RankingIndustrySector,
+                                                    RankingRow, RankingStock)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+ENGINES = ('sql', 'numpy', 'precomputed')
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('light', (True, False))
+def test_cached_ranking_rows_are_plain(db, app, monkeypatch, engine, light):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+
+    monkeypatch.setitem(app.config, 'STOCKANALYSIS_RANKING_ENGINE', engine)
+    monkeypatch.setitem(app.config, 'STOCKANALYSIS_LIGHT_ROWS', light)
+    exch = create_exchange('AX', {
+        'AAA': {2000: ['1.0000'], 2001: ['2.0000']},
+        'AAB': {2000: ['1.0000'], 2001: ['3.0000']}})
+    refresh_period_returns(exch.id)
+    _db.session.commit()
+
+    rows = yeartoyear_price_percent_change_ranking(exch, 2000, 2001)
+
+    for row in rows:
+        assert isinstance(row, RankingRow)
+        assert isinstance(row.stock, RankingStock)
+        assert isinstance(row.industry_sector, RankingIndustrySector)
+
+    # The cached rows are still readable once the session that loaded
+    # them is gone, and from another thread.
+    _db.session.remove()
+    cached_rows = yeartoyear_price_percent_change_ranking(exch, 2000, 2001)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        titles = executor.submit(
+            lambda: [
+                (row.stock.ticker_symbol, row.industry_sector.title)
+                for row in cached_rows]).result()
+
+    assert cached_rows is rows
+    assert titles == [('AAB', 'Widgets'), ('AAA', 'Widgets')]
@@ -0,0 +1,73 @@
+"""Tests for the risk metrics of rankings."""
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from whatifstocks.stockanalysis.pricematrix import PriceMatrix  # noqa: E402
+from whatifstocks.stockanalysis.riskmetrics import (  # noqa: E402
+    window_risk_metrics)
+from whatifstocks.stockanalysis.tests.factories import (  # noqa: E402
+    create_exchange)
+
+# One huge span, so that anything sized by it would run out of memory.
+HUGE_YEARS = (-10 ** 12, 10 ** 12)
+
+
+def make_matrix():
+    return PriceMatrix(1, [1, 2], 2000, np.array([
+        [1.0, 2.0, 1.0, 4.0],
+        [1.0, np.nan, 0.0, 1.0]]))
+
+
+@pytest.mark.pureunit
+class TestWindowRiskMetrics:
+
+    def test_metrics(self):
+        cagr, volatility, max_drawdown = window_risk_metrics(
+            make_matrix(), 2000, 2003)
+
+        np.testing.assert_allclose(cagr, [58.7401, 0.0])
+        np.testing.assert_allclose(
+            volatility[:1], [np.std([1.0, -0.5, 3.0], ddof=1) * 100.0],
+            atol=1e-4)
+        # A single yearly return has no volatility.
+        assert np.isnan(volatility[1])
+        np.testing.assert_allclose(max_drawdown, [-50.0, 0.0])
+
+    @pytest.mark.parametrize('from_year,to_year', [
+        (2001, 2001), (1999, 2003), (2000, 2004), HUGE_YEARS])
+    def test_invalid_years_are_nan(self, from_year, to_year):
+        for metric in window_risk_metrics(make_matrix(), from_year, to_year):
+            assert np.isnan(metric).all()
+
+    def test_year_window_rejects_years_outside_matrix(self):
+        matrix = make_matrix()
+
+        np.testing.assert_array_equal(
+            matrix.year_window(2001, 2002), matrix.prices[:, 1:3])
+
+        for from_year, to_year in ((1999, 2001), (2002, 2004), HUGE_YEARS):
+            with pytest.raises(ValueError):
+                matrix.year_window(from_year, to_year)
+
+
+@pytest.mark.database
+def test_api_with_years_outside_prices(db, app):
+    create_exchange('AX', {'AAA': {2000: ['1.0'], 2001: ['1.5']}})
+    client = app.test_client()
+
+    for query_string in (
+            'from_year={0}&to_year={1}&metrics=1'.format(*HUGE_YEARS),
+            'from_year=1999&to_year=2001&sort=cagr_percent',
+            'from_year=2000&to_year=2001&metrics=1'):
+        response = client.get(
+            '/stockanalysis/api/yeartoyear-price-percent-changes?'
+            'exchange_symbol=AX&format=json&' + query_string)
+
+        assert response.status_code == 200
+
+    rows = json.loads(response.data.decode('utf-8'))
+
+    assert [row['cagr_percent'] for row in rows] == [50.0]
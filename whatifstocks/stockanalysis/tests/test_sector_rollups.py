@@ -0,0 +1,65 @@
+"""Tests for the per-sector rollups of rankings."""
+from decimal import Decimal
+import json
+
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.models import IndustrySector, Stock
+from whatifstocks.stockanalysis.periodreturns import refresh_period_returns
+from whatifstocks.stockanalysis.queries import (SectorRollup,
+                                                yeartoyear_sector_rollups)
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+
+def create_ax_exchange():
+    """Widgets up 100%, 50%, 0% and 300%, gadgets down 50% and 75%."""
+    exch = create_exchange('AX', {
+        'AAA': {2000: [1.0], 2001: [2.0]},
+        'AAB': {2000: [2.0], 2001: [3.0]},
+        'AAC': {2000: [4.0], 2001: [4.0]},
+        'AAD': {2000: [1.0], 2001: [4.0]},
+        'GGA': {2000: [2.0], 2001: [1.0]},
+        'GGB': {2000: [4.0], 2001: [1.0]},
+        # No price in 2001, so not ranked.
+        'GGC': {2000: [4.0]}})
+    gadgets = IndustrySector.create(title='Gadgets')
+    (Stock.query
+          .filter(Stock.ticker_symbol.like('GG%'))
+          .update({'industry_sector_id': gadgets.id},
+                  synchronize_session=False))
+    refresh_period_returns(exch.id)
+    _db.session.commit()
+
+    return exch
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('engine', ('sql', 'numpy', 'precomputed'))
+def test_sector_rollups(db, app, monkeypatch, engine):
+    monkeypatch.setitem(app.config, 'STOCKANALYSIS_RANKING_ENGINE', engine)
+    exch = create_ax_exchange()
+
+    rollups = yeartoyear_sector_rollups(exch, 2000, 2001)
+
+    assert [r._replace(industry_sector_id=None) for r in rollups] == [
+        SectorRollup(
+            None, 'Widgets', 4, Decimal('75.0000'), Decimal('112.5000'),
+            Decimal('300.0000'), Decimal('0.0000')),
+        SectorRollup(
+            None, 'Gadgets', 2, Decimal('-62.5000'), Decimal('-62.5000'),
+            Decimal('-50.0000'), Decimal('-75.0000'))]
+
+
+@pytest.mark.database
+def test_sector_rollups_api(db, app):
+    create_ax_exchange()
+
+    response = app.test_client().get(
+        '/stockanalysis/api/sector-rollups?exchange_symbol=AX'
+        '&from_year=2000&to_year=2001&format=json'
+        '&fields=industry_sector,num_stocks')
+
+    assert json.loads(response.data.decode('utf-8')) == [
+        {'industry_sector': 'Widgets', 'num_stocks': 4},
+        {'industry_sector': 'Gadgets', 'num_stocks': 2}]
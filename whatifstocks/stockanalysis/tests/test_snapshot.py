@@ -0,0 +1,37 @@
+"""Tests for the price snapshot files."""
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from whatifstocks.stockanalysis.snapshot import (  # noqa: E402
+    read_snapshot, snapshot_file_id, snapshot_path, write_snapshot)
+
+
+@pytest.mark.pureunit
+class TestSnapshot:
+
+    def test_write_and_read(self, tmpdir):
+        path = snapshot_path(str(tmpdir), 1)
+        prices = np.array([[1.5, np.nan], [2.0, 3.25]])
+        write_snapshot(path, {'exchange_id': 1}, [4, 7], prices)
+
+        meta, stock_ids, read_prices, file_id = read_snapshot(path)
+
+        assert meta == {'exchange_id': 1, 'num_stocks': 2, 'num_years': 2}
+        assert stock_ids.tolist() == [4, 7]
+        np.testing.assert_array_equal(read_prices, prices)
+        assert file_id == snapshot_file_id(path)
+
+    def test_failed_write_leaves_no_files(self, tmpdir, monkeypatch):
+        def rename(src, dst):
+            raise OSError('disk on fire')
+
+        monkeypatch.setattr(os, 'rename', rename)
+
+        with pytest.raises(OSError):
+            write_snapshot(
+                snapshot_path(str(tmpdir), 1), {}, [1], np.ones((1, 1)))
+
+        assert tmpdir.listdir() == []
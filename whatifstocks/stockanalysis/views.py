@@ -1,5 +1,481 @@
 """Views related to stockanalysis."""
-from flask import Blueprint
+from decimal import Decimal
+import json
+import math
 
+from flask import (abort, Blueprint, current_app as app, jsonify,
+                   render_template, request, Response, stream_with_context)
 
-blueprint = Blueprint('stockanalysis', __name__, static_folder='../static')
+from whatifstocks.extensions import result_cache
+from whatifstocks.stockanalysis.exports import (iter_csv_chunks,
+                                                iter_gzip_chunks,
+                                                iter_yearly_price_rows,
+                                                RANKING_CSV_FIELDS,
+                                                YEARLY_PRICE_CSV_FIELDS)
+from whatifstocks.stockanalysis.globalranking import (
+    GLOBAL_RANKING_FIELDS, iter_global_ranking_rows)
+from whatifstocks.stockanalysis.models import Exchange
+from whatifstocks.stockanalysis.multiperiod import (iter_multi_period_rows,
+                                                    MULTI_PERIOD_FIELDS,
+                                                    parse_year_pairs)
+from whatifstocks.stockanalysis.queries import (
+    iter_yeartoyear_price_percent_change_rows, RANKING_SORT_FIELDS,
+    RankingCursor, SectorRollup, yeartoyear_sector_rollups)
+
+
+blueprint = Blueprint(
+    'stockanalysis', __name__, url_prefix='/stockanalysis',
+    static_folder='../static')
+
+RANKING_FIELDS = (
+    'rank', 'stock_id', 'ticker_symbol', 'title', 'industry_sector',
+    'avg_close_price_from', 'avg_close_price_to', 'price_change_percent')
+
+
+def json_error(message, status_code=400):
+    """Abort with a JSON error response."""
+    response = jsonify({'error': message})
+    response.status_code = status_code
+    abort(response)
+
+
+def get_exchange_arg():
+    """Get and validate the exchange_symbol request arg."""
+    exchange_symbol = request.args.get('exchange_symbol')
+
+    if not exchange_symbol:
+        json_error('exchange_symbol is required')
+
+    exch = (Exchange.query
+                    .filter_by(exchange_symbol=exchange_symbol)
+                    .first())
+
+    if not exch:
+        json_error('Exchange "{0}" not found'.format(exchange_symbol), 404)
+
+    return exch
+
+
+def get_exchanges_arg(is_required=True):
+    """Get and validate the comma-separated exchange_symbols request arg.
+
+    Returns a list of exchanges, or of all exchanges if the arg is
+    missing and not required.
+    """
+    exchange_symbols = [
+        s.strip()
+        for s in request.args.get('exchange_symbols', '').split(',')
+        if s.strip()]
+
+    if not exchange_symbols:
+        if is_required:
+            json_error('exchange_symbols is required')
+
+        return Exchange.query.order_by(Exchange.exchange_symbol).all()
+
+    exchanges = (Exchange.query
+                         .filter(Exchange.exchange_symbol.in_(
+                             exchange_symbols))
+                         .order_by(Exchange.exchange_symbol)
+                         .all())
+    unknown_symbols = (
+        set(exchange_symbols) - set(e.exchange_symbol for e in exchanges))
+
+    if unknown_symbols:
+        json_error(
+            'Exchange "{0}" not found'.format(sorted(unknown_symbols)[0]),
+            404)
+
+    return exchanges
+
+
+def get_year_args():
+    """Get and validate the from_year and to_year request args."""
+    years = []
+
+    for arg_name in ('from_year', 'to_year'):
+        try:
+            years.append(int(request.args.get(arg_name, '')))
+        except ValueError:
+            json_error('{0} must be a year'.format(arg_name))
+
+    return years[0], years[1]
+
+
+def get_ranking_args():
+    """Get and validate the exchange and year range request args.
+
+    Returns ``(exch, from_year, to_year)``.
+    """
+    exch = get_exchange_arg()
+    from_year, to_year = get_year_args()
+
+    return exch, from_year, to_year
+
+
+def get_cursor_arg():
+    """Get and validate the cursor request arg (None for the first page)."""
+    cursor_raw = request.args.get('cursor')
+
+    if not cursor_raw:
+        return None
+
+    try:
+        return RankingCursor.decode(cursor_raw)
+    except ValueError as e:
+        json_error(str(e))
+
+
+def get_limit_arg():
+    """Get and validate the limit request arg (None for no limit)."""
+    limit_raw = request.args.get('limit')
+
+    if not limit_raw:
+        return None
+
+    try:
+        limit = int(limit_raw)
+    except ValueError:
+        limit = -1
+
+    if limit < 0:
+        json_error('limit must be a non-negative integer')
+
+    return limit or None
+
+
+def get_fields_arg(all_fields):
+    """Get and validate the comma-separated fields request arg."""
+    fields_raw = request.args.get('fields')
+
+    if not fields_raw:
+        return list(all_fields)
+
+    fields = [f.strip() for f in fields_raw.split(',') if f.strip()]
+    unknown_fields = [f for f in fields if f not in all_fields]
+
+    if unknown_fields:
+        json_error('Unknown fields: {0}'.format(', '.join(unknown_fields)))
+
+    return fields
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+
+    raise TypeError('{0!r} is not JSON serializable'.format(value))
+
+
+def stream_json_rows(rows, fields, output_format):
+    """Stream dict rows as NDJSON lines, or as one JSON array."""
+    def generate():
+        is_first = True
+
+        if output_format == 'json':
+            yield '['
+
+        for row in rows:
+            line = json.dumps(
+                {f: row[f] for f in fields}, default=_json_default)
+
+            if output_format == 'json':
+                yield (is_first and '\n' or ',\n') + line
+            else:
+                yield line + '\n'
+
+            is_first = False
+
+        if output_format == 'json':
+            yield '\n]\n'
+
+    mimetype = (
+        output_format == 'json' and 'application/json'
+        or 'application/x-ndjson')
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def get_format_arg(formats):
+    """Get and validate the format request arg (first format is default)."""
+    output_format = request.args.get('format', formats[0])
+
+    if output_format not in formats:
+        json_error('format must be one of: {0}'.format(', '.join(formats)))
+
+    return output_format
+
+
+def stream_csv(fields, rows, filename):
+    """Stream dict rows as a CSV attachment, gzipped if ``gzip=1``."""
+    chunks = iter_csv_chunks(fields, rows)
+
+    if request.args.get('gzip') == '1':
+        chunks = iter_gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv'
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = (
+        'attachment; filename="{0}"'.format(filename))
+
+    return response
+
+
+@blueprint.route('/cache-stats')
+def cache_stats():
+    """Hit, miss and eviction counters of this worker's result cache."""
+    return jsonify(result_cache.stats())
+
+
+@blueprint.route('/api/yeartoyear-price-percent-changes')
+def api_yeartoyear_price_percent_changes():
+    """Stream percent change in prices between from and to year.
+
+    With ``metrics=1`` or a ``sort`` field, rows also have each stock's
+    CAGR, volatility and max drawdown, and come from the price matrix.
+    """
+    exch, from_year, to_year = get_ranking_args()
+    limit = get_limit_arg()
+    with_metrics = (
+        request.args.get('metrics') == '1' or bool(request.args.get('sort')))
+
+    if with_metrics:
+        # Imported here so that NumPy is only needed for risk metrics.
+        from whatifstocks.stockanalysis.riskmetrics import (
+            iter_risk_metric_ranking_rows, RISK_METRIC_FIELDS)
+
+        sort_fields = [f for f, _ in RANKING_SORT_FIELDS]
+        sort_field = request.args.get('sort', sort_fields[0])
+
+        if sort_field not in sort_fields:
+            json_error('sort must be one of: {0}'.format(
+                ', '.join(sort_fields)))
+
+        fields = get_fields_arg(RANKING_FIELDS + RISK_METRIC_FIELDS)
+    else:
+        fields = get_fields_arg(RANKING_FIELDS)
+
+    output_format = get_format_arg(('ndjson', 'json'))
+    cursor = get_cursor_arg()
+
+    if with_metrics:
+        # The whole ranking is sorted in memory, so pages are cut at the
+        # cursor's rank, whatever the sort.
+        rows = iter_risk_metric_ranking_rows(
+            exch, from_year, to_year, sort_field=sort_field, limit=limit,
+            offset=cursor and cursor.rank or 0,
+            snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+    else:
+        rows = iter_yeartoyear_price_percent_change_rows(
+            exch.id, from_year, to_year, limit=limit, cursor=cursor)
+
+    return stream_json_rows(rows, fields, output_format)
+
+
+@blueprint.route('/api/global-price-percent-changes')
+def api_global_price_percent_changes():
+    """Stream one ranking of the stocks of several (or all) exchanges."""
+    exchanges = get_exchanges_arg(is_required=False)
+    from_year, to_year = get_year_args()
+    limit = get_limit_arg()
+    fields = get_fields_arg(GLOBAL_RANKING_FIELDS)
+    output_format = get_format_arg(('ndjson', 'json'))
+    rows = iter_global_ranking_rows(
+        exchanges, from_year, to_year, limit=limit, cursor=get_cursor_arg(),
+        workers=app.config['STOCKANALYSIS_GLOBAL_RANKING_WORKERS'])
+
+    return stream_json_rows(rows, fields, output_format)
+
+
+@blueprint.route('/api/multi-period-changes')
+def api_multi_period_changes():
+    """Stream rankings for many exchanges and pairs of years at once."""
+    exchanges = get_exchanges_arg()
+
+    try:
+        year_pairs = parse_year_pairs(request.args.get('periods', ''))
+    except ValueError as e:
+        json_error(str(e))
+
+    max_periods = app.config['STOCKANALYSIS_MAX_PERIODS']
+
+    if len(year_pairs) > max_periods:
+        json_error('At most {0} periods are allowed'.format(max_periods))
+
+    limit = get_limit_arg()
+    fields = get_fields_arg(MULTI_PERIOD_FIELDS)
+    output_format = get_format_arg(('ndjson', 'json'))
+    rows = iter_multi_period_rows(
+        [e.id for e in exchanges], year_pairs, limit=limit)
+
+    return stream_json_rows(rows, fields, output_format)
+
+
+@blueprint.route('/api/backtest', methods=['POST'])
+def api_backtest():
+    """Backtest a batch of weighted portfolios of an exchange's stocks.
+
+    Takes a JSON body with ``exchange_symbol``, ``from_year``,
+    ``to_year``, ``portfolios`` (a list of ``{ticker_symbol: weight}``
+    objects) and optionally ``rebalance``, ``limit`` and
+    ``include_values``.
+    """
+    # Imported here so that NumPy is only needed for backtests.
+    from whatifstocks.stockanalysis.backtest import backtest_portfolios
+
+    body = request.get_json(silent=True)
+
+    if not isinstance(body, dict):
+        json_error('A JSON object body is required')
+
+    exch = (Exchange.query
+                    .filter_by(exchange_symbol=body.get('exchange_symbol'))
+                    .first())
+
+    if not exch:
+        json_error('Exchange "{0}" not found'.format(
+            body.get('exchange_symbol')), 404)
+
+    for arg_name in ('from_year', 'to_year'):
+        year = body.get(arg_name)
+
+        if isinstance(year, bool) or not isinstance(year, int):
+            json_error('{0} must be a year'.format(arg_name))
+
+    limit = body.get('limit')
+
+    if limit is not None and (
+            isinstance(limit, bool) or
+            not (isinstance(limit, int) and limit >= 0)):
+        json_error('limit must be a non-negative integer')
+
+    for arg_name in ('rebalance', 'include_values'):
+        if not isinstance(body.get(arg_name, False), bool):
+            json_error('{0} must be true or false'.format(arg_name))
+
+    portfolios = body.get('portfolios')
+    max_portfolios = app.config['STOCKANALYSIS_MAX_BACKTEST_PORTFOLIOS']
+
+    if isinstance(portfolios, list) and len(portfolios) > max_portfolios:
+        json_error('At most {0} portfolios are allowed'.format(
+            max_portfolios))
+
+    try:
+        result = backtest_portfolios(
+            exch, body['from_year'], body['to_year'], portfolios,
+            rebalance=body.get('rebalance', False), limit=limit,
+            include_values=body.get('include_values', True),
+            snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+    except ValueError as e:
+        json_error(str(e))
+
+    return jsonify(result)
+
+
+HEATMAP_METRIC_TITLES = {
+    'median_price_change_percent': 'Median change',
+    'top_decile_price_change_percent': 'Top decile cutoff',
+    'best_price_change_percent': 'Best stock'}
+
+
+def _heatmap_color(price_change_percent, max_log_change):
+    """Cell color: green for gains, red for losses, on a log scale."""
+    strength = (
+        max_log_change and
+        math.log1p(abs(price_change_percent) / 100.0) / max_log_change)
+    alpha = 0.1 + 0.8 * strength
+
+    if price_change_percent >= 0.0:
+        return 'rgba(60, 118, 61, {0:.2f})'.format(alpha)
+
+    return 'rgba(169, 68, 66, {0:.2f})'.format(alpha)
+
+
+@blueprint.route('/heatmap')
+def heatmap():
+    """Heatmap of a stat of the changes for every pair of years."""
+    # Imported here so that NumPy is only needed for heatmaps.
+    from whatifstocks.stockanalysis.heatmap import (HEATMAP_METRICS,
+                                                    period_heatmap)
+
+    exch = (Exchange.query
+                    .filter_by(exchange_symbol=request.args.get(
+                        'exchange_symbol'))
+                    .first())
+    metric = request.args.get('metric', HEATMAP_METRICS[0])
+
+    if not exch or metric not in HEATMAP_METRICS:
+        abort(404)
+
+    cells = period_heatmap(
+        exch, snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+    cells_by_years = {(c['from_year'], c['to_year']): c for c in cells}
+    from_years = sorted(set(c['from_year'] for c in cells))
+    to_years = sorted(set(c['to_year'] for c in cells))
+    max_log_change = max(
+        [math.log1p(abs(c[metric]) / 100.0) for c in cells] or [0.0])
+    rows = [
+        (from_year, [
+            (to_year, cells_by_years.get((from_year, to_year)))
+            for to_year in to_years])
+        for from_year in from_years]
+
+    return render_template(
+        'stockanalysis/heatmap.html', exchange=exch, metric=metric,
+        metric_titles=HEATMAP_METRIC_TITLES, metrics=HEATMAP_METRICS,
+        to_years=to_years, rows=rows,
+        color=lambda value: _heatmap_color(value, max_log_change))
+
+
+@blueprint.route('/api/heatmap')
+def api_heatmap():
+    """Stats of the changes for every pair of years, at once."""
+    # Imported here so that NumPy is only needed for heatmaps.
+    from whatifstocks.stockanalysis.heatmap import (HEATMAP_FIELDS,
+                                                    period_heatmap)
+
+    exch = get_exchange_arg()
+    fields = get_fields_arg(HEATMAP_FIELDS)
+    output_format = get_format_arg(('ndjson', 'json'))
+    cells = period_heatmap(
+        exch, snapshot_dir=app.config['STOCKANALYSIS_SNAPSHOT_DIR'])
+
+    return stream_json_rows(cells, fields, output_format)
+
+
+@blueprint.route('/api/sector-rollups')
+def api_sector_rollups():
+    """Per-sector stats of percent change between from and to year."""
+    exch, from_year, to_year = get_ranking_args()
+    fields = get_fields_arg(SectorRollup._fields)
+    output_format = get_format_arg(('ndjson', 'json'))
+    rows = (
+        r._asdict()
+        for r in yeartoyear_sector_rollups(exch, from_year, to_year))
+
+    return stream_json_rows(rows, fields, output_format)
+
+
+@blueprint.route('/export/yeartoyear-price-percent-changes.csv')
+def export_yeartoyear_price_percent_changes():
+    """Export the whole ranking for an exchange and year range as CSV."""
+    exch, from_year, to_year = get_ranking_args()
+    rows = iter_yeartoyear_price_percent_change_rows(
+        exch.id, from_year, to_year)
+    filename = '{0}-{1}-{2}-price-percent-changes.csv'.format(
+        exch.exchange_symbol, from_year, to_year)
+
+    return stream_csv(RANKING_CSV_FIELDS, rows, filename)
+
+
+@blueprint.route('/export/yearly-prices.csv')
+def export_yearly_prices():
+    """Export all yearly prices for an exchange as CSV."""
+    exch = get_exchange_arg()
+    rows = iter_yearly_price_rows(exch.id)
+    filename = '{0}-yearly-prices.csv'.format(exch.exchange_symbol)
+
+    return stream_csv(YEARLY_PRICE_CSV_FIELDS, rows, filename)
@@ -0,0 +1,183 @@
+"""Tests for the benchmark suite, its synthetic data and stub server."""
+import itertools
+import json
+
+import pytest
+
+from whatifstocks.benchmarks.datagen import SyntheticMarket
+from whatifstocks.benchmarks.downloads import (bench_download,
+                                               download_scenarios,
+                                               ticker_symbols)
+from whatifstocks.benchmarks.stubserver import StubAlphaVantageServer
+from whatifstocks.benchmarks.suite import compare_results
+from whatifstocks.stockanalysis.downloader import (
+    ALPHAVANTAGE_ERROR_KEY, ALPHAVANTAGE_MONTHLY_PRICES_KEY)
+from whatifstocks.stockanalysis.models import (Exchange, IndustrySector,
+                                               Stock, StockYearlyPrice)
+
+
+def small_market(**kwargs):
+    return SyntheticMarket(
+        num_exchanges=2, stocks_per_exchange=5, num_years=3, num_sectors=2,
+        **kwargs)
+
+
+@pytest.mark.pureunit
+class TestSyntheticMarket:
+
+    def test_is_deterministic(self):
+        market, same_market, other_market = (
+            small_market(seed=1), small_market(seed=1), small_market(seed=2))
+
+        assert list(market.company_rows(1)) == list(
+            same_market.company_rows(1))
+        assert list(market.monthly_price_rows(1)) == list(
+            same_market.monthly_price_rows(1))
+        assert list(market.monthly_price_rows(1)) != list(
+            other_market.monthly_price_rows(1))
+        assert list(market.monthly_price_rows(0)) != list(
+            market.monthly_price_rows(1))
+
+    def test_monthly_prices_are_grouped_and_in_date_order(self):
+        market = small_market()
+        rows = list(market.monthly_price_rows(0))
+        ticker_symbols = [
+            ticker_symbol for ticker_symbol, _ in itertools.groupby(
+                rows, key=lambda row: row['ticker_symbol'])]
+
+        assert ticker_symbols == [
+            row['ticker_symbol'] for row in market.company_rows(0)]
+
+        for _, stock_rows in itertools.groupby(
+                rows, key=lambda row: row['ticker_symbol']):
+            close_ats = [row['close_at'] for row in stock_rows]
+
+            assert close_ats == sorted(close_ats)
+            assert close_ats[-1] == '{0}-12-28'.format(market.last_year)
+
+
+@pytest.mark.pureunit
+def test_compare_results():
+    old = {'results': [
+        {'name': 'ranking', 'num_stocks': 100, 'median': 2.0},
+        {'name': 'ranking', 'num_stocks': 1000, 'median': 10.0},
+        {'name': 'removed', 'num_stocks': 100, 'median': 1.0}]}
+    new = {'results': [
+        {'name': 'ranking', 'num_stocks': 100, 'median': 1.0},
+        {'name': 'ranking', 'num_stocks': 1000, 'median': 15.0},
+        {'name': 'added', 'num_stocks': 100, 'median': 1.0}]}
+
+    assert compare_results(old, new) == [
+        ('ranking', 100, 2.0, 1.0, 0.5),
+        ('ranking', 1000, 10.0, 15.0, 1.5)]
+
+
+@pytest.mark.database
+def test_create_and_delete_in_db(db):
+    market = small_market()
+    other_market = small_market(symbol_prefix='OTHER')
+    other_market.create_in_db(with_prices=False)
+
+    exchanges = market.create_in_db()
+
+    assert [e.exchange_symbol for e in exchanges] == ['BENCH0', 'BENCH1']
+    assert Stock.query.count() == 20
+    assert StockYearlyPrice.query.count() > 0
+    assert all(e.data_version > 0 for e in exchanges)
+
+    market.delete_from_db()
+
+    assert [e.exchange_symbol for e in Exchange.query] == [
+        'OTHER0', 'OTHER1']
+    assert Stock.query.count() == 10
+    assert StockYearlyPrice.query.count() == 0
+    assert IndustrySector.query.count() == 2
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def stub_query(symbol, apikey='KEY'):
+    return {
+        'function': ['TIME_SERIES_MONTHLY_ADJUSTED'],
+        'symbol': [symbol], 'apikey': [apikey]}
+
+
+@pytest.mark.pureunit
+class TestStubAlphaVantageServer:
+
+    def test_quota_per_apikey(self):
+        clock = Clock()
+        server = StubAlphaVantageServer(
+            requests_per_minute=2, first_year=2016, last_year=2017,
+            clock=clock)
+
+        try:
+            outcomes = [server.respond(stub_query('A.AX'))[0]]
+            clock.now += 30.0
+            outcomes.extend(
+                server.respond(stub_query('A.AX'))[0] for _ in range(2))
+            outcomes.append(server.respond(stub_query('A.AX', 'KEY2'))[0])
+            clock.now += 30.0
+            outcomes.append(server.respond(stub_query('A.AX'))[0])
+            _, (status, _, body) = server.respond(stub_query('A.AX'))
+        finally:
+            server.server_close()
+
+        assert outcomes == ['ok', 'ok', 'throttled', 'ok', 'ok']
+        assert status == 200
+        assert 'Note' in json.loads(body)
+        assert server.stats() == {'requests': 6, 'ok': 4, 'throttled': 2}
+
+    def test_responses(self):
+        server = StubAlphaVantageServer(
+            first_year=2016, last_year=2017, unknown_rate=0.5)
+
+        try:
+            symbols = ['T{0}.AX'.format(i) for i in range(20)]
+            responses = [server.respond(stub_query(s))[1] for s in symbols]
+            _, (_, _, invalid_body) = server.respond(
+                {'function': ['TIME_SERIES_DAILY'], 'symbol': ['A.AX']})
+        finally:
+            server.server_close()
+
+        assert ALPHAVANTAGE_ERROR_KEY in json.loads(invalid_body)
+
+        for symbol, (_, _, body) in zip(symbols, responses):
+            body = json.loads(body)
+
+            if server.is_symbol_unknown(symbol):
+                assert ALPHAVANTAGE_ERROR_KEY in body
+            else:
+                assert len(body[ALPHAVANTAGE_MONTHLY_PRICES_KEY]) == 24
+
+        assert 0 < server.stats()['unknown'] < 20
+
+
+def test_bench_download():
+    server = StubAlphaVantageServer(
+        error_rate=0.2, first_year=2016, last_year=2017, seed=2).start()
+    scenarios = download_scenarios((1, 4), (None,), (1,))
+
+    try:
+        results = [
+            bench_download(
+                server.url_pattern, 'KEY', 'AX', ticker_symbols(10),
+                scenario, max_tries=20, backoff_base=0.001,
+                backoff_max=0.01, server=server)
+            for scenario in scenarios]
+    finally:
+        server.stop()
+
+    assert [r['workers'] for r in results] == [1, 4]
+
+    for result in results:
+        assert (result['num_ok'], result['num_failed']) == (10, 0)
+        assert result['num_requests'] == result['server']['requests']
+        assert result['num_retries'] == result['server']['errors']
@@ -0,0 +1,52 @@
+"""Tests for the Prometheus metrics."""
+import pytest
+from prometheus_client import REGISTRY
+
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+
+def sample_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.database
+def test_request_metrics(db, app):
+    create_exchange('AX', {'AAA': {2000: [1.0], 2001: [2.0]}})
+    client = app.test_client()
+    labels = {'endpoint': 'public.home'}
+    num_requests = sample_value(
+        'whatifstocks_request_duration_seconds_count', method='GET',
+        status='200', **labels)
+    num_sql_statements = sample_value(
+        'whatifstocks_request_sql_statements_sum', **labels)
+    num_renders = sample_value(
+        'whatifstocks_template_render_seconds_count',
+        template='public/home.html')
+
+    for _ in range(2):
+        response = client.get(
+            '/?exchange_symbol=AX&from_year=2000&to_year=2001&limit=10')
+        assert response.status_code == 200
+
+    assert sample_value(
+        'whatifstocks_request_duration_seconds_count', method='GET',
+        status='200', **labels) == num_requests + 2
+    assert sample_value(
+        'whatifstocks_request_sql_statements_sum',
+        **labels) > num_sql_statements
+    assert sample_value(
+        'whatifstocks_template_render_seconds_count',
+        template='public/home.html') == num_renders + 2
+
+
+@pytest.mark.database
+def test_metrics_view(db, app):
+    app.test_client().get('/')
+
+    response = app.test_client().get(app.config['METRICS_PATH'])
+    text = response.data.decode('utf-8')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'whatifstocks_request_duration_seconds_bucket{' in text
+    assert 'whatifstocks_sql_statements_total ' in text
@@ -0,0 +1,145 @@
+"""Tests for the public pages."""
+from datetime import timedelta
+import re
+
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+import pytest
+from werkzeug.http import http_date
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.stockanalysis.commands import import_monthly_prices
+from whatifstocks.stockanalysis.periodreturns import refresh_period_returns
+from whatifstocks.stockanalysis.tests.factories import create_exchange
+
+HOME_URL = '/?exchange_symbol=AX&from_year=2000&to_year=2001'
+
+
+def create_ax_exchange():
+    return create_exchange('AX', {
+        'AAA': {2000: [1.0], 2001: [2.0]},
+        'AAB': {2000: [2.0], 2001: [1.0]}})
+
+
+@pytest.mark.database
+class TestHomeCaching:
+
+    def test_if_none_match(self, db, app):
+        create_ax_exchange()
+        client = app.test_client()
+
+        response = client.get(HOME_URL)
+        etag = response.headers['ETag']
+        not_modified = client.get(
+            HOME_URL, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert b'AAA' in response.data
+        assert not_modified.status_code == 304
+        assert not_modified.data == b''
+        assert not_modified.headers['ETag'] == etag
+
+    def test_etag_depends_on_args(self, db, app):
+        create_ax_exchange()
+        client = app.test_client()
+
+        etag = client.get(HOME_URL).headers['ETag']
+        response = client.get(
+            HOME_URL + '&limit=1', headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_etag_changes_with_data(self, db, app):
+        exch = create_ax_exchange()
+        client = app.test_client()
+
+        etag = client.get(HOME_URL).headers['ETag']
+        exch.bump_data_version()
+        response = client.get(HOME_URL, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_etag_changes_with_failed_import(self, db, app, tmpdir):
+        create_exchange('AX', {
+            'AAA': {2000: [1.0], 2001: [2.0]}, 'AAB': {}})
+        client = app.test_client()
+        etag = client.get(HOME_URL).headers['ETag']
+        path = tmpdir.join('monthly_prices.csv')
+        path.write(
+            'ticker_symbol,close_at,close_price\n'
+            'AAB,2000-01-31,1.0\n'
+            'AAB,2001-01-31,3.0\n'
+            'ZZZ,2001-01-31,1.0\n')
+
+        result = CliRunner().invoke(
+            import_monthly_prices,
+            ['--exchange-symbol', 'AX', '--monthly-prices-file', str(path)],
+            obj=ScriptInfo(create_app=lambda info: app))
+        response = client.get(HOME_URL, headers={'If-None-Match': etag})
+
+        assert result.exit_code == 2
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert b'AAB' in response.data
+
+    def test_if_modified_since(self, db, app):
+        exch = create_ax_exchange()
+        client = app.test_client()
+
+        not_modified = client.get(HOME_URL, headers={
+            'If-Modified-Since': http_date(exch.data_updated_at)})
+        modified = client.get(HOME_URL, headers={
+            'If-Modified-Since': http_date(
+                exch.data_updated_at - timedelta(seconds=1))})
+
+        assert not_modified.status_code == 304
+        assert modified.status_code == 200
+
+
+@pytest.mark.database
+def test_home_next_page_links(db, app):
+    create_exchange('AX', {
+        ticker_symbol: {2000: [1.0], 2001: [change]}
+        for ticker_symbol, change in (
+            ('AAA', 2.0), ('AAB', 3.0), ('AAC', 2.0), ('AAD', 0.5),
+            ('AAE', 2.0))})
+    client = app.test_client()
+    url = HOME_URL + '&limit=2'
+    pages = []
+
+    while url:
+        html = client.get(url).data.decode('utf-8')
+        pages.append(re.findall(r'<td>(AA[A-E])</td>', html))
+        next_urls = re.findall(r'<li class="next"><a href="([^"]+)"', html)
+        url = next_urls and next_urls[0].replace('&amp;', '&')
+
+    assert pages == [['AAB', 'AAA'], ['AAC', 'AAE'], ['AAD']]
+
+
+@pytest.mark.database
+@pytest.mark.parametrize('engine', ('sql', 'numpy', 'precomputed'))
+@pytest.mark.parametrize('light', (False, True))
+def test_streamed_home_matches_rendered_home(
+        db, app, monkeypatch, engine, light):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+
+    monkeypatch.setitem(app.config, 'STOCKANALYSIS_RANKING_ENGINE', engine)
+    monkeypatch.setitem(app.config, 'STOCKANALYSIS_LIGHT_ROWS', light)
+    exch = create_exchange('AX', {
+        'AA{0}'.format(chr(ord('A') + i)): {2000: [1.0], 2001: [i % 3 + 1.0]}
+        for i in range(5)})
+    refresh_period_returns(exch.id)
+    _db.session.commit()
+    client = app.test_client()
+    url = HOME_URL + '&limit=0'
+
+    streamed = client.get(url).data.decode('utf-8')
+    monkeypatch.setitem(app.config, 'PUBLIC_HOME_STREAM_ALL', False)
+    rendered = client.get(url).data.decode('utf-8')
+
+    assert streamed == rendered
+    assert re.findall(r'<td>\d+</td>\s*<td>(AA[A-E])</td>', streamed) == [
+        'AAC', 'AAB', 'AAE', 'AAA', 'AAD']
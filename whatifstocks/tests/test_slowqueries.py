@@ -0,0 +1,44 @@
+"""Tests for the slow-query log."""
+import pytest
+
+from whatifstocks.extensions import db as _db
+from whatifstocks.slowqueries import SlowQueryLog
+
+
+def explain(statement, parameters=None):
+    """EXPLAIN a statement in the session's transaction."""
+    connection = _db.session.connection().connection
+    cursor = connection.cursor()
+
+    try:
+        return SlowQueryLog().explain(cursor, statement, parameters)
+    finally:
+        cursor.close()
+
+
+@pytest.mark.database
+class TestExplain:
+
+    def test_plan(self, db):
+        plan = explain('SELECT %(x)s + 1', {'x': 1})
+
+        assert plan[0]['Plan']['Node Type'] == 'Result'
+
+    def test_error_leaves_transaction_usable(self, db):
+        _db.session.execute('CREATE TEMPORARY TABLE t (x integer)')
+        _db.session.execute('INSERT INTO t VALUES (1)')
+
+        plan = explain('SELECT 1 / 0')
+
+        assert 'division by zero' in plan['error']
+        assert _db.session.execute('SELECT x FROM t').fetchall() == [(1,)]
+
+    def test_statement_is_rolled_back(self, db):
+        _db.session.execute('CREATE TEMPORARY TABLE t (x integer)')
+        _db.session.execute(
+            'CREATE FUNCTION pg_temp.add_row() RETURNS integer AS '
+            "'INSERT INTO t VALUES (2) RETURNING x' LANGUAGE sql")
+
+        explain('SELECT pg_temp.add_row()')
+
+        assert _db.session.execute('SELECT x FROM t').fetchall() == []
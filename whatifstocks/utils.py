@@ -1,9 +1,13 @@
 """Helper utilities and decorators."""
-from flask import current_app as app
+from flask import (before_render_template, current_app as app,
+                   template_rendered)
 from flask_mail import Message
 
 from whatifstocks.extensions import mail, mailgun
 
+# Template output events joined into each chunk when streaming a template.
+STREAM_TEMPLATE_BUFFER_SIZE = 100
+
 
 def send_mail(
         sender=None, recipients=None, subject=None, body=None,
@@ -39,3 +43,28 @@ def send_mail(
         msg.body = body
 
         mail.send(msg)
+
+
+def stream_template(template_name, **context):
+    """Render a template as an iterator of chunks, for a streamed response.
+
+    Like ``render_template``, but the template is rendered as the
+    response is sent, and ``template_rendered`` is sent once it's done.
+    Wrap it in ``stream_with_context``.
+    """
+    app_obj = app._get_current_object()
+    app_obj.update_template_context(context)
+    template = app_obj.jinja_env.get_template(template_name)
+
+    def generate():
+        before_render_template.send(
+            app_obj, template=template, context=context)
+        stream = template.stream(context)
+        stream.enable_buffering(STREAM_TEMPLATE_BUFFER_SIZE)
+
+        for chunk in stream:
+            yield chunk
+
+        template_rendered.send(app_obj, template=template, context=context)
+
+    return generate()